@@ -1,636 +1,256 @@
 # pyright: reportUndefinedVariable=false
 
-import os
-import re
-import base64
-import html as _html
-import hashlib
+import time
+from contextlib import closing
 import streamlit as st
-from dotenv import load_dotenv
-import google.generativeai as genai
-
-if "img_value" not in st.session_state:
-    st.session_state.img_value = None
+from pipeline import (
+    ALL_LANGS,
+    _rewrite_links,
+    build_prompt,
+    build_revision_prompt,
+    build_site_zip,
+    build_stack_rules,
+    cache_lookup,
+    check_stack_applicability,
+    generate_html,
+    generation_cache_key,
+    optimize_site,
+    render_generated_page,
+    split_html_assets,
+)
+from backends import ModelBackend
+from compaction import compact, restore
+from gen_cache import GenerationCache
+from metrics import REGISTRY, Trace, note, serve_metrics, span
+from resilience import ModelCallError, ModelTimeout
+from asset_store import AssetStore
+from variants import iter_variants, thumbnail_html, variant_configs
+from section_gen import generate_sectioned
+from sections import build_section_revision_prompt, index_sections, select_sections, splice_sections
+from streaming import IncrementalHtmlSanitizer
+from preview import DEVICE_WIDTHS, preview_frame
+from prompt_index import PromptIndex, prompt_context
+from history import VersionHistory
+from jobs import JobCancelled, JobManager
+from themes import detect_visual_intent
+from webperf import format_report, optimize_page
+from settings import (
+    Settings,
+    init_session,
+    load_settings,
+    make_asset_store,
+    make_backend,
+    make_generation_cache,
+    make_history,
+    make_job_manager,
+    make_prompt_index,
+)
 
 
 # ------------------ 0) Setup ------------------
-load_dotenv()
-API_KEY = os.getenv("GEMINI_API_KEY", "")
-if API_KEY:
-    genai.configure(api_key=API_KEY)
+@st.cache_resource
+def get_settings() -> Settings:
+    """.env and GENWEBLY_* variables, read once per process rather than on every rerun."""
+    return load_settings()
+
+
+SETTINGS = get_settings()
 
 st.set_page_config(page_title="AI UI Designer", page_icon="🎨", layout="wide")
 st.title("GenWebly")
 st.caption("Prompt it. Build it.")
 
-# Session state
-init_vals = {
-    "html": "",
-    "raw_html": "",
-    "regen_notes": "",
-    "last_img_mode": None,
-    "last_img_value": "",
-    "last_prompt": "",
-    "stack_langs": [],
-    "show_learn": False,
-    "stack_js_mode": "Static",
-    "stack_js_use": "",
-    "stack_choice": "— choose —",
-    "stack_prev_choice": "— choose —",
-    "render_tick": 0,
-
-}
-for k, v in init_vals.items():
-    if k not in st.session_state:
-        st.session_state[k] = v
-if "render_tick" not in st.session_state:
-    st.session_state["render_tick"] = 0
-
-
-# ------------------ 1) Theme helpers ------------------
-def theme_palette(prompt_text: str) -> dict:
-    p = (prompt_text or "").lower()
-
-    def pal(bg, bg2, text, muted, primary, accent, border):
-        return {
-            "bg": bg,
-            "bg2": bg2,
-            "text": text,
-            "muted": muted,
-            "primary": primary,
-            "accent": accent,
-            "border": border,
-        }
-
-    if any(k in p for k in ["wedding", "love", "invite", "bride", "groom"]):
-        return pal("#fff7fb", "#fdeef4", "#2d1f24", "#7a6a70", "#d9c06d", "#f4b6c2", "#ead9b0")
-    if any(k in p for k in ["tech", "ai", "cyber", "startup", "saas"]):
-        return pal("#0b0f1a", "#141a2a", "#e6f0ff", "#9db2ce", "#7b2ff7", "#00f0ff", "#27304a")
-    if any(k in p for k in ["coffee", "cafe", "bakery", "espresso"]):
-        return pal("#fff8f0", "#f3e5d8", "#2b211a", "#7a5c49", "#b36a3c", "#d2a679", "#e2c8ad")
-    if any(k in p for k in ["fashion", "style", "boutique"]):
-        return pal("#fffafc", "#fde8f2", "#1f1a1d", "#846877", "#f472b6", "#facc15", "#eed4e1")
-    if any(k in p for k in ["portfolio", "resume", "personal"]):
-        return pal("#f6f7fb", "#e9edfb", "#0f172a", "#4b5563", "#6366f1", "#22d3ee", "#c7d2fe")
-    if any(k in p for k in ["travel", "beach", "adventure", "tour"]):
-        return pal("#f1fbff", "#e6faff", "#0b2a3a", "#4b6b7a", "#38bdf8", "#fbbf24", "#cfe9f6")
-    return pal("#faf6ff", "#e7f1ff", "#0f172a", "#64748b", "#8b5cf6", "#22d3ee", "#dbeafe")
-
-
-def build_theme_css(p: dict) -> str:
-    return f"""
-<style>
-:root {{
-  --bg: {p['bg']};
-  --bg2: {p['bg2']};
-  --text: {p['text']};
-  --muted: {p['muted']};
-  --primary: {p['primary']};
-  --accent: {p['accent']};
-  --border: {p['border']};
-}}
-html, body {{
-  background: radial-gradient(1200px 700px at 20% 0%, var(--bg2), var(--bg));
-  color: var(--text);
-}}
-section, .card, .panel, .feature {{
-  background: rgba(255,255,255,0.6);
-  backdrop-filter: blur(6px);
-  border: 1px solid var(--border);
-  border-radius: 14px;
-  padding: 1.25rem; margin: .75rem 0;
-}}
-#hero {{
-  min-height: 70vh; display: flex; align-items: center; justify-content: center;
-  position: relative; overflow: hidden;
-}}
-h1, h2, h3 {{ color: var(--text); letter-spacing: .3px; text-shadow: 0 1px 0 rgba(255,255,255,.25); }}
-a, .link {{ color: var(--primary); text-decoration: none; }}
-a:hover {{ opacity: .9; }}
-button, .btn, .cta, input[type="submit"] {{
-  display: inline-block; padding: .75rem 1.1rem; border-radius: 12px;
-  border: 1px solid var(--border);
-  background: linear-gradient(180deg, var(--primary), var(--accent));
-  color: #0d0f12; font-weight: 600; cursor: pointer;
-  transition: transform .08s ease, box-shadow .18s ease;
-  box-shadow: 0 6px 20px rgba(0,0,0,.12);
-}}
-button:hover, .btn:hover, .cta:hover, input[type="submit"]:hover {{ transform: translateY(-2px); }}
-nav a {{ padding: .35rem .6rem; border-radius: 8px; }}
-hr {{ border: 0; height: 1px; background: linear-gradient(90deg, transparent, var(--border), transparent); }}
-</style>
-"""
-
+# Session state (defaults in settings.SESSION_DEFAULTS, filled once per session)
+init_session(st.session_state)
+# a full run redraws every panel, so a pending page change is already handled
+st.session_state.pop("_page_changed", None)
 
-def theme_aware_svg(prompt_text: str) -> str:
-    p = (prompt_text or "").lower()
-    if any(k in p for k in ["wedding", "love", "invite"]):
-        color1, color2, shape = "#f4b6c2", "#ffd6e0", "roses and cherry blossoms"
-    elif any(k in p for k in ["tech", "ai", "cyber", "startup"]):
-        color1, color2, shape = "#00f0ff", "#7b2ff7", "circuit lines and neon glow"
-    elif any(k in p for k in ["coffee", "cafe", "bakery"]):
-        color1, color2, shape = "#b6905b", "#f5deb3", "coffee cups and steam"
-    elif any(k in p for k in ["fashion", "style", "boutique"]):
-        color1, color2, shape = "#f9a8d4", "#fcd34d", "flowing fabric ribbons"
-    elif any(k in p for k in ["portfolio", "resume", "personal"]):
-        color1, color2, shape = "#60a5fa", "#a78bfa", "abstract geometric polygons"
-    elif any(k in p for k in ["travel", "beach", "adventure"]):
-        color1, color2, shape = "#38bdf8", "#facc15", "waves and airplane trails"
-    else:
-        color1, color2, shape = "#e0c3fc", "#8ec5fc", "soft pastel sparkles"
-    return f"""
-<svg id="theme-art" viewBox="0 0 220 220" width="240" height="240"
-     style="position:absolute;top:-10px;left:-10px;opacity:.15;z-index:0;pointer-events:none;">
-  <defs>
-    <linearGradient id="grad1" x1="0" y1="0" x2="1" y2="1">
-      <stop offset="0" stop-color="{color1}"/><stop offset="1" stop-color="{color2}"/>
-    </linearGradient>
-  </defs>
-  <g fill="url(#grad1)" stroke="{color2}" stroke-width="0.6">
-    <path d="M40,110 C60,80 90,70 120,70 C145,70 170,80 185,95
-             C130,125 90,150 55,170 C35,150 25,130 40,110 Z"/>
-    <text x="12" y="205" font-size="10" fill="{color2}" opacity=".6">{shape}</text>
-  </g>
-</svg>
-"""
 
+# ------------------ 1-4) Theme, HTML, stack and prompt helpers live in pipeline.py ------------------
 
-def detect_visual_intent(text: str) -> bool:
-    if not text:
-        return False
-    t = text.lower()
-    keywords = [
-        "flowers",
-        "floral",
-        "cloud",
-        "butterfly",
-        "sparkle",
-        "glow",
-        "neon",
-        "pattern",
-        "illustration",
-        "icons",
-        "waves",
-        "palm",
-        "bokeh",
-        "confetti",
-        "cherries",
-        "stars",
-        "gradient background",
-        "texture",
-        "grid",
-        "circuit",
-    ]
-    return any(k in t for k in keywords)
-
-
-# ------------------ 2) HTML safety + postprocess ------------------
-def sanitize_html(raw: str) -> str:
-    html = (raw or "").replace("```html", "").replace("```", "").strip()
-    if not html:
-        return ""
-    html = re.sub(r'href="/[^"]*"', 'href="#"', html)
-    html = html.replace('href="/"', 'href="#"')
-
-    def add_target_blank(m):
-        url = m.group(1)
-        return f'href="{url}" target="_blank" rel="noopener noreferrer"'
-
-    html = re.sub(r'href="(https?://[^"]+)"(?![^>]*\\btarget=)', add_target_blank, html)
-
-    interceptor = """
-<script>
-document.addEventListener('click', function(e){
-  const a = e.target.closest('a'); if(!a) return;
-  const href = a.getAttribute('href') || '';
-  if (href.startsWith('#')) return;
-  if (/^https?:\\/\\//i.test(href) && a.target === '_blank') return;
-  e.preventDefault();
-  if (href === '#' || href === '') window.scrollTo({top: 0, behavior: 'smooth'});
-});
-document.querySelectorAll('a[href^="#"]').forEach(a=>{
-  a.addEventListener('click', function(ev){
-    const id = this.getAttribute('href').slice(1);
-    const el = document.getElementById(id);
-    if(el){ ev.preventDefault(); el.scrollIntoView({behavior:'smooth'}); }
-  });
-});
-</script>
-"""
-    if "</body>" in html:
-        html = html.replace("</body>", interceptor + "</body>")
-    else:
-        html += interceptor
-    return html
 
-extra_image_src = st.session_state.get("img_value", "")
-image_place_hint = st.session_state.get("image_place_hint", "")
+# ------------------ Model backend + generation cache ------------------
+@st.cache_resource
+def get_backend() -> ModelBackend:
+    """One backend (and SDK client) per process; GENWEBLY_BACKEND=fake runs offline.
 
+    Calls get a deadline, retries with jittered backoff and, with
+    GENWEBLY_HEDGE=1, a hedged duplicate once they run past the observed p95.
+    The model SDK itself is only imported on the first call.
+    """
+    return make_backend(SETTINGS)
 
-def postprocess_html(raw_html: str, hero_image_url: str = "", ensure_story_anchor: bool = True, prompt_text: str = "") -> str:
-    html = (raw_html or "").replace("```html", "").replace("```", "").strip()
-    if "<html" not in html.lower():
-        html = f"<html><head></head><body>{html}</body></html>"
 
-    palette = theme_palette(prompt_text)
-    theme_css = build_theme_css(palette)
-    if "</head>" in html:
-        html = html.replace("</head>", theme_css + "</head>")
-    else:
-        html = theme_css + html
+@st.cache_resource
+def get_generation_cache() -> GenerationCache:
+    return make_generation_cache(SETTINGS)
 
-    html = re.sub(r'href="/[^"]*"', 'href="#"', html)
-    html = html.replace('href="/"', 'href="#"')
-    if ensure_story_anchor and "#story" in html:
-        html = html.replace('href="#"', 'href="#story"')
 
-    def _add_target_blank(m):
-        url = m.group(1)
-        return f'href="{url}" target="_blank" rel="noopener noreferrer"'
+@st.cache_resource
+def get_prompt_index() -> PromptIndex:
+    """Earlier prompts -> generation cache keys, for near-duplicate lookups."""
+    return make_prompt_index(SETTINGS)
 
-    html = re.sub(r'href="(https?://[^"]+)"(?![^>]*\\btarget=)', _add_target_blank, html)
 
-    if hero_image_url and "hero background" in prompt_text.lower():
+@st.cache_resource
+def start_metrics_endpoint():
+    """Serve Prometheus text on GENWEBLY_METRICS_PORT (once per process) when it is set."""
+    return serve_metrics(SETTINGS.metrics_port) if SETTINGS.metrics_port else None
 
-        css = "<style>#hero{background:url('" + hero_image_url + "') center/cover no-repeat;}</style>"
-        html = html.replace("</head>", css + "</head>") if "</head>" in html else css + html
 
-        # --- CONDITIONAL SPARKLES ENGINE ---
-    user_hates_sparkles = "no sparkle" in prompt_text.lower() or \
-                          "remove sparkle" in prompt_text.lower() or \
-                          "remove sparkles" in prompt_text.lower() or \
-                          "remove snow" in prompt_text.lower() or \
-                          "remove floating" in prompt_text.lower()
+start_metrics_endpoint()
 
-    sparkle_keywords = ["sparkle", "sparkles", "glow", "neon", "bokeh", "confetti", "dreamy", "magic", "fairy"]
 
-    user_wants_sparkles = any(k in prompt_text.lower() for k in sparkle_keywords)
+def stream_html(
+    req: str, generation_config: dict, on_partial=None, bypass_cache: bool = False, cache=None, backend=None, job=None
+) -> str:
+    """One model call, served from the generation cache when possible.
 
-    # Remove sparkles fully if user said no
-    if user_hates_sparkles:
-        html = re.sub(r'<style>[\s\S]*?#sparkles[\s\S]*?</script>', '', html)
+    The call is streamed only when ``on_partial(doc)`` wants a renderable
+    prefix on each repaint; otherwise it is a plain ``generate``, which gets
+    the backend's deadline and hedging for the whole answer. With a ``job``
+    the stream is closed, aborting the request, as soon as the job is
+    cancelled. Pass ``cache`` and ``backend`` explicitly from worker threads.
+    """
+    cache = get_generation_cache() if cache is None else cache
+    backend = get_backend() if backend is None else backend
+    if on_partial is None:
+        html = generate_html(req, generation_config, backend, cache, bypass_cache)
+        if job is not None:
+            job.check()
         return html
 
-    # Add sparkles only if requested
-    if user_wants_sparkles and 'id="sparkles"' not in html:
-        sparkles = """
-        <style>
-        #sparkles{position:fixed;inset:0;pointer-events:none;z-index:1;}
-        .sparkle{position:absolute;border-radius:50%;
-        background:radial-gradient(circle, rgba(255,255,255,0.9), rgba(255,255,255,0));
-        opacity:.6;filter:blur(.5px);animation:float 6s linear infinite;}
-        @keyframes float{from{transform:translateY(0)}to{transform:translateY(-120vh)}}
-        </style>
-        <div id="sparkles"></div>
-        <script>(function(){const c=document.getElementById('sparkles');if(!c)return;
-        for(let i=0;i<28;i++){const s=document.createElement('div');s.className='sparkle';
-        const d=3+Math.random()*7;s.style.width=d+'px';s.style.height=d+'px';
-        s.style.left=Math.random()*100+'vw';s.style.top=(100+Math.random()*40)+'vh';
-        s.style.animationDelay=(Math.random()*6)+'s';
-        s.style.animationDuration=(5+Math.random()*6)+'s';c.appendChild(s);}})();</script>
-        """
-        html = html.replace("</body>", sparkles + "</body>") if "</body>" in html else html + sparkles
-
-    if 'id="theme-art"' not in html:
-        html = html.replace("<body>", "<body>" + theme_aware_svg(prompt_text))
-
+    key = generation_cache_key(backend.model_name, generation_config, req)
+    cached = cache_lookup(cache, key, bypass_cache)
+    if cached is not None:
+        return cached
+
+    inc = IncrementalHtmlSanitizer(fragment_filter=_rewrite_links, repaint_ms=SETTINGS.stream_repaint_ms)
+    with span("model_call"), closing(backend.stream(req, generation_config)) as chunks:
+        for text in chunks:
+            if job is not None:
+                job.check()
+            if inc.feed(text):
+                on_partial(inc.snapshot())
+    html = inc.finish()
+    cache.put(key, html)
     return html
 
 
- 
-
-
-
-
-
-# ------------------ 3) Stack helpers + prompt builders ------------------
-ALL_LANGS = ["HTML", "CSS", "JS", "Tailwind", "Bootstrap", "jQuery"]
-
-
-def check_stack_applicability(selected):
-    """Return (is_applicable: bool, message: str)."""
-    if not selected:
-        return True, "No stack chosen; model will pick a reasonable default (HTML + CSS)."
-    if "HTML" not in selected:
-        return False, "Stack not applicable: HTML is required since the output is always an HTML document. Add 'HTML'."
-    if "Tailwind" in selected and "Bootstrap" in selected:
-        return False, "Stack not applicable: Tailwind CSS and Bootstrap are full CSS frameworks that often conflict; pick one of them, not both."
-    return True, "Stack applicable."
-
-
-def build_stack_rules(selected_langs, js_mode: str, js_use: str) -> str:
-    if not selected_langs:
-        return ""
-
-    langs = set(selected_langs)
-    rules = []
-
-    # Base HTML/CSS rules
-    if "HTML" in langs and "CSS" not in langs and not (langs & {"Tailwind", "Bootstrap"}):
-        rules.append("Output a single self-contained HTML file. Use minimal inline CSS inside a <style> block.")
-    if "HTML" in langs and "CSS" in langs and not (langs & {"Tailwind", "Bootstrap", "jQuery"}):
-        rules.append("Use a single HTML file with a <style> block for CSS. Avoid external libraries.")
-
-    # Tailwind
-    if "Tailwind" in langs:
-        rules.append("Use Tailwind utility classes. Include CDN <script src='https://cdn.tailwindcss.com'></script> in <head>.")
-
-    # Bootstrap
-    if "Bootstrap" in langs:
-        rules.append("Use Bootstrap 5 via CDN (CSS and JS). Build layout with Bootstrap components.")
-
-    # jQuery
-    has_js_like = False
-    if "jQuery" in langs:
-        rules.append("Include jQuery via CDN and use it for small interactions.")
-        has_js_like = True
-
-    # Vanilla JS / Bootstrap behavior
-    if "JS" in langs or "Bootstrap" in langs:
-        has_js_like = True
-
-    if has_js_like:
-        rules.append("All code must live in a single HTML file with <style> and <script> blocks.")
-        if js_mode == "Dynamic":
-            rules.append(
-                "Use JavaScript to add interactivity (tabs, modals, form handling, smooth scrolling, localStorage, etc.). Avoid external API requests."
-            )
-        else:
-            rules.append("Keep JavaScript minimal, so the page mostly behaves like a static site (minor enhancements only).")
-        if js_use.strip():
-            rules.append(f"Specific JavaScript behavior requested by the user: {js_use.strip()}")
-
-    return "\n".join(rules)
-
-
-def build_revision_prompt(
-    current_html: str,
-    stack_rules: str,
-    change_list: str = "",
-    extra_image_src: str = "",
-    image_place_hint: str = "",
-    svg_hint: str = "",
-    logic_fixes: str = "",
-):
-    rules = [
-    "Revise the EXISTING HTML below. Do NOT recreate from scratch.",
-    "APPLY ONLY the requested changes. Do not remove sections or anchors.",
-    "Return ONE full HTML document (no markdown).",
-    "IMPORTANT: If a change mentions color, font, placement, or logic, edit the exact CSS/JS/HTML selectors.",
-    "Insert an HTML comment per applied change like <!--applied: change-key-->.",
-    "Keep responsiveness and accessibility intact.",
-    "YOU MUST make at least one visible modification to the HTML, even if the request is minor.",
-]
-
-
-    if stack_rules:
-        rules.append("Respect these stack rules:\n" + stack_rules)
-
-    # Make sure Gemini ALWAYS applies changes
-    if change_list.strip():
-        change_list += "\nALWAYS MODIFY AT LEAST ONE ELEMENT."
-
-    if change_list.strip():
-        rules.append("Apply these changes:\n" + change_list.strip())
-    else:
-        rules.append("User gave no changes → apply gentle improvements only.")
-
-    if logic_fixes.strip():
-        rules.append("Logic fixes:\n" + logic_fixes.strip())
-
-    if extra_image_src and image_place_hint:
-        rules.append(
-            f"PLACE THIS IMAGE EXACTLY at '{image_place_hint}'. USE THIS SRC ONLY: {extra_image_src}."
+def find_similar_page(prompt_text: str, context: str, exact_key: str, cache=None, index=None):
+    """(Match, raw html) of the closest earlier prompt scoring at least
+    GENWEBLY_SIMILAR_SHOW, or None. An exact cache entry for this request
+    always wins, so nothing is offered then."""
+    if SETTINGS.similar_show <= 0:
+        return None
+    cache = get_generation_cache() if cache is None else cache
+    index = get_prompt_index() if index is None else index
+    if cache.get(exact_key, record=False) is not None:
+        return None
+    with span("similar_lookup"):
+        match = index.lookup(prompt_text, context, min_score=SETTINGS.similar_show, exclude_key=exact_key)
+    if match is None:
+        return None
+    raw = cache.get(match.key, record=False)
+    if raw is None:  # the page has left the cache since
+        index.discard(match.key)
+        return None
+    return match, raw
+
+
+def show_job_preview(html: str, height: int = 600):
+    """Live preview of a running job in the hash-keyed frame: polls that bring no new page send only the hash."""
+    width = DEVICE_WIDTHS[st.session_state.get("device", "Mobile")]
+    preview_frame(html, width, height, asset_urls=get_asset_store().preview_urls(html), key="job_preview")
+
+
+def show_similar_page(job):
+    """The closest earlier design, rendered once per job, while the new one is generated."""
+    match, raw = job.meta["similar"]
+    if "similar_html" not in job.meta:
+        job.meta["similar_html"] = render_generated_page(
+            raw, prompt_text=job.meta["prompt"], image_src=job.meta.get("image_src")
         )
+    st.caption(f"Similar earlier design ({match.score:.0%} match: “{match.prompt}”) while yours is generated…")
+    show_job_preview(job.meta["similar_html"])
 
-    if svg_hint.strip():
-        rules.append("Add inline SVG art: " + svg_hint.strip())
 
-    return (
-        "\n".join(rules)
-        + "\n\n--- CURRENT HTML (EDIT THIS, DO NOT REWRITE) ---\n"
-        + current_html
+def render_cache_stats():
+    s = get_generation_cache().stats()
+    similar = get_prompt_index().stats()
+    st.caption(
+        f"Cache: {s['hits']} hits · {s['misses']} misses · {s['bypassed']} bypassed "
+        f"({s['hit_rate']:.0%} hit rate)"
+        + (f" · {similar['matches']} similar prompts, {similar['served']} served" if similar["matches"] else "")
     )
-
-
-
-# ------------------ 4) Helper utilities for regenerate verification/patch + splitting ------------------
-def _norm(s: str) -> str:
-    return re.sub(r"\s+", " ", (s or "")).strip()
-
-
-def _hash(s: str) -> str:
-    return hashlib.sha256((s or "").encode("utf-8")).hexdigest()
-
-
-def ensure_min_date_js(html: str) -> str:
-    snippet = """
-<script>
-(function(){
-  function todayStr(){
-    const t=new Date();
-    const m=String(t.getMonth()+1).padStart(2,'0');
-    const d=String(t.getDate()).padStart(2,'0');
-    return `${t.getFullYear()}-${m}-${d}`;
-  }
-  document.querySelectorAll('input[type="date"]').forEach(el=>{
-    const td=todayStr();
-    if(!el.min) el.min = td;
-    if(el.value && el.value < td) el.value = td;
-    el.addEventListener('change',()=>{ if(el.value < td) el.value = td; });
-  });
-})();
-</script>
-"""
-    return html.replace("</body>", snippet + "</body>") if "</body>" in html else (html + snippet)
-
-
-def force_contact_text_black(html: str) -> str:
-    style = """
-<style id="contact-enforce-text">
-#contact, section#contact, .contact, .contact-section { color:#000 !important; }
-#contact p, .contact p, #contact li, .contact li { color:#000 !important; }
-</style>
-"""
-    return html.replace("</head>", style + "</head>") if "</head" in html else (style + html)
-
-# --- IMAGE INJECTION ENGINE (FINAL PATCH) ---
-def apply_explicit_image_patch(html, src, place_hint, prompt):
-    place_hint = (place_hint or "").lower()
-    prompt = (prompt or "").lower()
-
-    
-    # Build <img> tag with size + opacity rules
-    # Base styles so image is ALWAYS visible
-    # --- FORCE IMAGE TO RENDER VISIBLY ---
-    base_styles = [
-    "width:100%",
-    "height:100%",
-    "object-fit:contain",
-    "display:block"
-]
-
-# Optional size hints
-    if "small" in place_hint:
-        base_styles.append("max-width:90px")
-    elif "medium" in place_hint:
-        base_styles.append("max-width:180px")
-    elif "large" in place_hint:
-        base_styles.append("max-width:260px")
-
-# Optional opacity
-    m = re.search(r"opacity\s*([0-9]*\.?[0-9]+)", place_hint)
-    if m:
-        try:
-            op = float(m.group(1))
-            if op > 1:
-                op = op / 100
-            base_styles.append(f"opacity:{op}")
-        except:
-            pass
-
-    style_attr = ' style="' + ";".join(base_styles) + ';"'
-
-    img_tag = f'<img src="{src}" loading="lazy"{style_attr} />'
-
-
-
-    # Placement logic
-    # 1) CONTACT SECTION
-    if "contact" in place_hint:
-        return re.sub(
-        r'(<section[^>]*id=["\']contact["\'][^>]*>)(.*?)(</section>)',
-        r'\1' + img_tag + r'\3',
-        html,
-        flags=re.I | re.S
-    )
-
-    # 2) ABOUT SECTION
-    if "about" in place_hint:
-        return re.sub(
-        r'(<section[^>]*id=["\']about["\'][^>]*>)(.*?)(</section>)',
-        r'\1' + img_tag + r'\3',
-        html,
-        flags=re.I | re.S
+    calls = get_backend().stats()
+    if calls["calls"]:
+        st.caption(
+            f"Model calls: {calls['calls']} · p50 {calls['p50_s'] or 0:.1f}s · p95 {calls['p95_s'] or 0:.1f}s "
+            f"· hedges {calls['hedges']} ({calls['hedge_wins']} won)"
+        )
+    queue = calls.get("scheduler")
+    if queue and (queue["admitted"] or queue["running"]):
+        waiting = sum(queue["queued"].values())
+        st.caption(f"Scheduler: {queue['running']} running · {waiting} queued · {queue['cancelled']} cancelled")
+    stages = sorted(
+        ("{flow}/{stage}".format(**dict(labels)), p50)
+        for (name, labels), (_count, _total, p50, _p95) in REGISTRY.snapshot().items()
+        if name == "genwebly_stage_seconds" and p50 is not None
     )
+    if stages:
+        st.caption("Stage p50: " + " · ".join(f"{stage} ≤{p50:g}s" for stage, p50 in stages))
 
 
-    # 3) HERO IMAGE — REPLACE CONTENT
-    if "hero" in place_hint:
-        return re.sub(
-            r'(<section[^>]*id=["\']hero["\'][^>]*>)(.*?)(</section>)',
-            r'\1' + img_tag + r'\3',
-            html,
-            flags=re.I | re.S
-    )
-
+@st.fragment
+def stack_panel():
+    """Stack picker; changing it reruns only this panel.
 
-    # 4) BOTTOM LEFT
-    if "bottom left" in place_hint:
-        fixed = (
-            "<div style='position:absolute;left:0;bottom:0;z-index:50;'>"
-            + img_tag +
-            "</div>"
-        )
-        return html.replace("</body>", fixed + "</body>")
-
-    # 5) BOTTOM RIGHT
-    if "bottom right" in place_hint:
-        fixed = (
-            "<div style='position:absolute;right:0;bottom:0;z-index:50;'>"
-            + img_tag +
-            "</div>"
+    Writes stack_langs / stack_js_mode / stack_js_use to session state, where
+    Generate and Regenerate read them when clicked.
+    """
+    with st.expander("Choose stack (optional)", expanded=False):
+        selected = st.multiselect(
+            "Languages / libraries",
+            ALL_LANGS,
+            default=st.session_state["stack_langs"],
+            key="stack_langs_widget",
         )
-        return html.replace("</body>", fixed + "</body>")
-
-    # 6) DEFAULT — append before </body>
-    return html.replace("</body>", img_tag + "</body>")
-
-def inject_edit_delete_svgs_if_missing(html: str) -> str:
-    add_svg_js = """
-<script>
-(function(){
-  const editSVG = '<svg viewBox="0 0 24 24" width="18" height="18" fill="currentColor" aria-hidden="true"><path d="M3 17.25V21h3.75L17.81 9.94l-3.75-3.75L3 17.25zm14.71-9.04a1 1 0 0 0 0-1.41l-2.51-2.51a1 1 0 0 0-1.41 0l-1.83 1.83 3.75 3.75 2-1.66z"/></svg>';
-  const delSVG = '<svg viewBox="0 0 24 24" width="18" height="18" fill="currentColor" aria-hidden="true"><path d="M6 19a2 2 0 0 0 2 2h8a2 2 0 0 0 2-2V7H6v12zM19 4h-3.5l-1-1h-5l-1 1H5v2h14V4z"/></svg>';
-  document.querySelectorAll('.icon-edit').forEach(el=>{ if(!el.innerHTML.trim()) el.innerHTML = editSVG; });
-  document.querySelectorAll('.icon-delete').forEach(el=>{ if(!el.innerHTML.trim()) el.innerHTML = delSVG; });
-})();
-</script>
-"""
-    return html.replace("</body>", add_svg_js + "</body>") if "</body" in html else (html + add_svg_js)
-
-
-def split_html_assets(raw_html: str):
-    """Split raw HTML into index.html, styles.css, script.js."""
-    html = (raw_html or "").strip()
-    if not html:
-        return "", "", ""
-
-    css_parts = re.findall(r"<style[^>]*>(.*?)</style>", html, flags=re.S | re.I)
-    js_parts = re.findall(r"<script[^>]*>(.*?)</script>", html, flags=re.S | re.I)
-
-    css = "\n\n".join(part.strip() for part in css_parts if part.strip())
-    js = "\n\n".join(part.strip() for part in js_parts if part.strip())
-
-    html_wo_css = re.sub(r"<style[^>]*>.*?</style>", "", html, flags=re.S | re.I)
-    html_clean = re.sub(r"<script[^>]*>.*?</script>", "", html_wo_css, flags=re.S | re.I)
-
-    inject = ""
-    if css:
-        inject += '<link rel="stylesheet" href="styles.css"/>\n'
-    if js:
-        inject += '<script src="script.js"></script>\n'
-
-    if "</head>" in html_clean:
-        html_clean = html_clean.replace("</head>", inject + "</head>")
-    else:
-        html_clean = inject + html_clean
-
-    return html_clean.strip(), css.strip(), js.strip()
 
+        st.session_state["stack_langs"] = selected
 
-with st.expander("Choose stack (optional)", expanded=False):
-    if "stack_langs" not in st.session_state:
-        st.session_state["stack_langs"] = []
-
-    selected = st.multiselect(
-        "Languages / libraries",
-        ALL_LANGS,
-        default=st.session_state["stack_langs"],
-        key="stack_langs_widget",
-    )
+        applicable, stack_msg = check_stack_applicability(selected)
+        if applicable:
+            st.markdown(
+                f"<p style='font-size:0.85rem;font-style:italic;color:#9ca3af;'>*{stack_msg}</p>",
+                unsafe_allow_html=True,
+            )
+        else:
+            st.markdown(
+                f"<p style='font-size:0.85rem;font-style:italic;color:#f97373;'>*{stack_msg}</p>",
+                unsafe_allow_html=True,
+            )
 
-    st.session_state["stack_langs"] = selected
+        # JS behavior controls only if JS or jQuery are present
+        has_js_like = any(l in selected for l in ["JS", "jQuery"])
+        if has_js_like:
+            st.markdown("**Behavior for JS-based parts**")
+            st.session_state["stack_js_mode"] = st.radio(
+                "If JS is involved, should it be…",
+                ["Static", "Dynamic"],
+                index=0 if st.session_state["stack_js_mode"] == "Static" else 1,
+                horizontal=True,
+                key="stack_js_mode_radio",
+            )
+            st.session_state["stack_js_mode"] = st.session_state["stack_js_mode_radio"]
+            st.session_state["stack_js_use"] = st.text_input(
+                "(Optional) What should JS do?",
+                value=st.session_state["stack_js_use"],
+                placeholder="tabs, modal, localStorage diary, form validation…",
+            )
 
-    applicable, stack_msg = check_stack_applicability(selected)
-    if applicable:
-        st.markdown(
-            f"<p style='font-size:0.85rem;font-style:italic;color:#9ca3af;'>*{stack_msg}</p>",
-            unsafe_allow_html=True,
-        )
-    else:
-        st.markdown(
-            f"<p style='font-size:0.85rem;font-style:italic;color:#f97373;'>*{stack_msg}</p>",
-            unsafe_allow_html=True,
-        )
 
-    # JS behavior controls only if JS or jQuery are present
-    has_js_like = any(l in selected for l in ["JS", "jQuery"])
-    if has_js_like:
-        st.markdown("**Behavior for JS-based parts**")
-        st.session_state["stack_js_mode"] = st.radio(
-            "If JS is involved, should it be…",
-            ["Static", "Dynamic"],
-            index=0 if st.session_state["stack_js_mode"] == "Static" else 1,
-            horizontal=True,
-            key="stack_js_mode_radio",
-        )
-        st.session_state["stack_js_mode"] = st.session_state["stack_js_mode_radio"]
-        st.session_state["stack_js_use"] = st.text_input(
-            "(Optional) What should JS do?",
-            value=st.session_state["stack_js_use"],
-            placeholder="tabs, modal, localStorage diary, form validation…",
-        )
+stack_panel()
 
  # --- Clean Small Learn More Button (Working Popover) ---
 c1, c2 = st.columns([1, 4])
@@ -677,104 +297,456 @@ hint_text = st.text_input(
 )
 
 
-def file_to_data_url(file) -> str:
+@st.cache_resource
+def get_asset_store() -> AssetStore:
+    return make_asset_store(SETTINGS)
+
+
+def file_to_asset_ref(file) -> str:
+    """Store an upload once per session and return its short ``asset://`` reference."""
     if not file:
         return ""
-    data = file.read()
-    ext = file.name.split(".")[-1].lower()
-    mime = "image/png" if ext == "png" else "image/jpeg"
-    return f"data:{mime};base64," + base64.b64encode(data).decode("utf-8")
-
-
-# Decide image mode/value from inputs
-img_mode, img_value = None, None
-if bg_url:
-    img_mode, img_value = "url", bg_url.strip()
-elif uploaded:
-    img_mode, img_value = "data", file_to_data_url(uploaded)
-elif hint_text:
-    img_mode, img_value = "svg", hint_text.strip()
-else:
+    refs = st.session_state.setdefault("asset_refs", {})
+    key = getattr(file, "file_id", None) or f"{file.name}:{file.size}"
+    if key not in refs:
+        refs[key] = get_asset_store().put_upload(file)
+    return refs[key]
+
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def inline_assets(html: str) -> str:
+    """Self-contained copy of ``html`` for download (asset refs -> data URLs)."""
+    return get_asset_store().inline(html)
+
+
+def source_files(raw_html: str):
+    """split_html_assets for the source view, kept for the page this session shows.
+
+    Reruns that leave the page alone reuse the split; only the session's own
+    current page is held, never other sessions' documents.
+    """
+    memo = st.session_state.get("_source_files")
+    if memo is None or memo[0] != raw_html:
+        memo = (raw_html, split_html_assets(raw_html))
+        st.session_state["_source_files"] = memo
+    return memo[1]
+
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def site_zip(raw_html: str, precompress: bool = False, optimize: bool = False):
+    """index.html + styles.css + script.js + uploaded images, zipped once per page.
+
+    Returns (zip bytes, PerfReport or None); ``optimize`` runs the webperf pass on index.html.
+    """
+    html_main, css, js = split_html_assets(raw_html)
+    html_main, files = get_asset_store().bundle(html_main)
+    report = None
+    if optimize:
+        html_main, report = optimize_site(html_main, css, files)
+    return build_site_zip(html_main, css, js, files, precompress), report
+
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def optimized_single_file(html: str):
+    """(optimized self-contained page, PerfReport) for the single-file download."""
+    return optimize_page(inline_assets(html))
+
+
+def resolve_image_input():
+    """(img_mode, img_value) from the image inputs; only needed when Generate is clicked."""
+    if bg_url:
+        return "url", bg_url.strip()
+    if uploaded:
+        return "data", file_to_asset_ref(uploaded)
+    if hint_text:
+        return "svg", hint_text.strip()
     if detect_visual_intent(prompt):
-        img_mode, img_value = "svg", prompt.strip()
-
-def build_prompt(u: str, img_mode=None, img_hint=None, stack_rules: str = "", temperature: float = 0.8) -> str:
-    base = (
-        "Return ONE complete HTML document (no markdown). "
-        "Prefer a single file with inline <style> and optional <script>. "
-        "Make it responsive and accessible with good contrast.\n"
-        "STRUCTURE: header/nav, hero, 3 feature cards/sections, footer.\n"
-        "NAV: in-page anchors only (e.g., href=\"#about\"). Smooth scrolling.\n"
-        "Buttons/links: External links target='_blank' rel='noopener noreferrer'.\n"
-        "Forms: no external navigation.\n"
+        return "svg", prompt.strip()
+    return None, None
+
+# ------------------ 6) Generate ------------------
+bypass_cache = st.checkbox(
+    "Skip cache (force a fresh generation)",
+    value=False,
+    help="Identical requests are normally answered from the local generation cache.",
+)
+stream_preview = st.checkbox(
+    "Stream preview while generating",
+    value=True,
+    help="Show the page section by section as the model writes it.",
+)
+parallel_sections = st.checkbox(
+    "Build sections in parallel",
+    value=False,
+    help="A short design-spec call, then header, hero, features and footer are written at the same time "
+    "and stitched into one page. Faster on long pages; ignored when generating variants.",
+)
+n_variants = st.number_input(
+    "Variants",
+    min_value=1,
+    max_value=5,
+    value=1,
+    step=1,
+    help="Generate several options in parallel and pick one from the gallery in the Preview tab.",
+)
+render_cache_stats()
+
+
+# ------------------ Version history (undo/redo) ------------------
+def get_history() -> VersionHistory:
+    if "history" not in st.session_state:
+        st.session_state["history"] = make_history(SETTINGS)
+    return st.session_state["history"]
+
+
+def record_version(label: str):
+    get_history().commit(
+        {"raw_html": st.session_state.get("raw_html", ""), "html": st.session_state.get("html", "")},
+        label,
     )
-    if stack_rules:
-        base += f"\nStack rules:\n{stack_rules}\n"
 
-    if img_mode in ("data", "url"):
-        base += "Use the user's provided image as the main hero background. Do not include other images.\n"
-    elif img_mode == "svg" or (img_hint and img_hint.strip()):
-        base += "Generate visuals as inline SVG or CSS drawings that match the hint. No external URLs.\n" + f"Image Hint: {img_hint}\n"
-    else:
-        base += "Do NOT include external <img> unless asked. Use gradients/SVG if visuals are needed.\n"
 
-    return f"{base}\nUser request:\n{u}\n(temperature={temperature})"
+def restore_version(state):
+    if state is not None:
+        st.session_state["raw_html"] = state["raw_html"]
+        st.session_state["html"] = state["html"]
+        st.session_state["_page_changed"] = True
+
+
+def undo_version():
+    restore_version(get_history().undo())
+
+
+def redo_version():
+    restore_version(get_history().redo())
+
+
+def jump_to_version():
+    restore_version(get_history().jump(st.session_state["history_pick"]))
+
+
+def promote_variant(i: int):
+    v = st.session_state["variants"][i]
+    st.session_state["raw_html"] = v["raw"]
+    st.session_state["html"] = v["html"]
+    record_version(f"Variant #{v['index'] + 1}")
+    st.session_state["_page_changed"] = True
+
+
+def rerun_app_if_page_changed():
+    """Widget callbacks inside a fragment only rerun that fragment. When one of
+    them replaced the page, rerun the whole app so every panel shows it."""
+    if st.session_state.pop("_page_changed", False):
+        st.rerun(scope="app")
+
+
+# ------------------ Background generation jobs ------------------
+@st.cache_resource
+def get_jobs() -> JobManager:
+    """Worker pool for Generate / Regenerate; script runs only submit and poll."""
+    return make_job_manager(SETTINGS)
+
+
+def current_job():
+    """The session's generation job (running or finished), or None."""
+    job_id = st.session_state.get("job_id")
+    job = get_jobs().get(job_id) if job_id else None
+    if job_id and job is None:  # expired, or the process restarted
+        st.session_state.pop("job_id", None)
+    return job
+
+
+def submit_job(kind: str, fn, meta: dict):
+    """Run ``fn(job)`` in the background; a job the session still has running is cancelled."""
+    old = current_job()
+    if old is not None:
+        old.cancel()
+    job = get_jobs().submit(st.session_state["session_id"], kind, fn, meta)
+    st.session_state["job_id"] = job.id
+    return job
+
+
+def cancel_job():
+    get_jobs().cancel(st.session_state.get("job_id", ""))
+
+
+def run_generate_job(job, spec: dict, cache, backend, index):
+    """Worker side of Generate: build the prompt, call the model, post-process.
+
+    Returns {"raw", "html", "variants", "similar"}, or None when cancelled.
+    """
+    n = spec["n_variants"]
+    sectioned = bool(spec["sections"] and n <= 1)
+    with Trace("generate", variants=n, streaming=bool(spec["stream"] and n <= 1), sections=sectioned) as trace:
+        try:
+            user_prompt, img_mode, img_value = spec["user_prompt"], spec["img_mode"], spec["img_value"]
+            with span("prompt_build"):
+                applicable, _msg = check_stack_applicability(spec["stack_langs"])
+                stack_rules = build_stack_rules(spec["stack_langs"] if applicable else [], spec["js_mode"], spec["js_use"])
 
-# ------------------ 6) Generate ------------------
-if st.button("Generate", type="primary"):
-    if not API_KEY:
-        st.session_state["html"] = "<html><body><h2>❌ No API key found in .env</h2></body></html>"
-    else:
-        with st.spinner("✨ Designing with Gemini..."):
-            try:
-                applicable, _msg = check_stack_applicability(st.session_state["stack_langs"])
-                effective_langs = st.session_state["stack_langs"] if applicable else []
-                stack_rules = build_stack_rules(effective_langs, js_mode, js_use)
-
-                model = genai.GenerativeModel(
-                    "gemini-2.5-flash",
-                    generation_config={"temperature": 0.8},
-                )
                 req = build_prompt(
-                    prompt or "minimal landing page",
+                    user_prompt,
                     img_mode=img_mode,
                     img_hint=(img_value if img_mode == "svg" else None),
                     stack_rules=stack_rules,
                     temperature=0.8,
                 )
-                resp = model.generate_content(req)
-                html = (resp.text or "").strip()
-                st.session_state["raw_html"] = html
-                safe = sanitize_html(html)
-
-                # 🔴 ADD THIS BLOCK (IMAGE INSERTION)
-                if img_mode in ("url", "data"):
-                    safe = apply_explicit_image_patch(
-                        safe,
-                        img_value,
-                        "",  # no place hint during initial generate
-                        prompt
-    )
+            image_src = img_value if img_mode in ("url", "data") else None
+
+            def render(raw):
+                # sanitize + image insertion (no place hint during initial generate) + postprocess
+                return render_generated_page(raw, prompt_text=spec["prompt"], image_src=image_src)
+
+            # an SVG hint taken from the prompt itself is already covered by the wording
+            svg_hint = img_value if img_mode == "svg" and img_value != user_prompt.strip() else ""
+            context = prompt_context(stack_rules, img_mode, svg_hint)
+            exact_key = generation_cache_key(backend.model_name, {"temperature": 0.8}, req)
+            similar = None
+            if n <= 1 and not spec["bypass"]:
+                similar = find_similar_page(user_prompt, context, exact_key, cache, index)
+
+            if similar is not None and similar[0].score >= SETTINGS.similar_serve:
+                index.note_served()
+                note("cache", "similar")
+                return {"raw": similar[1], "html": render(similar[1]), "variants": [], "similar": similar[0]}
+            if n > 1:
+                gallery = []
+                for v in iter_variants(
+                    lambda r, cfg: stream_html(r, cfg, None, spec["bypass"], cache, backend, job),
+                    req,
+                    variant_configs(n, base_temperature=0.8),
+                    postprocess=render,
+                    max_workers=SETTINGS.variant_workers,
+                ):
+                    gallery.append(v._asdict())
+                    job.progress = f"{len(gallery)}/{n} variants ready"
+                job.check()
+                gallery.sort(key=lambda v: v["index"])
+                ok = [v for v in gallery if not v["error"]]
+                if not ok:
+                    raise RuntimeError(gallery[0]["error"])
+                return {"raw": ok[0]["raw"], "html": ok[0]["html"], "variants": gallery, "similar": None}
+
+            job.meta["similar"] = similar  # shown while the new page is generated
+            if sectioned:
+
+                def section_ready(done, total, doc):
+                    job.progress = f"{done}/{total} sections ready"
+                    if spec["stream"]:
+                        job.partial = render(doc)
+
+                html = generate_sectioned(
+                    lambda r, cfg: stream_html(r, cfg, None, spec["bypass"], cache, backend, job),
+                    user_prompt,
+                    img_mode=img_mode,
+                    img_hint=(img_value if img_mode == "svg" else None),
+                    stack_rules=stack_rules,
+                    temperature=0.8,
+                    on_progress=section_ready,
+                )
+                # each call is cached on its own; there is no single cache entry to index the prompt under
+                return {"raw": html, "html": render(html), "variants": [], "similar": None}
+            on_partial = (lambda doc: setattr(job, "partial", doc)) if spec["stream"] else None
+            html = stream_html(req, {"temperature": 0.8}, on_partial, spec["bypass"], cache, backend, job)
+            index.add(user_prompt, context, exact_key)
+            return {"raw": html, "html": render(html), "variants": [], "similar": None}
+        except JobCancelled:
+            trace.status = "cancelled"
+            return None
+
+
+def deliver_generate(job):
+    if job.state == "cancelled":
+        st.toast("Generation cancelled")
+        return
+    if job.state == "failed":
+        if isinstance(job.error, (ModelCallError, ModelTimeout)):
+            # keep whatever page is on screen instead of replacing it with the error
+            st.error(f"Generation failed: {job.error}")
+        else:
+            st.session_state["html"] = f"<html><body><h2>🚫 API Error</h2><pre>{job.error}</pre></body></html>"
+            st.session_state["render_tick"] += 1
+        return
+    result, spec = job.result, job.meta
+    if result["similar"] is not None:
+        match = result["similar"]
+        st.info(
+            f"Reused the design for a near-identical earlier prompt ({match.score:.0%} match: "
+            f"“{match.prompt}”). Tick “Skip cache” for a fresh one."
+        )
+    st.session_state["variants"] = result["variants"]
+    st.session_state["raw_html"] = result["raw"]
+    st.session_state["html"] = result["html"]
+    record_version("Generate")
 
-                safe = postprocess_html(
-                    safe,
-                    hero_image_url="",  # IMPORTANT: prevent hero auto-bg
-                    prompt_text=prompt,
-)
+    st.session_state["last_img_mode"] = spec["img_mode"]
+    st.session_state["last_img_value"] = spec["img_value"] or ""
+    st.session_state["last_prompt"] = spec["user_prompt"]
+
+
+def run_regenerate_job(job, spec: dict, cache, backend):
+    """Worker side of Regenerate: compact, revise (scoped when possible), restore,
+    post-process. Returns {"raw", "html", "flash"}, or None when cancelled."""
+    regen_notes = spec["notes"]
+    with Trace("regenerate", scoped=bool(spec["scoped"])) as trace:
+        try:
+            flash = []  # shown in the Regenerate panel after delivery
+            # --- stack rules ---
+            applicable, _ = check_stack_applicability(spec["stack_langs"])
+            stack_rules = build_stack_rules(
+                spec["stack_langs"] if applicable else [], spec["js_mode"], spec["js_use"]
+            )
 
-                st.session_state["html"] = safe
+            # --- compaction: data URLs, long SVGs, injected scripts and CDN tags become placeholders ---
+            with span("compaction"):
+                current_html, kept_spans, compaction = compact(spec["current_html"])
+            trace.note("compaction_tokens_saved", compaction.tokens_before - compaction.tokens_after)
+
+            # --- section-scoped revision (only the blocks the note touches) ---
+            new_html = None
+            if spec["scoped"]:
+                sections = index_sections(current_html)
+                targets = select_sections(current_html, sections, regen_notes)
+                if targets:
+                    req = build_section_revision_prompt(
+                        current_html, sections, targets, regen_notes, stack_rules
+                    )
+                    fragments = stream_html(req, {"temperature": 0.25}, None, spec["bypass"], cache, backend, job)
+                    new_html = splice_sections(current_html, targets, fragments)
+                    if new_html is not None:
+                        sent = sum(t.end - t.start for t in targets)
+                        flash.append(
+                            f"Scoped revision: {', '.join(t.key for t in targets)} "
+                            f"({sent / max(len(current_html), 1):.0%} of the page sent)"
+                        )
+
+            # --- full revision prompt ---
+            if new_html is None:
+                with span("prompt_build"):
+                    req = build_revision_prompt(
+                        change_list=regen_notes,
+                        current_html=current_html,
+                        stack_rules=stack_rules,
+                        extra_image_src="",
+                        image_place_hint="",
+                        svg_hint="",
+                        logic_fixes="",
+                    )
 
-                st.session_state["last_img_mode"] = img_mode
-                st.session_state["last_img_value"] = img_value or ""
-                st.session_state["last_prompt"] = prompt or "minimal landing page"
-            except Exception as e:
-                st.session_state["html"] = f"<html><body><h2>🚫 API Error</h2><pre>{e}</pre></body></html>"
-                st.session_state["render_tick"] += 1
+                new_html = stream_html(req, {"temperature": 0.25}, None, spec["bypass"], cache, backend, job)
+
+            with span("restore"):
+                new_html = restore(new_html, kept_spans)
+            if compaction.tokens_before > compaction.tokens_after:
+                flash.append(
+                    f"Prompt compaction: ~{compaction.tokens_before:,} → ~{compaction.tokens_after:,} page tokens "
+                    f"({compaction.placeholders} spans kept aside)"
+                )
+
+            # --- sanitize + image patch (ONLY if user uploaded + placement given) + postprocess ---
+            safe = render_generated_page(
+                new_html,
+                prompt_text=spec["last_prompt"] + " " + regen_notes,
+                image_src=spec["img_src"],
+                place_hint=spec["place_hint"],
+            )
+            return {"raw": new_html, "html": safe, "flash": flash}
+        except JobCancelled:
+            trace.status = "cancelled"
+            return None
+
+
+def deliver_regenerate(job):
+    if job.state == "cancelled":
+        st.toast("Regeneration cancelled")
+        return
+    if job.state == "failed":
+        st.session_state["regen_error"] = str(job.error)
+        return
+    result, notes = job.result, job.meta["notes"]
+    st.session_state["raw_html"] = result["raw"]
+    st.session_state["html"] = result["html"]
+    record_version("Regenerate: " + (notes.strip().splitlines() or ["(no notes)"])[0][:40])
+    st.session_state["regen_flash"] = result["flash"] + ["✅ Regenerated successfully"]
+
+
+def poll_generation_job():
+    """Apply the session's job once it has finished, on this script thread."""
+    job = current_job()
+    if job is None or not job.done:
+        return
+    st.session_state.pop("job_id", None)
+    if job.kind == "regenerate":
+        deliver_regenerate(job)
+    else:
+        deliver_generate(job)
+
+
+@st.fragment(run_every=SETTINGS.job_poll_ms / 1000)
+def generation_job_panel():
+    """Status, queue position, live preview and Cancel for the running job.
+
+    Reruns on its own every GENWEBLY_JOB_POLL_MS; once the job has finished
+    it reruns the whole app, which delivers the result.
+    """
+    job = current_job()
+    if job is None:
+        return
+    if job.done:
+        st.rerun(scope="app")
+    status, cancel = st.columns([5, 1])
+    with status:
+        if job.cancelled:
+            st.caption("Cancelling…")
+        elif job.queue:
+            position, eta = job.queue
+            st.caption(f"⏳ Queued behind other requests: position {position} · about {max(1, round(eta))}s")
+        else:
+            action = "Designing with Gemini" if job.kind == "generate" else "Regenerating"
+            st.caption(f"✨ {action}… {job.progress} ({job.elapsed():.0f}s)")
+    with cancel:
+        st.button("Cancel", key="cancel_job", on_click=cancel_job, disabled=job.cancelled)
+    if job.partial:
+        show_job_preview(job.partial)
+    elif job.meta.get("similar"):
+        show_similar_page(job)
+
+
+if st.button("Generate", type="primary"):
+    if not get_backend().available:
+        st.session_state["html"] = "<html><body><h2>❌ No API key found in .env</h2></body></html>"
+    else:
+        img_mode, img_value = resolve_image_input()
+        spec = {
+            "prompt": prompt,
+            "user_prompt": prompt or "minimal landing page",
+            "img_mode": img_mode,
+            "img_value": img_value,
+            "image_src": img_value if img_mode in ("url", "data") else None,
+            "stack_langs": list(st.session_state["stack_langs"]),
+            "js_mode": js_mode,
+            "js_use": js_use,
+            "n_variants": int(n_variants),
+            "bypass": bypass_cache,
+            "stream": stream_preview,
+            "sections": parallel_sections,
+        }
+        cache, backend, index = get_generation_cache(), get_backend(), get_prompt_index()
+        submit_job("generate", lambda job: run_generate_job(job, spec, cache, backend, index), spec)
+
+poll_generation_job()
+generation_job_panel()
 
 
 # ------------------ 7) Preview (device frames + Source with split option) ------------------
-tab1, tab2 = st.tabs(["Preview", "Source"])
-with tab1:
+@st.fragment
+def preview_panel():
+    """Variant gallery and device preview; device and height changes rerun only this panel.
+
+    Reads html / variants from session state. Promoting a variant replaces
+    the page, which reruns the whole app.
+    """
+    rerun_app_if_page_changed()
     st.markdown("### Preview")
     st.info(
     "**Live Preview Notice**\n\n"
@@ -786,84 +758,82 @@ with tab1:
 )
 
 
+    # --- VARIANT GALLERY ---
+    variants = st.session_state.get("variants") or []
+    if len(variants) > 1:
+        st.markdown("#### Variants")
+        cols = st.columns(min(3, len(variants)))
+        for i, v in enumerate(variants):
+            with cols[i % len(cols)]:
+                if v["error"]:
+                    st.warning(f"Variant {v['index'] + 1} failed: {v['error']}")
+                    continue
+                st.components.v1.html(
+                    thumbnail_html(get_asset_store().resolve_for_preview(v["html"])),
+                    height=270,
+                )
+                st.caption(
+                    f"#{v['index'] + 1} · temperature {v['config']['temperature']} · {v['seconds']:.1f}s"
+                )
+                st.button(
+                    "Use this design",
+                    key=f"use_variant_{i}",
+                    on_click=promote_variant,
+                    args=(i,),
+                    disabled=v["html"] == st.session_state.get("html"),
+                )
+
     # --- DEVICE SELECTION ---
     device = st.radio(
         "Device",
-        ["Mobile", "Tablet", "Laptop", "Desktop"],
+        list(DEVICE_WIDTHS),
         horizontal=True,
+        key="device",
     )
-
-    # --- WIDTH MAPPING ---
-    if device == "Mobile":
-        w = 375
-    elif device == "Tablet":
-        w = 768
-    elif device == "Laptop":
-        w = 1280
-    else:
-        w = 1440
+    w = DEVICE_WIDTHS[device]
 
     height_px = st.slider("Frame height", 600, 1400, 900, 50)
 
     # --- PREVIEW RENDER ---
-    preview_html = f"""
-    <!doctype html>
-    <html>
-    <head>
-      <meta charset="utf-8" />
-      <meta name="viewport" content="width=device-width, initial-scale=1" />
-      <style>
-        body {{
-          margin: 0;
-          padding: 24px 12px;
-          background: #0b0f1a;
-          font-family: system-ui, -apple-system, Segoe UI, Roboto;
-        }}
-        .frame {{
-          width: {w}px;
-          height: {height_px}px;
-          margin: 0 auto;
-          border-radius: 18px;
-          border: 1px solid rgba(120,130,150,.35);
-          box-shadow: 0 20px 60px rgba(0,0,0,.18);
-          overflow: auto;
-          background: #fff;
-        }}
-      </style>
-    </head>
-    <body>
-      <div class="frame">
-        {st.session_state.get("html", "")}
-      </div>
-    </body>
-    </html>
-    """
-
-    st.components.v1.html(preview_html, height=height_px + 100, scrolling=True)
-
-
-
+    # Only the content hash and frame size travel on reruns; the document is
+    # re-sent when it changes.
+    page_html = st.session_state.get("html", "")
+    with Trace("preview", emit=False), span("preview_render"):
+        preview_frame(page_html, w, height_px, asset_urls=get_asset_store().preview_urls(page_html))
 
 
-with tab2:
+@st.fragment
+def source_panel():
+    """Source view and downloads; reads html / raw_html from session state only."""
     src_mode = st.radio(
         "Source view",
         ["Single HTML file", "HTML / CSS / JS"],
         horizontal=True,
     )
+    optimize = st.checkbox(
+        "Optimize downloads for load speed",
+        value=False,
+        key="optimize_export",
+        help="Defers scripts, inlines critical CSS, lazy-loads and sizes images, preloads the hero image and minifies. The preview and source view stay unchanged.",
+    )
+    report = None
 
     if src_mode == "Single HTML file":
         st.code(st.session_state["html"], language="html")
         if st.session_state["html"]:
+            if optimize:
+                page, report = optimized_single_file(st.session_state["html"])
+            else:
+                page = inline_assets(st.session_state["html"])
             st.download_button(
                 "Download single HTML",
-                st.session_state["html"].encode("utf-8"),
+                page.encode("utf-8"),
                 "generated.html",
                 "text/html",
             )
     else:
         raw_src = st.session_state.get("raw_html") or st.session_state["html"]
-        html_main, css_code, js_code = split_html_assets(raw_src)
+        html_main, css_code, js_code = source_files(raw_src)
 
         if html_main:
             st.markdown("**index.html**")
@@ -875,36 +845,46 @@ with tab2:
             st.markdown("**script.js**")
             st.code(js_code, language="javascript")
 
-        col_dl1, col_dl2, col_dl3 = st.columns(3)
         if html_main:
-            with col_dl1:
-                st.download_button(
-                    "Download index.html",
-                    html_main.encode("utf-8"),
-                    "index.html",
-                    "text/html",
-                )
-        if css_code:
-            with col_dl2:
-                st.download_button(
-                    "Download styles.css",
-                    css_code.encode("utf-8"),
-                    "styles.css",
-                    "text/css",
-                )
-        if js_code:
-            with col_dl3:
-                st.download_button(
-                    "Download script.js",
-                    js_code.encode("utf-8"),
-                    "script.js",
-                    "application/javascript",
-                )
+            precompress = st.checkbox(
+                "Include precompressed copies (.gz/.br)",
+                value=False,
+                help="For static hosts that serve precompressed files next to the originals (.br needs the brotli package).",
+            )
+            data, report = site_zip(raw_src, precompress, optimize)
+            st.download_button(
+                "Download project (.zip)",
+                data,
+                "genwebly-site.zip",
+                "application/zip",
+            )
+
+    if report is not None:
+        with st.expander("Load-performance report", expanded=False):
+            st.text(format_report(report))
+
+
+tab1, tab2 = st.tabs(["Preview", "Source"])
+with tab1:
+    preview_panel()
+with tab2:
+    source_panel()
 
 # ------------------ Regenerate (FINAL) ------------------
-if st.session_state.get("html"):
+@st.fragment
+def regenerate_panel():
+    """Revision form and version history; typing and toggles rerun only this panel.
+
+    A successful revision, undo, redo or jump replaces the page and reruns
+    the whole app so the preview and source views pick it up.
+    """
+    rerun_app_if_page_changed()
     st.markdown("---")
     st.subheader("Regenerate / Apply Changes")
+    for message in st.session_state.pop("regen_flash", []):
+        st.caption(message)
+    if "regen_error" in st.session_state:
+        st.error(st.session_state.pop("regen_error"))
 
     regen_notes = st.text_area(
         "Describe the changes you want",
@@ -923,75 +903,67 @@ if st.session_state.get("html"):
         placeholder="e.g. small square logo near title, opacity 0.8",
     )
 
-    do_regen = st.button("Regenerate")
-
-    if do_regen and API_KEY:
-        with st.spinner("Regenerating..."):
-            try:
-                # --- stack rules ---
-                applicable, _ = check_stack_applicability(st.session_state["stack_langs"])
-                stack_rules = build_stack_rules(
-                    st.session_state["stack_langs"] if applicable else [],
-                    js_mode,
-                    js_use,
-                )
-
-                # --- model ---
-                model = genai.GenerativeModel(
-                    "gemini-2.5-flash",
-                    generation_config={"temperature": 0.25},
-                )
-
-                # --- source HTML ---
-                current_html = (
-                    st.session_state.get("raw_html")
-                    or st.session_state.get("html")
-                    or "<html><body></body></html>"
-                )
-
-                # --- revision prompt ---
-                req = build_revision_prompt(
-                    change_list=regen_notes,
-                    current_html=current_html,
-                    stack_rules=stack_rules,
-                    extra_image_src="",
-                    image_place_hint="",
-                    svg_hint="",
-                    logic_fixes="",
-                )
-
-                resp = model.generate_content(req)
-                new_html = (resp.text or "").strip()
-
-                # --- save raw ---
-                st.session_state["raw_html"] = new_html
-
-                # --- sanitize ---
-                safe = sanitize_html(new_html)
+    regen_bypass_cache = st.checkbox(
+        "Skip cache for this regeneration",
+        value=False,
+        key="regen_bypass_cache",
+    )
 
-                # --- image patch (ONLY if user uploaded + placement given) ---
-                if extra_image_upload and image_place_hint:
-                    img_src = file_to_data_url(extra_image_upload)
-                    safe = apply_explicit_image_patch(
-                        safe,
-                        img_src,
-                        image_place_hint,
-                        st.session_state.get("last_prompt", ""),
-                    )
+    scoped_regen = st.checkbox(
+        "Only send the affected sections (faster on big pages)",
+        value=True,
+        key="scoped_regen",
+        help="Falls back to a full-page revision when the change touches most of the page.",
+    )
 
-                # --- final postprocess ---
-                safe = postprocess_html(
-                    safe,
-                    hero_image_url="",  # ❗ DO NOT FORCE HERO IMAGE
-                    prompt_text=(
-                        st.session_state.get("last_prompt", "") + " " + regen_notes
-                    ),
-                )
+    do_regen = st.button("Regenerate")
 
-                # --- update preview ---
-                st.session_state["html"] = safe
+    if do_regen and get_backend().available:
+        # --- source HTML ---
+        current_html = (
+            st.session_state.get("raw_html")
+            or st.session_state.get("html")
+            or "<html><body></body></html>"
+        )
+        spec = {
+            "notes": regen_notes,
+            "scoped": scoped_regen,
+            "bypass": regen_bypass_cache,
+            "stack_langs": list(st.session_state["stack_langs"]),
+            "js_mode": st.session_state.get("stack_js_mode", "Static"),
+            "js_use": st.session_state.get("stack_js_use", ""),
+            "current_html": current_html,
+            "last_prompt": st.session_state.get("last_prompt", ""),
+            "img_src": file_to_asset_ref(extra_image_upload) if extra_image_upload and image_place_hint else None,
+            "place_hint": image_place_hint,
+        }
+        cache, backend = get_generation_cache(), get_backend()
+        submit_job("regenerate", lambda job: run_regenerate_job(job, spec, cache, backend), spec)
+        # the job panel and its polling live in the main page
+        st.rerun(scope="app")
+
+    # --- VERSION HISTORY ---
+    history = get_history()
+    if len(history) > 1:
+        st.markdown("#### Version history")
+        versions = {v.id: v for v in history.versions()}
+        h1, h2, h3 = st.columns([1, 1, 4])
+        with h1:
+            st.button("↶ Undo", on_click=undo_version, disabled=not history.can_undo)
+        with h2:
+            st.button("↷ Redo", on_click=redo_version, disabled=not history.can_redo)
+        with h3:
+            st.session_state["history_pick"] = history.current_id
+            st.selectbox(
+                "Jump to version",
+                list(reversed(versions)),
+                format_func=lambda vid: f"v{vid} · {versions[vid].label} · {time.strftime('%H:%M:%S', time.localtime(versions[vid].created))}",
+                key="history_pick",
+                on_change=jump_to_version,
+                label_visibility="collapsed",
+            )
+        st.caption(f"{len(history)} versions · {history.memory_bytes() / 1024:.0f} KB stored")
 
-                st.success("Regenerated successfully")
 
-            except Exception as e:
-                st.error(e)
+if st.session_state.get("html"):
+    regenerate_panel()
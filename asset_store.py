@@ -0,0 +1,191 @@
+"""Content-addressed store for uploaded images.
+
+Uploads are hashed once and written to disk (optionally downscaled and
+recompressed). The working HTML only carries short ``asset://<id>``
+references; they are resolved to static URLs for the preview and inlined as
+data URLs (or bundled as files) only at export time. Past ``max_bytes`` the
+oldest files are deleted; references to them are left unresolved.
+"""
+
+import io
+import os
+import re
+import base64
+import hashlib
+import threading
+from functools import lru_cache
+
+
+@lru_cache(maxsize=1)
+def _pil_image():
+    """PIL.Image, imported on the first upload rather than at app start (None without Pillow)."""
+    try:
+        from PIL import Image
+    except ImportError:  # Pillow is optional; without it images are stored as uploaded
+        return None
+    return Image
+
+ASSET_SCHEME = "asset://"
+ASSET_REF_RE = re.compile(r"asset://([0-9a-f]{16})")
+
+_MIME_BY_EXT = {"png": "image/png", "jpg": "image/jpeg", "jpeg": "image/jpeg", "webp": "image/webp", "gif": "image/gif"}
+
+
+class AssetStore:
+    def __init__(
+        self,
+        root: str = "static/assets",
+        max_dim: int = 1600,
+        jpeg_quality: int = 82,
+        url_prefix: str = "app/static/assets",
+        max_bytes: int = 500 * 1024 * 1024,
+    ):
+        self.root = root
+        self.max_dim = max_dim
+        self.jpeg_quality = jpeg_quality
+        self.url_prefix = url_prefix.rstrip("/")
+        self.max_bytes = max_bytes
+        self._files = {}  # asset id -> file name
+        self._bytes = 0
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        for name in os.listdir(root):
+            stem, _, ext = name.partition(".")
+            if ext in _MIME_BY_EXT:
+                self._files[stem] = name
+                self._bytes += os.path.getsize(os.path.join(root, name))
+
+    # ------------------ writing ------------------
+    def put(self, data: bytes, ext: str = "png") -> str:
+        """Store image bytes and return an ``asset://<id>`` reference."""
+        asset_id = hashlib.sha256(data).hexdigest()[:16]
+        with self._lock:
+            if asset_id in self._files:
+                return ASSET_SCHEME + asset_id
+        data, ext = self._shrink(data, ext.lower())
+        name = f"{asset_id}.{ext}"
+        path = os.path.join(self.root, name)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with self._lock:
+            if asset_id not in self._files:
+                self._bytes += len(data)
+            self._files[asset_id] = name
+            if self.max_bytes and self._bytes > self.max_bytes:
+                self._evict(keep=asset_id)
+        return ASSET_SCHEME + asset_id
+
+    def _evict(self, keep: str):
+        """Delete oldest-first until under 90% of ``max_bytes``; ``keep`` (the new upload) stays."""
+        entries = []
+        for asset_id, name in self._files.items():
+            try:
+                st_ = os.stat(os.path.join(self.root, name))
+            except OSError:
+                continue
+            entries.append((st_.st_mtime, st_.st_size, asset_id, name))
+        self._bytes = sum(e[1] for e in entries)
+        target = int(self.max_bytes * 0.9)
+        for _mtime, size, asset_id, name in sorted(entries):
+            if self._bytes <= target:
+                break
+            if asset_id == keep:
+                continue
+            try:
+                os.remove(os.path.join(self.root, name))
+            except OSError:
+                continue
+            del self._files[asset_id]
+            self._bytes -= size
+
+    def put_upload(self, file) -> str:
+        """Store a Streamlit UploadedFile (or any object with .name and .getvalue())."""
+        ext = file.name.rsplit(".", 1)[-1].lower() if "." in file.name else "png"
+        return self.put(file.getvalue(), ext)
+
+    def _shrink(self, data: bytes, ext: str):
+        """Downscale to ``max_dim`` and recompress; fall back to the original bytes."""
+        Image = _pil_image()
+        if Image is None or not self.max_dim:
+            return data, ext
+        try:
+            img = Image.open(io.BytesIO(data))
+            img.load()
+        except Exception:
+            return data, ext
+        if max(img.size) <= self.max_dim and len(data) < 512 * 1024:
+            return data, ext
+        img.thumbnail((self.max_dim, self.max_dim))
+        out = io.BytesIO()
+        has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+        if has_alpha:
+            img.save(out, format="PNG", optimize=True)
+            new_ext = "png"
+        else:
+            img.convert("RGB").save(out, format="JPEG", quality=self.jpeg_quality, optimize=True, progressive=True)
+            new_ext = "jpg"
+        if out.tell() >= len(data):
+            return data, ext
+        return out.getvalue(), new_ext
+
+    # ------------------ reading ------------------
+    def file_name(self, asset_id: str):
+        return self._files.get(asset_id)
+
+    def read(self, asset_id: str) -> bytes:
+        with open(os.path.join(self.root, self._files[asset_id]), "rb") as f:
+            return f.read()
+
+    def mime(self, asset_id: str) -> str:
+        return _MIME_BY_EXT.get(self._files[asset_id].rsplit(".", 1)[-1], "application/octet-stream")
+
+    def data_url(self, asset_id: str) -> str:
+        return _data_url(self, asset_id)
+
+    # ------------------ HTML rewriting ------------------
+    def resolve_for_preview(self, html: str) -> str:
+        """Point asset references at the static file server (no base64 involved)."""
+        if ASSET_SCHEME not in (html or ""):
+            return html
+        return ASSET_REF_RE.sub(lambda m: self._url(m.group(1)), html)
+
+    def preview_urls(self, html: str) -> dict:
+        """{asset id: static URL} for the references in ``html`` (resolved client-side)."""
+        if ASSET_SCHEME not in (html or ""):
+            return {}
+        return {i: self._url(i) for i in set(ASSET_REF_RE.findall(html)) if i in self._files}
+
+    def inline(self, html: str) -> str:
+        """Replace asset references with data URLs for a self-contained export."""
+        if ASSET_SCHEME not in (html or ""):
+            return html
+        return ASSET_REF_RE.sub(lambda m: self.data_url(m.group(1)) if m.group(1) in self._files else m.group(0), html)
+
+    def bundle(self, html: str, folder: str = "assets"):
+        """Rewrite references to relative paths; return (html, {path: bytes})."""
+        files = {}
+
+        def repl(m):
+            asset_id = m.group(1)
+            name = self._files.get(asset_id)
+            if not name:
+                return m.group(0)
+            path = f"{folder}/{name}"
+            if path not in files:
+                files[path] = self.read(asset_id)
+            return path
+
+        if ASSET_SCHEME not in (html or ""):
+            return html, files
+        return ASSET_REF_RE.sub(repl, html), files
+
+    def _url(self, asset_id: str) -> str:
+        name = self._files.get(asset_id)
+        return f"{self.url_prefix}/{name}" if name else ASSET_SCHEME + asset_id
+
+
+@lru_cache(maxsize=32)
+def _data_url(store: AssetStore, asset_id: str) -> str:
+    return f"data:{store.mime(asset_id)};base64," + base64.b64encode(store.read(asset_id)).decode("ascii")
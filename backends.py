@@ -0,0 +1,367 @@
+"""Model backends.
+
+Every model call goes through a ``ModelBackend`` (generate, stream,
+count_tokens). ``GeminiBackend`` builds its SDK client once and reuses it for
+all calls, passing the generation config per request. ``FakeBackend``
+returns canned or synthesized HTML after a configurable delay, so the whole
+pipeline can be profiled and tested offline.
+"""
+
+import os
+import re
+import json
+import time
+import random
+import hashlib
+import threading
+from collections import deque
+
+from metrics import record_usage
+
+DEFAULT_MODEL = "gemini-2.5-flash"
+
+
+class ModelBackend:
+    name = "base"
+    model_name = DEFAULT_MODEL
+
+    @property
+    def available(self) -> bool:
+        return True
+
+    def generate(self, req: str, generation_config: dict) -> str:
+        raise NotImplementedError
+
+    def stream(self, req: str, generation_config: dict):
+        """Yield text chunks; the default just yields the full answer once."""
+        yield self.generate(req, generation_config)
+
+    def count_tokens(self, req: str) -> int:
+        return max(1, len(req or "") // 4)
+
+
+class GeminiBackend(ModelBackend):
+    name = "gemini"
+
+    def __init__(self, api_key: str, model_name: str = DEFAULT_MODEL, request_timeout: float = None):
+        self.api_key = api_key
+        self.model_name = model_name
+        self.request_timeout = request_timeout  # HTTP-level timeout, so abandoned calls end too
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def available(self) -> bool:
+        return bool(self.api_key)
+
+    def _client(self):
+        # The SDK is imported and configured on first use, then reused.
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    import google.generativeai as genai
+
+                    genai.configure(api_key=self.api_key)
+                    self._model = genai.GenerativeModel(self.model_name)
+        return self._model
+
+    def _request_options(self):
+        return {"timeout": self.request_timeout} if self.request_timeout else None
+
+    def generate(self, req, generation_config):
+        resp = self._client().generate_content(
+            req, generation_config=generation_config, request_options=self._request_options()
+        )
+        text = (resp.text or "").strip()
+        _record_usage(getattr(resp, "usage_metadata", None), text)
+        return text
+
+    def stream(self, req, generation_config):
+        usage, size = None, 0
+        for chunk in self._client().generate_content(
+            req, generation_config=generation_config, stream=True, request_options=self._request_options()
+        ):
+            usage = getattr(chunk, "usage_metadata", None) or usage  # totals arrive on the last chunk
+            try:
+                text = chunk.text
+            except ValueError:
+                # chunks without text parts (e.g. safety/finish metadata)
+                continue
+            if text:
+                size += len(text.encode("utf-8"))
+                yield text
+        _record_usage(usage, size=size)
+
+    def count_tokens(self, req):
+        return self._client().count_tokens(req).total_tokens
+
+
+def _record_usage(usage, text: str = "", size: int = None):
+    record_usage(
+        getattr(usage, "prompt_token_count", 0),
+        getattr(usage, "candidates_token_count", 0),
+        len(text.encode("utf-8")) if size is None else size,
+    )
+
+
+class FakeServiceUnavailable(Exception):
+    pass
+
+
+class FakeResourceExhausted(Exception):
+    pass
+
+
+class FakeBackend(ModelBackend):
+    """Deterministic offline backend.
+
+    ``latency`` seconds (+/- ``jitter``) per call; streaming spreads the delay
+    over ~``chunk_chars``-sized chunks. ``error_rate`` of calls raise a
+    retryable 503 and ``tail_rate`` take ``tail_latency`` seconds instead, to
+    exercise retries and hedging. ``char_latency`` adds seconds per 1000
+    characters of answer, like a model's output speed. With ``rpm_limit`` / ``tpm_limit`` it
+    enforces a simulated quota over a sliding minute and raises a 429 like
+    Gemini's ResourceExhausted beyond it. Answers come from ``responses_dir``
+    (``<sha256 of request>.html`` or ``default.html``) when present, otherwise
+    they are synthesized from the request, seeded by its hash.
+    """
+
+    name = "fake"
+
+    def __init__(
+        self,
+        latency: float = 0.5,
+        jitter: float = 0.0,
+        responses_dir: str = "",
+        chunk_chars: int = 400,
+        model_name: str = "fake-html",
+        error_rate: float = 0.0,
+        tail_rate: float = 0.0,
+        tail_latency: float = 10.0,
+        seed: int = 0,
+        rpm_limit: int = 0,
+        tpm_limit: int = 0,
+        char_latency: float = 0.0,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.tail_rate = tail_rate
+        self.tail_latency = tail_latency
+        self._faults = random.Random(seed)  # per-call fault draws, reproducible per instance
+        self.responses_dir = responses_dir
+        self.chunk_chars = chunk_chars
+        self.model_name = model_name
+        self.calls = 0
+        self.char_latency = char_latency
+        self.rpm_limit = rpm_limit
+        self.tpm_limit = tpm_limit
+        self.quota_errors = 0
+        self._window = deque()  # (time, tokens) of calls in the last minute
+        self._lock = threading.Lock()
+
+    def _charge(self, req):
+        """Count one call against the simulated quota."""
+        if not (self.rpm_limit or self.tpm_limit):
+            return
+        tokens = self.count_tokens(req)
+        with self._lock:
+            now = time.monotonic()
+            while self._window and now - self._window[0][0] >= 60.0:
+                self._window.popleft()
+            used = sum(n for _t, n in self._window)
+            if (self.rpm_limit and len(self._window) >= self.rpm_limit) or (
+                self.tpm_limit and used + tokens > self.tpm_limit
+            ):
+                self.quota_errors += 1
+                raise FakeResourceExhausted("429 ResourceExhausted: fake quota exceeded")
+            self._window.append((now, tokens))
+
+    def _delay(self, rng):
+        with self._lock:
+            fail = self._faults.random() < self.error_rate
+            slow = self._faults.random() < self.tail_rate
+        if fail:
+            raise FakeServiceUnavailable("503 fake backend unavailable")
+        if slow:
+            return self.tail_latency
+        return max(0.0, self.latency + rng.uniform(-self.jitter, self.jitter))
+
+    def _rng(self, req, generation_config):
+        seed = hashlib.sha256(f"{req}|{sorted((generation_config or {}).items())}".encode("utf-8")).hexdigest()
+        return random.Random(seed), seed
+
+    def generate(self, req, generation_config):
+        with self._lock:
+            self.calls += 1
+        self._charge(req)
+        rng, seed = self._rng(req, generation_config)
+        delay = self._delay(rng)
+        text = self._answer(req, rng, seed)
+        time.sleep(delay + len(text) / 1000 * self.char_latency)
+        record_usage(self.count_tokens(req), self.count_tokens(text), len(text.encode("utf-8")))
+        return text
+
+    def stream(self, req, generation_config):
+        with self._lock:
+            self.calls += 1
+        self._charge(req)
+        rng, seed = self._rng(req, generation_config)
+        delay = self._delay(rng)
+        text = self._answer(req, rng, seed)
+        delay += len(text) / 1000 * self.char_latency
+        chunks = [text[i:i + self.chunk_chars] for i in range(0, len(text), self.chunk_chars)] or [""]
+        per_chunk = delay / len(chunks)
+        for c in chunks:
+            time.sleep(per_chunk)
+            yield c
+        record_usage(self.count_tokens(req), self.count_tokens(text), len(text.encode("utf-8")))
+
+    # ------------------ canned / synthesized answers ------------------
+    def _answer(self, req, rng, seed):
+        canned = self._canned(seed)
+        if canned is not None:
+            return canned
+        if "--- DESIGN SPEC ---" in req:
+            return synthesize_spec(req, rng)
+        if "--- SECTION TO WRITE ---" in req:
+            return synthesize_section(req, rng)
+        if "--- FRAGMENTS TO EDIT ---" in req:
+            return self._revise_fragments(req)
+        if "--- CURRENT HTML" in req:
+            current = req[req.index("--- CURRENT HTML"):].split("\n", 1)[-1]
+            return current.replace("</body>", "<!--applied: fake-revision--></body>", 1)
+        return synthesize_page(req, rng)
+
+    def _canned(self, seed):
+        if not self.responses_dir:
+            return None
+        for name in (seed + ".html", "default.html"):
+            path = os.path.join(self.responses_dir, name)
+            if os.path.exists(path):
+                with open(path, "r", encoding="utf-8") as f:
+                    return f.read()
+        return None
+
+    @staticmethod
+    def _revise_fragments(req):
+        frags = re.findall(r"(<!--section:([^>]+?)-->)(.*?)(<!--/section:\2-->)", req, re.S)
+        return "\n".join(f"{a}{body.rstrip()}<!--applied: fake-revision-->\n{d}" for a, _k, body, d in frags)
+
+
+_WORDS = "bright fresh modern calm bold simple clean warm friendly fast secure local handmade".split()
+
+
+def _topic(req: str) -> str:
+    m = re.search(r"User request:\n(.*?)\n\(temperature", req or "", re.S)
+    return (m.group(1) if m else "landing page").strip().splitlines()[0][:80] or "landing page"
+
+
+def synthesize_spec(req: str, rng=None) -> str:
+    """A design spec as section_gen.build_spec_prompt asks for it."""
+    rng = rng or random.Random(0)
+    topic = _topic(req)
+    features = [{"id": w, "title": w.title()} for w in rng.sample(_WORDS, 3)]
+    return json.dumps({
+        "site_name": topic.title()[:40],
+        "tagline": f"A {rng.choice(_WORDS)} and {rng.choice(_WORDS)} {topic}.",
+        "heading_font": "Georgia, serif",
+        "body_font": "system-ui, sans-serif",
+        "tone": f"{rng.choice(_WORDS)}, {rng.choice(_WORDS)}",
+        "features": features,
+    })
+
+
+def synthesize_section(req: str, rng=None) -> str:
+    """One section as section_gen.build_part_prompt asks for it: scoped <style> + element."""
+    rng = rng or random.Random(0)
+    m = re.search(r"Start the element with exactly: (<(\w+)[^>]*>)", req)
+    element, tag = (m.group(1), m.group(2)) if m else ("<section>", "section")
+    key = req.split("--- SECTION TO WRITE ---\n", 1)[-1].split(":", 1)[0]
+    if tag == "header":
+        links = re.findall(r'#([\w-]+) "([^"]+)"', req)
+        inner = "<strong>{}</strong><nav>{}</nav>".format(
+            _html_escape(_topic(req).title()), "".join(f'<a href="#{a}">{_html_escape(t)}</a>' for a, t in links)
+        )
+    else:
+        words = " ".join(rng.choice(_WORDS) for _ in range(rng.randint(12, 30)))
+        inner = f'<div class="container card"><h2>{_html_escape(key.title())}</h2><p>{words}.</p></div>'
+    return (
+        f"<style>\n  {tag}{'#' + key if tag == 'section' else ''} h2 {{ color: var(--primary); }}\n"
+        "  section { padding: 4rem 0; }\n</style>\n"
+        f"{element}\n  {inner}\n</{tag}>"
+    )
+
+
+def synthesize_page(req: str, rng=None) -> str:
+    """A plausible single-file landing page following build_prompt's STRUCTURE."""
+    rng = rng or random.Random(0)
+    topic = _topic(req)
+    title = _html_escape(topic.title())
+    hue = rng.randrange(360)
+    features = []
+    for i in range(3):
+        words = " ".join(rng.choice(_WORDS) for _ in range(rng.randint(12, 30)))
+        features.append(
+            f'    <section id="feature-{i + 1}" class="feature card">\n'
+            f"      <h2>{rng.choice(_WORDS).title()} {i + 1}</h2>\n      <p>{words}.</p>\n    </section>"
+        )
+    return f"""<!DOCTYPE html>
+<html lang="en">
+<head>
+  <meta charset="utf-8">
+  <meta name="viewport" content="width=device-width, initial-scale=1">
+  <title>{title}</title>
+  <style>
+    body {{ margin: 0; font-family: system-ui, sans-serif; color: hsl({hue}, 30%, 15%); }}
+    header {{ display: flex; justify-content: space-between; padding: 1rem 2rem; }}
+    nav a {{ margin-left: 1rem; }}
+    #hero {{ padding: 6rem 2rem; text-align: center; background: hsl({hue}, 70%, 92%); }}
+    .features {{ display: grid; grid-template-columns: repeat(auto-fit, minmax(220px, 1fr)); gap: 1rem; padding: 2rem; }}
+    footer {{ padding: 2rem; text-align: center; }}
+  </style>
+</head>
+<body>
+  <header>
+    <strong>{title}</strong>
+    <nav><a href="#hero">Home</a><a href="#features">Features</a><a href="#contact">Contact</a></nav>
+  </header>
+  <section id="hero">
+    <h1>{title}</h1>
+    <p>A {rng.choice(_WORDS)} and {rng.choice(_WORDS)} experience.</p>
+    <a class="cta" href="#features">Get started</a>
+  </section>
+  <main id="features" class="features">
+{chr(10).join(features)}
+  </main>
+  <footer id="contact">
+    <p>&copy; {title}</p>
+  </footer>
+  <script>
+    document.querySelectorAll('a[href^="#"]').forEach(a => a.addEventListener('click', () => {{}}));
+  </script>
+</body>
+</html>"""
+
+
+def _html_escape(s):
+    return s.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def create_backend(
+    kind: str = "gemini",
+    api_key: str = "",
+    model_name: str = DEFAULT_MODEL,
+    request_timeout: float = 120.0,
+    fake_options=None,
+) -> ModelBackend:
+    """Backend from a name ("gemini" or "fake"); ``fake_options`` are FakeBackend keyword arguments.
+
+    Nothing here reads the environment: settings.load_settings does, once.
+    """
+    kind = (kind or "gemini").lower()
+    if kind == "fake":
+        return FakeBackend(**(fake_options or {}))
+    if kind == "gemini":
+        return GeminiBackend(api_key, model_name, request_timeout=request_timeout)
+    raise ValueError(f"unknown backend: {kind!r}")
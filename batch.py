@@ -0,0 +1,229 @@
+"""Headless batch generation.
+
+Reads a JSONL file of jobs and writes index.html / styles.css / script.js per
+job. Jobs run with bounded concurrency behind a token-bucket rate limiter;
+finished jobs go to a checkpoint file so an interrupted run can be resumed.
+
+    python batch.py jobs.jsonl --out build/ --concurrency 4 --rpm 30
+
+One job per line:
+
+    {"id": "coffee", "prompt": "coffee shop landing page",
+     "stack": ["HTML", "CSS", "JS"], "js_mode": "Static", "js_use": "",
+     "image_url": "", "image_hint": "", "temperature": 0.8}
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pipeline
+from resilience import ResilientBackend
+from gen_cache import GenerationCache
+from scheduler import TokenBucket
+from metrics import Trace, span
+from webperf import format_report
+from themes import detect_visual_intent
+from settings import load_settings, make_model_backend
+
+
+def is_rate_limit_error(e: Exception) -> bool:
+    text = f"{type(e).__name__} {e}"
+    return "ResourceExhausted" in text or "429" in text or "quota" in text.lower()
+
+
+# ------------------ jobs ------------------
+def build_job_request(job: dict):
+    """(request text, generation config, image_src) for one job, same rules as the app."""
+    stack = job.get("stack") or []
+    applicable, _msg = pipeline.check_stack_applicability(stack)
+    stack_rules = pipeline.build_stack_rules(stack if applicable else [], job.get("js_mode", "Static"), job.get("js_use", ""))
+    prompt = job.get("prompt") or "minimal landing page"
+    temperature = float(job.get("temperature", 0.8))
+
+    img_mode, img_value = None, None
+    if job.get("image_url"):
+        img_mode, img_value = "url", job["image_url"].strip()
+    elif job.get("image_hint"):
+        img_mode, img_value = "svg", job["image_hint"].strip()
+    elif detect_visual_intent(prompt):
+        img_mode, img_value = "svg", prompt.strip()
+
+    req = pipeline.build_prompt(
+        prompt,
+        img_mode=img_mode,
+        img_hint=(img_value if img_mode == "svg" else None),
+        stack_rules=stack_rules,
+        temperature=temperature,
+    )
+    return req, {"temperature": temperature}, (img_value if img_mode == "url" else None)
+
+
+def run_job(job, out_dir, backend, cache, bucket, max_retries=5, optimize=False):
+    with Trace("batch", job=job["id"]) as trace:
+        result = _run_job(job, out_dir, backend, cache, bucket, max_retries, optimize)
+        result.update(trace.usage)
+        return result
+
+
+def _run_job(job, out_dir, backend, cache, bucket, max_retries, optimize):
+    with span("prompt_build"):
+        req, config, image_src = build_job_request(job)
+    attempt = 0
+    waited = 0.0
+    t0 = time.perf_counter()
+    while True:
+        with span("rate_limit_wait"):
+            waited += bucket.acquire()
+        try:
+            raw = pipeline.generate_html(req, config, backend, cache=cache)
+            break
+        except Exception as e:
+            attempt += 1
+            if attempt > max_retries or not is_rate_limit_error(e):
+                raise
+            backoff = min(60.0, 2 ** attempt) * (0.5 + random.random())
+            time.sleep(backoff)
+            waited += backoff
+    model_s = time.perf_counter() - t0
+
+    page = pipeline.render_generated_page(raw, prompt_text=job.get("prompt", ""), image_src=image_src)
+    with span("split_assets"):
+        html_main, css, js = pipeline.split_html_assets(page)
+    perf = None
+    if optimize:
+        with span("optimize"):
+            html_main, perf = pipeline.optimize_site(html_main, css)
+
+    with span("write"):
+        job_dir = os.path.join(out_dir, job["id"])
+        os.makedirs(job_dir, exist_ok=True)
+        for name, content in (("index.html", html_main), ("styles.css", css), ("script.js", js)):
+            if content:
+                with open(os.path.join(job_dir, name), "w", encoding="utf-8") as f:
+                    f.write(content)
+        if perf is not None:
+            with open(os.path.join(job_dir, "perf-report.txt"), "w", encoding="utf-8") as f:
+                f.write(format_report(perf) + "\n")
+    result = {
+        "id": job["id"],
+        "status": "ok",
+        "seconds": round(time.perf_counter() - t0, 3),
+        "model_seconds": round(model_s, 3),
+        "waited_seconds": round(waited, 3),
+        "retries": attempt,
+        "bytes": len(page.encode("utf-8")),
+    }
+    if perf is not None:
+        result["index_bytes"] = [perf.before.bytes, perf.after.bytes]
+        result["render_blocking"] = [len(perf.before.blocking), len(perf.after.blocking)]
+    return result
+
+
+def load_jobs(path):
+    jobs = []
+    with open(path, "r", encoding="utf-8") as f:
+        for n, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            job = json.loads(line)
+            job["id"] = re.sub(r"[^\w.-]+", "-", str(job.get("id") or f"job-{n}"))
+            jobs.append(job)
+    return jobs
+
+
+def load_checkpoint(path):
+    done = set()
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue  # torn last line from a killed run
+                if rec.get("status") == "ok":
+                    done.add(rec["id"])
+    return done
+
+
+# ------------------ CLI ------------------
+def main(argv=None):
+    settings = load_settings()  # before the parser: its defaults come from GENWEBLY_* and .env
+    ap = argparse.ArgumentParser(description="Generate landing pages in bulk from a JSONL file.")
+    ap.add_argument("jobs", help="JSONL file, one job per line")
+    ap.add_argument("--out", default="batch_output", help="output directory (one folder per job)")
+    ap.add_argument("--concurrency", type=int, default=4, help="max model calls in flight")
+    ap.add_argument("--rpm", type=float, default=30.0, help="requests per minute (0 = unlimited)")
+    ap.add_argument("--burst", type=float, default=2.0, help="token bucket capacity")
+    ap.add_argument("--checkpoint", default=None, help="checkpoint file (default: <out>/checkpoint.jsonl)")
+    ap.add_argument("--cache-dir", default=settings.cache_dir, help="generation cache dir ('' to disable)")
+    ap.add_argument("--max-retries", type=int, default=5, help="retries per job on rate-limit errors")
+    ap.add_argument("--timeout", type=float, default=settings.timeout_s, help="per-call deadline in seconds")
+    ap.add_argument("--optimize", action="store_true", help="run the load-performance pass on index.html (writes perf-report.txt)")
+    ap.add_argument("--backend", default=settings.backend, choices=("gemini", "fake"), help="model backend ('fake' runs offline)")
+    args = ap.parse_args(argv)
+
+    # deadline only; rate-limit retries are handled per job below, in step with the token bucket
+    backend = ResilientBackend(
+        make_model_backend(settings._replace(backend=args.backend, timeout_s=args.timeout)),
+        timeout=args.timeout,
+        max_retries=0,
+        max_workers=max(1, args.concurrency) * 2,
+    )
+    if not backend.available:
+        print("GEMINI_API_KEY is not set", file=sys.stderr)
+        return 2
+
+    os.makedirs(args.out, exist_ok=True)
+    checkpoint = args.checkpoint or os.path.join(args.out, "checkpoint.jsonl")
+    jobs = load_jobs(args.jobs)
+    done = load_checkpoint(checkpoint)
+    todo = [j for j in jobs if j["id"] not in done]
+    print(f"{len(jobs)} jobs, {len(done)} already done, {len(todo)} to run")
+
+    cache = GenerationCache(cache_dir=args.cache_dir) if args.cache_dir else None
+    bucket = TokenBucket(args.rpm / 60.0, args.burst)
+    lock = threading.Lock()
+    results = []
+    t0 = time.perf_counter()
+
+    with open(checkpoint, "a", encoding="utf-8") as ck, ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as pool:
+        futures = {pool.submit(run_job, j, args.out, backend, cache, bucket, args.max_retries, args.optimize): j for j in todo}
+        for fut in as_completed(futures):
+            job = futures[fut]
+            try:
+                rec = fut.result()
+            except Exception as e:
+                rec = {"id": job["id"], "status": "error", "error": str(e)}
+            with lock:
+                ck.write(json.dumps(rec) + "\n")
+                ck.flush()
+                results.append(rec)
+            print(f"[{len(results)}/{len(todo)}] {rec['id']}: {rec['status']}" + (f" ({rec['seconds']}s)" if rec["status"] == "ok" else f" - {rec['error']}"))
+
+    wall = time.perf_counter() - t0
+    ok = [r for r in results if r["status"] == "ok"]
+    print("\n--- summary ---")
+    print(f"ok: {len(ok)}  failed: {len(results) - len(ok)}  skipped (checkpoint): {len(done)}")
+    print(f"wall time: {wall:.1f}s  throughput: {len(ok) / wall * 60 if wall else 0:.1f} pages/min")
+    if ok:
+        lat = sorted(r["seconds"] for r in ok)
+        print(
+            f"latency p50: {lat[len(lat) // 2]:.1f}s  max: {lat[-1]:.1f}s  "
+            f"rate-limit wait: {sum(r['waited_seconds'] for r in ok):.1f}s  retries: {sum(r['retries'] for r in ok)}"
+        )
+    if cache is not None:
+        s = cache.stats()
+        print(f"cache hits: {s['hits']}  misses: {s['misses']}")
+    return 0 if len(ok) == len(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,300 @@
+"""Post-processing micro-benchmarks over a synthetic HTML corpus.
+
+    python -m benchmarks.postprocess                  # compare against baseline.json
+    python -m benchmarks.postprocess --save-baseline  # record a new baseline
+    python -m benchmarks.postprocess --quick -k split # skip 5 MB pages, filter "target|case" keys
+
+For each (function, page) pair it reports throughput (MB/s at p50), p50/p99
+latency and peak allocation (tracemalloc, measured in a separate run so it
+does not skew timings). Timings are divided by a small calibration workload
+before being compared, so a baseline recorded on one machine stays usable on
+another. The run exits with status 1 if any best-of-N time or peak allocation
+is worse than the baseline by more than ``--threshold`` twice: entries over it
+are measured again, after a fresh calibration, before the run fails.
+"""
+
+import os
+import re
+import sys
+import gc
+import json
+import time
+import random
+import argparse
+import tracemalloc
+
+import pipeline
+from page_engine import remove_sparkle_blocks
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+KB = 1024
+MB = 1024 * KB
+
+
+# ------------------ corpus ------------------
+_LOREM = (
+    "artisan coffee roasted daily fresh pastries cozy corner free wifi seasonal menu "
+    "friendly baristas single origin beans pour over espresso cold brew oat milk"
+).split()
+
+
+def _text(rng, n_words):
+    return " ".join(rng.choice(_LOREM) for _ in range(n_words))
+
+
+def _links(rng, n):
+    hrefs = ["/", "#", "#about", "/pricing", "/blog/post-{}", "https://example.com/p/{}", "http://cdn.example.org/{}", "mailto:hi@example.com"]
+    out = []
+    for i in range(n):
+        h = rng.choice(hrefs).format(i)
+        extra = ' target="_blank"' if h.startswith("http") and rng.random() < 0.2 else ""
+        out.append(f'<a href="{h}"{extra}>{rng.choice(_LOREM)}</a>')
+    return " ".join(out)
+
+
+def make_page(target_bytes: int, seed: int = 0, base64_images: bool = False, blocks: int = 3) -> str:
+    """A landing page of roughly ``target_bytes`` with nav/hero/sections/footer,
+    ``blocks`` inline <style> and <script> blocks, dense links and optional data-URL images."""
+    rng = random.Random(seed)
+    head = ["<!DOCTYPE html>\n<html lang=\"en\">\n<head>\n<meta charset=\"utf-8\">\n<title>Bench</title>\n"]
+    for i in range(blocks):
+        rules = "\n".join(f".c{i}-{j} {{ padding: {j}px; color: #{rng.randrange(0xFFFFFF):06x}; }}" for j in range(40))
+        head.append(f"<style>\n{rules}\n</style>\n")
+    head.append("</head>\n<body>\n")
+    body = [
+        "<header><nav>" + _links(rng, 8) + "</nav></header>\n",
+        '<section id="hero"><h1>Bench Cafe</h1><p>' + _text(rng, 30) + '</p><a class="cta" href="https://example.com/order">Order</a></section>\n',
+    ]
+    tail = [
+        '<section id="about"><h2>About</h2><p>' + _text(rng, 60) + "</p></section>\n",
+        '<section id="contact"><h2>Contact</h2><form><input type="date"><button>Send</button></form></section>\n',
+        "<footer>" + _links(rng, 6) + "</footer>\n",
+    ]
+    for i in range(blocks):
+        tail.append(f"<script>\ndocument.querySelectorAll('.c{i}').forEach(function (el) {{ el.dataset.n = '{i}'; }});\n</script>\n")
+    tail.append("</body>\n</html>\n")
+
+    size = sum(len(s) for s in head + body + tail)
+    i = 0
+    while size < target_bytes:
+        if base64_images and i % 4 == 3:
+            n = min(max(1024, (target_bytes - size) // 2), 256 * KB)
+            payload = "".join(rng.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/") for _ in range(64)) * (n // 64)
+            chunk = f'<section id="gallery-{i}"><img alt="photo" src="data:image/jpeg;base64,{payload}"></section>\n'
+        else:
+            chunk = (
+                f'<section id="feature-{i}" class="feature c{i % blocks}-{i % 40}"><h2>{_text(rng, 3)}</h2>'
+                f"<p>{_text(rng, 80)}</p><p>{_links(rng, 12)}</p></section>\n"
+            )
+        body.append(chunk)
+        size += len(chunk)
+        i += 1
+    return "".join(head + body + tail)
+
+
+def pathological_sparkles(target_bytes: int) -> str:
+    """Many <style> openers and #sparkles mentions with no closing </script>, the
+    worst case for the lazy legacy regex (every start re-scans to the end)."""
+    unit = "<style>.x{}</style><p>#sparkles glitter</p>\n"
+    return "<html><head></head><body>" + unit * max(1, target_bytes // len(unit)) + "</body></html>"
+
+
+def corpus(quick: bool = False):
+    """(case name, html) pairs."""
+    sizes = [("10k", 10 * KB), ("100k", 100 * KB), ("1m", MB)] + ([] if quick else [("5m", 5 * MB)])
+    for label, n in sizes:
+        yield f"page-{label}", make_page(n, seed=n)
+        yield f"b64-{label}", make_page(n, seed=n + 1, base64_images=True)
+    yield "sparkle-patho-4k", pathological_sparkles(4 * KB)
+    yield "sparkle-patho-100k", pathological_sparkles(100 * KB)
+    yield "sparkle-patho-1m", pathological_sparkles(MB)
+
+
+# ------------------ targets ------------------
+_LEGACY_SPARKLE_RE = re.compile(r"<style>[\s\S]*?#sparkles[\s\S]*?</script>")
+
+# name -> (callable, max input size or None)
+TARGETS = {
+    "sanitize_html": (pipeline.sanitize_html, None),
+    "postprocess_html": (lambda h: pipeline.postprocess_html(h, prompt_text="coffee shop, no sparkles"), None),
+    "apply_explicit_image_patch": (lambda h: pipeline.apply_explicit_image_patch(h, "https://example.com/a.png", "about section small", "coffee"), None),
+    # bypass the memoization so every run does the work
+    "split_html_assets": (pipeline.split_html_assets, None),
+    "render_generated_page": (lambda h: pipeline.render_generated_page(h, prompt_text="coffee shop, no sparkles", image_src="https://example.com/a.png", place_hint="hero"), None),
+    "remove_sparkle_blocks": (remove_sparkle_blocks, None),
+    # the regex it replaced backtracks super-linearly on pathological input; keep it to small pages
+    "legacy_sparkle_regex": (lambda h: _LEGACY_SPARKLE_RE.sub("", h), 8 * KB),
+}
+
+
+# ------------------ measurement ------------------
+def _calibrate() -> float:
+    """Seconds for a fixed regex + string workload; used to normalize timings."""
+    text = "abc def <a href=\"/x\">y</a> " * 20000
+    best = float("inf")
+    for _ in range(40):
+        t0 = time.perf_counter()
+        re.sub(r'href="/[^"]*"', 'href="#"', text).replace("abc", "xyz")
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def _percentile(sorted_vals, q):
+    if not sorted_vals:
+        return 0.0
+    idx = min(len(sorted_vals) - 1, max(0, int(round(q * (len(sorted_vals) - 1)))))
+    return sorted_vals[idx]
+
+
+def measure(fn, html: str, min_time: float = 0.3, min_runs: int = 5, max_runs: int = 200) -> dict:
+    fn(html)  # warm caches (compiled regexes, lru_cache'd themes)
+    times = []
+    gc.collect()
+    gc.disable()  # like timeit: keep collector pauses out of the numbers
+    try:
+        start = time.perf_counter()
+        while len(times) < max_runs and (len(times) < min_runs or time.perf_counter() - start < min_time):
+            t0 = time.perf_counter()
+            fn(html)
+            times.append(time.perf_counter() - t0)
+    finally:
+        gc.enable()
+    times.sort()
+
+    tracemalloc.start()
+    fn(html)
+    _cur, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    p50 = _percentile(times, 0.5)
+    size_mb = len(html.encode("utf-8")) / MB
+    return {
+        "runs": len(times),
+        "best_ms": times[0] * 1000,
+        "p50_ms": p50 * 1000,
+        "p99_ms": _percentile(times, 0.99) * 1000,
+        "mb_s": size_mb / p50 if p50 else float("inf"),
+        "peak_kb": peak / KB,
+    }
+
+
+def run(quick=False, pattern="", min_time=0.3, on_result=None):
+    """{"target|case": stats}; ``on_result(key, stats)`` is called as each one finishes."""
+    cases = list(corpus(quick))
+    results = {}
+    for name, (fn, max_bytes) in TARGETS.items():
+        for case, html in cases:
+            key = f"{name}|{case}"
+            if (max_bytes and len(html) > max_bytes) or (pattern and not re.search(pattern, key)):
+                continue
+            results[key] = measure(fn, html, min_time=min_time)
+            if on_result:
+                on_result(key, results[key])
+    return results
+
+
+# ------------------ baseline ------------------
+def load_baseline(path=BASELINE_PATH):
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_baseline(results, calibration, path=BASELINE_PATH):
+    data = {
+        "calibration_ms": round(calibration * 1000, 4),
+        "results": {k: {"best_ms": round(v["best_ms"], 4), "p50_ms": round(v["p50_ms"], 4), "peak_kb": round(v["peak_kb"], 1)} for k, v in sorted(results.items())},
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=1, sort_keys=True)
+        f.write("\n")
+
+
+def compare(results, calibration, baseline, threshold):
+    """Regression messages for entries worse than ``threshold`` (relative) vs the baseline."""
+    scale = calibration * 1000 / baseline["calibration_ms"] if baseline.get("calibration_ms") else 1.0
+    problems = []
+    for key, r in sorted(results.items()):
+        b = baseline["results"].get(key)
+        if not b:
+            continue
+        # gate on the fastest run (least disturbed by other load); sub-millisecond
+        # timings are mostly noise, so allow an absolute slack too
+        expected_ms = b["best_ms"] * scale
+        if r["best_ms"] > expected_ms * (1 + threshold) + 0.05:
+            problems.append(f"{key}: best {r['best_ms']:.2f} ms vs {expected_ms:.2f} ms (normalized baseline)")
+        if r["peak_kb"] > b["peak_kb"] * (1 + threshold) + 64:
+            problems.append(f"{key}: peak {r['peak_kb']:.0f} KB vs {b['peak_kb']:.0f} KB")
+    return problems
+
+
+def _row_printer(baseline=None, scale=1.0):
+    print(f"{'target|case':<50} {'MB/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'peak KB':>9} {'vs base':>8}")
+
+    def row(key, r):
+        delta = ""
+        b = (baseline or {}).get("results", {}).get(key)
+        if b and b["p50_ms"]:
+            delta = f"{r['p50_ms'] / (b['p50_ms'] * scale) - 1:+.0%}"
+        print(f"{key:<50} {r['mb_s']:>9.1f} {r['p50_ms']:>9.2f} {r['p99_ms']:>9.2f} {r['peak_kb']:>9.0f} {delta:>8}", flush=True)
+
+    return row
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmark the HTML post-processing functions.")
+    ap.add_argument("--quick", action="store_true", help="skip the 5 MB pages")
+    ap.add_argument("-k", dest="pattern", default="", help='only run "target|case" keys matching this regex')
+    ap.add_argument("--min-time", type=float, default=0.3, help="seconds to spend per (target, case)")
+    ap.add_argument("--threshold", type=float, default=0.25, help="allowed relative slowdown before failing")
+    ap.add_argument("--baseline", default=BASELINE_PATH, help="baseline JSON path")
+    ap.add_argument("--save-baseline", action="store_true", help="write results as the new baseline")
+    ap.add_argument("--json", dest="json_out", default="", help="also write raw results to this file")
+    args = ap.parse_args(argv)
+
+    calibration = _calibrate()
+    baseline = load_baseline(args.baseline)
+    scale = calibration * 1000 / baseline["calibration_ms"] if baseline and baseline.get("calibration_ms") else 1.0
+    results = run(args.quick, args.pattern, args.min_time, on_result=_row_printer(baseline, scale))
+
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump({"calibration_ms": calibration * 1000, "results": results}, f, indent=1, sort_keys=True)
+
+    if args.save_baseline:
+        if baseline and (args.quick or args.pattern):
+            # partial runs update their entries and keep the rest, on the
+            # baseline's calibration so the untouched rows stay comparable
+            results = {k: {**v, "best_ms": v["best_ms"] / scale, "p50_ms": v["p50_ms"] / scale} for k, v in results.items()}
+            results = {**baseline["results"], **results}
+            calibration = baseline["calibration_ms"] / 1000
+        save_baseline(results, calibration, args.baseline)
+        print(f"\nbaseline written to {args.baseline}")
+        return 0
+
+    if baseline is None:
+        print("\nno baseline yet; run with --save-baseline")
+        return 0
+    problems = compare(results, calibration, baseline, args.threshold)
+    if problems:
+        # a shared or throttled machine slows down for seconds at a time: re-measure
+        # what failed against a fresh calibration and only fail if it fails again
+        flagged = "^(?:" + "|".join(sorted({re.escape(p.split(":")[0]) for p in problems})) + ")$"
+        print(f"\nre-measuring {len(problems)} entr{'y' if len(problems) == 1 else 'ies'} over the threshold")
+        recalibration = _calibrate()
+        rescale = recalibration * 1000 / baseline["calibration_ms"]
+        again = run(args.quick, flagged, args.min_time * 3, on_result=_row_printer(baseline, rescale))
+        problems = compare(again, recalibration, baseline, args.threshold)
+    if problems:
+        print(f"\n{len(problems)} regression(s) beyond {args.threshold:.0%}:")
+        for p in problems:
+            print("  " + p)
+        return 1
+    print(f"\nno regressions beyond {args.threshold:.0%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
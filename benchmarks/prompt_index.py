@@ -0,0 +1,70 @@
+"""Near-duplicate prompt index: build time, memory and lookup latency.
+
+    python -m benchmarks.prompt_index              # 100k prompts, 2000 lookups
+    python -m benchmarks.prompt_index --prompts 10000
+
+Prompts are random phrases over a small website vocabulary, which is harder
+on LSH than real traffic: many prompts share words, so buckets fill up.
+Each lookup is an indexed prompt with one word added.
+"""
+
+import sys
+import time
+import random
+import argparse
+import tracemalloc
+
+from prompt_index import PromptIndex, prompt_context
+
+_WORDS = (
+    "coffee bakery gym yoga studio dentist lawyer portfolio photographer startup saas agency restaurant "
+    "pizza sushi bar hotel spa salon florist travel blog shop store landing page website dark minimal "
+    "modern playful colorful elegant warm pastel neon retro cyberpunk pricing testimonials contact form "
+    "gallery hero menu booking team about faq newsletter"
+).split()
+
+
+def synthetic_prompts(n: int, seed: int = 1):
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(_WORDS) for _ in range(rng.randint(4, 12))) for _ in range(n)]
+
+
+def _pct(xs, q):
+    return sorted(xs)[min(len(xs) - 1, int(len(xs) * q))] * 1000
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Measure the near-duplicate prompt index.")
+    ap.add_argument("--prompts", type=int, default=100_000, help="number of indexed prompts")
+    ap.add_argument("--lookups", type=int, default=2000, help="number of timed lookups")
+    ap.add_argument("--threshold", type=float, default=0.5, help="min similarity for a match")
+    args = ap.parse_args(argv)
+
+    prompts = synthetic_prompts(args.prompts)
+    ctx = prompt_context()
+    index = PromptIndex(max_items=args.prompts)
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    for i, p in enumerate(prompts):
+        index.add(p, ctx, f"k{i}")
+    build = time.perf_counter() - t0
+    mem = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    rng = random.Random(2)
+    times, hits = [], 0
+    for p in rng.sample(prompts, min(args.lookups, len(prompts))):
+        q = f"{p} {rng.choice(_WORDS)}"
+        t0 = time.perf_counter()
+        hits += index.lookup(q, ctx, min_score=args.threshold) is not None
+        times.append(time.perf_counter() - t0)
+
+    print(f"indexed {len(index)} prompts in {build:.1f}s ({build / len(prompts) * 1e6:.0f} µs each), "
+          f"{mem / 1e6:.0f} MB traced")
+    print(f"lookup  p50 {_pct(times, 0.5):.3f} ms   p99 {_pct(times, 0.99):.3f} ms   max {max(times) * 1000:.3f} ms")
+    print(f"matched {hits}/{len(times)} lookups at similarity >= {args.threshold}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
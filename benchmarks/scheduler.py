@@ -0,0 +1,98 @@
+"""Fairness and quota behaviour of the model-call scheduler, on the fake backend.
+
+    python -m benchmarks.scheduler                  # 120 RPM quota, 20 s
+    python -m benchmarks.scheduler --rpm 60 --seconds 30
+
+One session spams Regenerate from several threads while a few other
+sessions click Generate every couple of seconds. The fake backend enforces
+the quota over a sliding minute and answers 429 beyond it. The run happens
+twice: once calling the backend directly (what every session did before),
+once through the scheduler.
+"""
+
+import sys
+import time
+import argparse
+import threading
+
+from backends import FakeBackend
+from resilience import ResilientBackend
+from scheduler import FairScheduler, ScheduledBackend, scheduled
+
+
+def _pct(xs, q):
+    return sorted(xs)[min(len(xs) - 1, int(len(xs) * q))] if xs else float("nan")
+
+
+def run(args, use_scheduler: bool) -> dict:
+    fake = FakeBackend(latency=args.latency, rpm_limit=args.rpm)
+    backend = ResilientBackend(fake, timeout=30, max_retries=2, backoff_base=0.2, backoff_cap=1.0)
+    if use_scheduler:
+        backend = ScheduledBackend(backend, FairScheduler(rpm=args.rpm, max_concurrent=args.concurrency))
+    deadline = time.monotonic() + args.seconds
+    results = {"spammer": [], "users": []}  # (seconds, ok)
+    lock = threading.Lock()
+
+    def call(session, kind, group, n):
+        t0 = time.monotonic()
+        try:
+            with scheduled(session, kind):
+                backend.generate(f"{session} request {n}", {"temperature": 0.8})
+            ok = True
+        except Exception:
+            ok = False
+        with lock:
+            results[group].append((time.monotonic() - t0, ok))
+
+    def spammer(worker):
+        n = 0
+        while time.monotonic() < deadline:
+            call("spammer", "regenerate", "spammer", f"{worker}.{n}")
+            n += 1
+
+    def user(u):
+        n = 0
+        time.sleep(u * args.interval / args.users)
+        while time.monotonic() < deadline:
+            call(f"user{u}", "generate", "users", n)
+            n += 1
+            time.sleep(args.interval)
+
+    threads = [threading.Thread(target=spammer, args=(w,)) for w in range(args.spam_threads)]
+    threads += [threading.Thread(target=user, args=(u,)) for u in range(args.users)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return {"results": results, "quota_errors": fake.quota_errors, "calls": fake.calls}
+
+
+def _report(name, out):
+    print(f"\n{name}: {out['calls']} backend calls, {out['quota_errors']} answered 429")
+    for group, rows in out["results"].items():
+        ok = [s for s, good in rows if good]
+        failed = len(rows) - len(ok)
+        print(
+            f"  {group:8s} {len(ok):4d} ok  {failed:4d} failed   "
+            f"latency p50 {_pct(ok, 0.5):6.2f}s  p95 {_pct(ok, 0.95):6.2f}s  max {max(ok, default=float('nan')):6.2f}s"
+        )
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Simulate a quota-limited backend with and without the scheduler.")
+    ap.add_argument("--rpm", type=int, default=120, help="simulated requests-per-minute quota")
+    ap.add_argument("--seconds", type=float, default=20.0, help="length of each run")
+    ap.add_argument("--latency", type=float, default=0.3, help="fake model latency in seconds")
+    ap.add_argument("--spam-threads", type=int, default=6, help="concurrent Regenerate loops of the spamming session")
+    ap.add_argument("--users", type=int, default=4, help="other sessions clicking Generate")
+    ap.add_argument("--interval", type=float, default=2.0, help="seconds between a user's Generate clicks")
+    ap.add_argument("--concurrency", type=int, default=8, help="scheduler max_concurrent")
+    args = ap.parse_args(argv)
+
+    _report("direct", run(args, use_scheduler=False))
+    _report("scheduled", run(args, use_scheduler=True))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
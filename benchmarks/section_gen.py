@@ -0,0 +1,60 @@
+"""Whole-page vs section-parallel generation latency, on the fake backend.
+
+    python -m benchmarks.section_gen                       # 0.5 s first token, 1.5 s per 1000 chars
+    python -m benchmarks.section_gen --char-latency 3 --runs 5
+
+The fake backend takes ``--latency`` seconds per call plus ``--char-latency``
+seconds per 1000 characters of answer, so like a real model a long page
+takes longer than a short section. Each run uses a different prompt.
+"""
+
+import sys
+import time
+import argparse
+import threading
+
+from backends import FakeBackend
+from pipeline import build_prompt
+from section_gen import generate_sectioned
+
+_TOPICS = ("coffee shop", "yoga studio", "dentist", "photography portfolio", "saas startup", "bakery", "law firm")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Compare whole-page and section-parallel generation.")
+    ap.add_argument("--latency", type=float, default=0.5, help="fake seconds per call (time to first token)")
+    ap.add_argument("--char-latency", type=float, default=1.5, help="fake seconds per 1000 answer characters")
+    ap.add_argument("--runs", type=int, default=3)
+    args = ap.parse_args(argv)
+
+    backend = FakeBackend(latency=args.latency, char_latency=args.char_latency)
+    calls, lock = [], threading.Lock()
+
+    def timed(req, cfg):
+        t0 = time.perf_counter()
+        text = backend.generate(req, cfg)
+        with lock:
+            calls.append((time.perf_counter() - t0, len(text)))
+        return text
+
+    print(f"{'prompt':24s} {'whole page':>12s} {'sectioned':>12s} {'spec':>7s} {'slowest part':>13s} {'speedup':>8s}")
+    for i in range(args.runs):
+        topic = f"{_TOPICS[i % len(_TOPICS)]} landing page"
+        t0 = time.perf_counter()
+        page = timed(build_prompt(topic), {"temperature": 0.8})
+        whole = time.perf_counter() - t0
+
+        calls.clear()
+        t0 = time.perf_counter()
+        stitched = generate_sectioned(timed, topic)
+        sectioned = time.perf_counter() - t0
+        spec_s, parts = calls[0][0], calls[1:]
+        print(
+            f"{topic[:24]:24s} {whole:7.2f}s {len(page) / 1000:3.0f}k {sectioned:7.2f}s {len(stitched) / 1000:3.0f}k "
+            f"{spec_s:6.2f}s {max(s for s, _n in parts):12.2f}s {whole / sectioned:7.1f}x"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
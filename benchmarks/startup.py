@@ -0,0 +1,104 @@
+"""Cold-start and per-rerun cost of the Streamlit app.
+
+    python -m benchmarks.startup             # 5 cold starts, 30 reruns
+    python -m benchmarks.startup --cold 10 --reruns 100
+
+Cold start is measured in fresh interpreters: importing Streamlit, importing
+the modules app.py imports, and the first full script run, which is what a
+new replica pays before it can answer. AppTest adds a roughly constant
+overhead of its own to the run figures. Reruns replay the script in one
+process with the fake backend, the way Streamlit does on every widget
+interaction. No model call is made.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_COLD = r"""
+import json, os, sys, time, warnings
+warnings.simplefilter("ignore")
+t0 = time.perf_counter()
+import streamlit
+t1 = time.perf_counter()
+import ast, importlib
+tree = ast.parse(open(os.path.join(sys.argv[1], "app.py"), encoding="utf-8").read())
+names = [a.name for n in tree.body if isinstance(n, ast.Import) for a in n.names]
+names += [n.module for n in tree.body if isinstance(n, ast.ImportFrom) and n.module]
+sys.path.insert(0, sys.argv[1])
+for name in names:
+    importlib.import_module(name)
+t_app = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file(os.path.join(sys.argv[1], "app.py"), default_timeout=60)
+t2 = time.perf_counter()
+at.run()
+t3 = time.perf_counter()
+modules = [m for m in ("google.generativeai", "PIL.Image", "dotenv") if m in sys.modules]
+print(json.dumps({"streamlit": t1 - t0, "app_imports": t_app - t1, "first_run": t3 - t2, "loaded": modules, "errors": len(at.exception)}))
+"""
+
+
+def _env():
+    env = dict(os.environ)
+    env.setdefault("GENWEBLY_BACKEND", "fake")
+    env.setdefault("GENWEBLY_CACHE_DIR", "")
+    return env
+
+
+def cold_starts(n: int):
+    rows = []
+    for _ in range(n):
+        out = subprocess.run(
+            [sys.executable, "-c", _COLD, ROOT], capture_output=True, text=True, cwd=ROOT, env=_env(), check=True
+        )
+        rows.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return rows
+
+
+def reruns(n: int):
+    import warnings
+
+    warnings.simplefilter("ignore")
+    os.environ.update({k: v for k, v in _env().items() if k.startswith("GENWEBLY_")})
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=60)
+    at.run()
+    times = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        at.run()
+        times.append(time.perf_counter() - t0)
+    return times
+
+
+def _ms(xs):
+    return f"best {min(xs) * 1000:7.1f} ms   p50 {statistics.median(xs) * 1000:7.1f} ms"
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Measure app cold start and rerun overhead.")
+    ap.add_argument("--cold", type=int, default=5, help="number of fresh-interpreter starts")
+    ap.add_argument("--reruns", type=int, default=30, help="number of in-process reruns")
+    args = ap.parse_args(argv)
+
+    rows = cold_starts(args.cold)
+    print(f"streamlit import  {_ms([r['streamlit'] for r in rows])}")
+    print(f"app imports       {_ms([r['app_imports'] for r in rows])}")
+    print(f"first run         {_ms([r['first_run'] for r in rows])}")
+    print(f"heavy modules loaded after first run: {', '.join(rows[-1]['loaded']) or 'none'}")
+    if any(r["errors"] for r in rows):
+        print("warning: the app raised during the first run")
+    print(f"rerun             {_ms(reruns(args.reruns))}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+"""Prompt compaction for revision requests.
+
+Before a page goes back to the model, the spans it never needs to see or
+edit are swapped for short placeholders:
+
+- data: URLs (base64 images, fonts) -> ``keep:K<8 hex>`` inside the attribute
+- long inline ``<svg>`` art, marked injections (``<!--gw:name-->`` blocks
+  from injections.py), the interceptor/sparkles scripts and external CDN
+  ``<script src>`` / ``<link href>`` tags -> ``<!--keep:K<8 hex>-->``
+
+Indentation and blank lines are dropped as well (outside ``<pre>`` and
+``<textarea>``). Placeholders are derived from the content hash, so the same
+span always gets the same token and cached prompts stay reusable.
+``restore`` puts the originals back into the model's answer; placeholders
+the model removed stay removed.
+"""
+
+import re
+import hashlib
+from collections import namedtuple
+
+from injections import InjectionIndex
+from page_engine import INTERCEPTOR_JS, SPARKLES_SNIPPET
+
+PLACEHOLDER_RULE = (
+    "Placeholders like <!--keep:K0a1b2c3d--> and keep:K0a1b2c3d stand for content you cannot see "
+    "(images, SVG art, scripts). Copy every placeholder you keep exactly as written."
+)
+
+_DATA_URL_RE = re.compile(r"data:[\w.+-]+/[\w.+-]+(?:;[\w=.+-]+)*,[A-Za-z0-9+/=%._-]{64,}")
+_SVG_RE = re.compile(r"<svg\b.*?</svg\s*>", re.S | re.I)
+_CDN_TAG_RE = re.compile(
+    r"""<script\b[^>]*\bsrc\s*=\s*["']?(?:https?:)?//[^>]*>\s*</script\s*>"""
+    r"""|<link\b[^>]*\bhref\s*=\s*["']?(?:https?:)?//[^>]*>""",
+    re.I,
+)
+_PROTECTED_RE = re.compile(r"<(pre|textarea)\b.*?</\1\s*>", re.S | re.I)
+_INDENT_RE = re.compile(r"\n[ \t]*(?:\n[ \t]*)*")
+_TOKEN_RE = re.compile(r"<!--\s*keep:(K[0-9a-f]{8})\s*-->|keep:(K[0-9a-f]{8})")
+
+CompactionStats = namedtuple("CompactionStats", "chars_before chars_after tokens_before tokens_after placeholders")
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token) for reporting."""
+    return (len(text or "") + 3) // 4
+
+
+def _token(span: str) -> str:
+    return "K" + hashlib.sha1(span.encode("utf-8")).hexdigest()[:8]
+
+
+def compact(html: str, min_svg_chars: int = 600):
+    """Return (compacted html, {token: original span}, CompactionStats)."""
+    html = html or ""
+    keep = {}
+
+    def block(span):
+        t = _token(span)
+        keep[t] = span
+        return f"<!--keep:{t}-->"
+
+    def inline(m):
+        t = _token(m.group(0))
+        keep[t] = m.group(0)
+        return f"keep:{t}"
+
+    out = _compact_injections(html, block)
+    for snippet in (INTERCEPTOR_JS, SPARKLES_SNIPPET):
+        if snippet in out:
+            out = out.replace(snippet, block(snippet))
+    out = _DATA_URL_RE.sub(inline, out)
+    out = _SVG_RE.sub(lambda m: block(m.group(0)) if len(m.group(0)) >= min_svg_chars else m.group(0), out)
+    out = _CDN_TAG_RE.sub(lambda m: block(m.group(0)), out)
+    out = _strip_indentation(out)
+
+    stats = CompactionStats(len(html), len(out), estimate_tokens(html), estimate_tokens(out), len(keep))
+    return out, keep, stats
+
+
+def _compact_injections(html: str, block) -> str:
+    spans = sorted(InjectionIndex(html).spans.values())
+    if not spans:
+        return html
+    parts, pos = [], 0
+    for start, end in spans:
+        if start < pos:  # nested inside a block already compacted
+            continue
+        parts.append(html[pos:start])
+        parts.append(block(html[start:end]))
+        pos = end
+    parts.append(html[pos:])
+    return "".join(parts)
+
+
+def _strip_indentation(html: str) -> str:
+    parts = []
+    pos = 0
+    for m in _PROTECTED_RE.finditer(html):
+        parts.append(_INDENT_RE.sub("\n", html[pos:m.start()]))
+        parts.append(m.group(0))
+        pos = m.end()
+    parts.append(_INDENT_RE.sub("\n", html[pos:]))
+    return "".join(parts)
+
+
+def restore(text: str, keep: dict) -> str:
+    """Put the original spans back for every placeholder found in ``text``."""
+    if not keep or "keep:K" not in (text or ""):
+        return text
+
+    def repl(m):
+        t = m.group(1) or m.group(2)
+        return keep.get(t, m.group(0))
+
+    # spans can nest (a data URL inside a compacted SVG), so repeat until stable
+    for _ in range(3):
+        restored = _TOKEN_RE.sub(repl, text)
+        if restored == text:
+            break
+        text = restored
+    return text
+
+
+def has_placeholders(html: str) -> bool:
+    return "keep:K" in (html or "")
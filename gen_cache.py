@@ -0,0 +1,211 @@
+"""Content-addressed cache for model generations.
+
+Two tiers: a small in-memory LRU in front of an on-disk store with TTL and
+size-based eviction. The TTL runs from when an entry was written; disk
+eviction drops the least recently used entries first, tracked by setting
+a file's access time on every disk hit. Keys are computed by the caller (see
+``generation_cache_key`` in app.py) so the cache never looks at prompts.
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+
+
+class GenerationCache:
+    def __init__(
+        self,
+        cache_dir: str = ".genwebly_cache",
+        max_items: int = 64,
+        max_disk_bytes: int = 200 * 1024 * 1024,
+        ttl_seconds: float = 7 * 24 * 3600,
+    ):
+        self.cache_dir = cache_dir
+        self.max_items = max_items
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl_seconds = ttl_seconds
+        self._mem = OrderedDict()  # key -> (stored_at, text)
+        self._lock = threading.Lock()
+        self._disk_bytes = 0
+        self._evicting = False
+        self.counters = {
+            "hits": 0,
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "bypassed": 0,
+            "writes": 0,
+            "evictions": 0,
+        }
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            self._disk_bytes = sum(e[1] for e in self._disk_entries())
+
+    # ------------------ lookups ------------------
+    def get(self, key: str, record: bool = True):
+        """Return the cached text for ``key`` or None (expired entries count as misses).
+
+        ``record=False`` leaves the hit/miss counters alone, for lookups that
+        are not a request of their own (e.g. fetching a near-duplicate's page).
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._mem.get(key)
+            if entry and now - entry[0] <= self.ttl_seconds:
+                self._mem.move_to_end(key)
+                if record:
+                    self.counters["hits"] += 1
+                    self.counters["memory_hits"] += 1
+                return entry[1]
+            if entry:
+                del self._mem[key]
+
+        text = self._disk_get(key, now)  # file I/O outside the lock
+        with self._lock:
+            if text is None:
+                if record:
+                    self.counters["misses"] += 1
+                return None
+            self._mem_put(key, text, now)
+            if record:
+                self.counters["hits"] += 1
+                self.counters["disk_hits"] += 1
+            return text
+
+    def put(self, key: str, text: str) -> None:
+        if not text:
+            return
+        now = time.time()
+        with self._lock:
+            self._mem_put(key, text, now)
+            self.counters["writes"] += 1
+        self._disk_put(key, text)  # file I/O outside the lock; only the byte count is shared
+
+    def note_bypass(self) -> None:
+        with self._lock:
+            self.counters["bypassed"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            out = dict(self.counters)
+            out["memory_items"] = len(self._mem)
+            out["disk_bytes"] = self._disk_bytes
+        lookups = out["hits"] + out["misses"]
+        out["hit_rate"] = (out["hits"] / lookups) if lookups else 0.0
+        return out
+
+    def clear(self) -> None:
+        with self._lock:
+            self._mem.clear()
+        for path, *_rest in self._disk_entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        with self._lock:
+            self._disk_bytes = 0
+
+    # ------------------ memory tier ------------------
+    def _mem_put(self, key, text, now):
+        self._mem[key] = (now, text)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_items:
+            self._mem.popitem(last=False)
+
+    # ------------------ disk tier ------------------
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key + ".html")
+
+    def _disk_get(self, key, now):
+        if not self.cache_dir:
+            return None
+        path = self._path(key)
+        try:
+            st_ = os.stat(path)
+        except OSError:
+            return None
+        if now - st_.st_mtime > self.ttl_seconds:
+            self._disk_remove(path, st_.st_size)
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                text = f.read()
+            os.utime(path, (now, st_.st_mtime))  # access time = recency for eviction; mtime keeps the TTL
+        except OSError:
+            return None
+        return text
+
+    def _disk_put(self, key, text):
+        if not self.cache_dir:
+            return
+        path = self._path(key)
+        data = text.encode("utf-8")
+        if len(data) > self.max_disk_bytes:
+            return
+        try:
+            old_size = os.path.getsize(path)
+        except OSError:
+            old_size = 0
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            return
+        with self._lock:
+            self._disk_bytes += len(data) - old_size
+            evict = self._disk_bytes > self.max_disk_bytes and not self._evicting
+            self._evicting = self._evicting or evict
+        if evict:
+            try:
+                self._evict_disk()
+            finally:
+                with self._lock:
+                    self._evicting = False
+
+    def _disk_remove(self, path, size):
+        try:
+            os.remove(path)
+        except OSError:
+            return
+        with self._lock:
+            self._disk_bytes = max(0, self._disk_bytes - size)
+            self.counters["evictions"] += 1
+
+    def _evict_disk(self):
+        """Drop expired entries, then least recently used until under 90% of the byte budget.
+
+        Runs outside the lock (one eviction at a time); only the byte count is
+        updated under it.
+        """
+        now = time.time()
+        entries = sorted(self._disk_entries(), key=lambda e: e[3])
+        with self._lock:
+            self._disk_bytes = sum(e[1] for e in entries)  # writes race on the count; resync while walking anyway
+        target = int(self.max_disk_bytes * 0.9)
+        for path, size, mtime, _atime in entries:
+            if now - mtime > self.ttl_seconds or self._disk_bytes > target:
+                self._disk_remove(path, size)
+
+    def _disk_entries(self):
+        if not self.cache_dir or not os.path.isdir(self.cache_dir):
+            return []
+        out = []
+        for root, _dirs, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(".html"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    s = os.stat(path)
+                except OSError:
+                    continue
+                out.append((path, s.st_size, s.st_mtime, s.st_atime))
+        return out
@@ -0,0 +1,171 @@
+"""Per-session version history with undo/redo.
+
+Only the newest version is kept as full text. Each older version is stored
+as a zlib-compressed *reverse* delta: a line-level edit script that turns
+the version after it back into it. Dropping the oldest version therefore
+never touches the others, which makes the memory cap a simple pop from the
+front. Restoring version N applies the deltas from the newest version back
+to N, which takes a few milliseconds for typical pages.
+"""
+
+import json
+import time
+import zlib
+import difflib
+from collections import namedtuple
+
+VersionInfo = namedtuple("VersionInfo", "id label created bytes current")
+
+
+def _lines(s: str):
+    return s.splitlines(keepends=True)
+
+
+def make_delta(new: str, old: str) -> list:
+    """Edit script turning ``new`` into ``old``: [start, end] copies from ``new``'s lines, strings are inserts."""
+    if new == old:
+        return [[0, -1]]  # marker: identical
+    a, b = _lines(new), _lines(old)
+    ops = []
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, a, b, autojunk=False).get_opcodes():
+        if tag == "equal":
+            ops.append([i1, i2])
+        elif j2 > j1:
+            ops.append("".join(b[j1:j2]))
+    return ops
+
+
+def apply_delta(new: str, ops: list) -> str:
+    if ops == [[0, -1]]:
+        return new
+    a = _lines(new)
+    return "".join("".join(a[op[0]:op[1]]) if isinstance(op, list) else op for op in ops)
+
+
+class _Entry:
+    __slots__ = ("id", "label", "created", "delta")
+
+    def __init__(self, id, label, created, delta=None):
+        self.id = id
+        self.label = label
+        self.created = created
+        self.delta = delta  # compressed reverse delta to the next entry; None for the newest
+
+
+class VersionHistory:
+    """Linear history of page states (dicts of strings, e.g. raw_html/html).
+
+    ``max_bytes`` caps the compressed deltas plus the newest full state;
+    ``max_versions`` caps the count. The oldest versions are evicted first.
+    Committing while an older version is current discards the redo branch,
+    as editors do.
+    """
+
+    def __init__(self, max_bytes: int = 8 * 1024 * 1024, max_versions: int = 100):
+        self.max_bytes = max_bytes
+        self.max_versions = max(1, max_versions)
+        self._entries = []
+        self._head = None  # newest state, materialized
+        self._pos = -1  # index of the current version
+        self._current = None  # current state, materialized
+        self._next_id = 1
+        self.evicted = 0
+
+    # ------------------ writing ------------------
+    def commit(self, state: dict, label: str = "") -> int:
+        """Record ``state`` as the newest version and make it current; return its id."""
+        state = {k: (v or "") for k, v in state.items()}
+        if self._current is not None and state == self._current:
+            return self._entries[self._pos].id
+
+        if self._entries:
+            if self._pos < len(self._entries) - 1:
+                # drop the redo branch; the current version becomes the newest
+                del self._entries[self._pos + 1:]
+                self._head = self._current
+            self._entries[-1].delta = self._encode(state, self._head)
+
+        self._entries.append(_Entry(self._next_id, label, time.time()))
+        self._next_id += 1
+        self._head = state
+        self._current = state
+        self._pos = len(self._entries) - 1
+        self._evict()
+        return self._entries[-1].id
+
+    def _encode(self, new: dict, old: dict) -> bytes:
+        delta = {k: make_delta(new.get(k, ""), old.get(k, "")) for k in old.keys() | new.keys()}
+        return zlib.compress(json.dumps(delta, separators=(",", ":")).encode("utf-8"), 6)
+
+    @staticmethod
+    def _decode(new: dict, blob: bytes) -> dict:
+        delta = json.loads(zlib.decompress(blob).decode("utf-8"))
+        return {k: apply_delta(new.get(k, ""), ops) for k, ops in delta.items()}
+
+    def _evict(self):
+        while len(self._entries) > 1 and (
+            len(self._entries) > self.max_versions or self.memory_bytes() > self.max_bytes
+        ):
+            if self._pos == 0:
+                break  # never evict the version on screen
+            self._entries.pop(0)
+            self._pos -= 1
+            self.evicted += 1
+
+    # ------------------ reading / navigation ------------------
+    def _materialize(self, index: int) -> dict:
+        state = self._head
+        for j in range(len(self._entries) - 2, index - 1, -1):
+            state = self._decode(state, self._entries[j].delta)
+        return state
+
+    def _move(self, index: int):
+        if not (0 <= index < len(self._entries)):
+            return None
+        if index != self._pos:
+            self._current = self._materialize(index)
+            self._pos = index
+        return dict(self._current)
+
+    def undo(self):
+        return self._move(self._pos - 1) if self.can_undo else None
+
+    def redo(self):
+        return self._move(self._pos + 1) if self.can_redo else None
+
+    def jump(self, version_id: int):
+        """Make ``version_id`` current and return its state (None if it was evicted)."""
+        for i, e in enumerate(self._entries):
+            if e.id == version_id:
+                return self._move(i)
+        return None
+
+    @property
+    def can_undo(self) -> bool:
+        return self._pos > 0
+
+    @property
+    def can_redo(self) -> bool:
+        return 0 <= self._pos < len(self._entries) - 1
+
+    @property
+    def current_id(self):
+        return self._entries[self._pos].id if self._entries else None
+
+    def versions(self):
+        """VersionInfo per stored version, oldest first."""
+        head_bytes = self._state_bytes(self._head)
+        return [
+            VersionInfo(e.id, e.label, e.created, len(e.delta) if e.delta is not None else head_bytes, i == self._pos)
+            for i, e in enumerate(self._entries)
+        ]
+
+    def memory_bytes(self) -> int:
+        return self._state_bytes(self._head) + sum(len(e.delta) for e in self._entries if e.delta is not None)
+
+    @staticmethod
+    def _state_bytes(state) -> int:
+        return sum(len(v) for v in (state or {}).values())
+
+    def __len__(self):
+        return len(self._entries)
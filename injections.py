@@ -0,0 +1,127 @@
+"""Named snippets that post-processing adds to a page.
+
+Every snippet the pipeline splices in (the link interceptor, theme CSS and
+art, sparkles, helper scripts) is registered here under a name and an
+anchor, and lands in the page wrapped in a marker pair::
+
+    <!--gw:interceptor--> ...snippet... <!--/gw:interceptor-->
+
+One scan over a page finds every marked block (``InjectionIndex``), after
+which checking, replacing or removing an injection is a dict lookup.
+``inject`` replaces a block in place when it is already there, so running
+the pipeline on its own output leaves the page unchanged instead of
+appending another copy.
+"""
+
+import re
+from collections import namedtuple
+
+# anchor: "head_end" (before </head>), "body_start" (after <body>) or
+# "body_end" (before </body>). With ``fallback`` a page without the anchor
+# gets the snippet prepended (head_end) or appended (body_end).
+Injection = namedtuple("Injection", "name anchor markup fallback", defaults=("", True))
+
+ANCHORS = ("head_end", "body_start", "body_end")
+REGISTRY = {}
+
+_MARK_RE = re.compile(r"<!--(/?)gw:([\w-]+)-->")
+
+
+def register(name: str, anchor: str, markup: str = "", fallback: bool = True) -> Injection:
+    """Add (or redefine) a named injection; ``markup`` is the default snippet."""
+    if anchor not in ANCHORS:
+        raise ValueError(f"unknown anchor {anchor!r}; expected one of {', '.join(ANCHORS)}")
+    inj = Injection(name, anchor, markup, fallback)
+    REGISTRY[name] = inj
+    return inj
+
+
+def open_marker(name: str) -> str:
+    return f"<!--gw:{name}-->"
+
+
+def close_marker(name: str) -> str:
+    return f"<!--/gw:{name}-->"
+
+
+def marked(name: str, markup: str) -> str:
+    return open_marker(name) + markup + close_marker(name)
+
+
+def parse_marker(text: str):
+    """(name, is_close) for a marker comment, else None."""
+    m = _MARK_RE.fullmatch(text)
+    return (m.group(2), m.group(1) == "/") if m else None
+
+
+class InjectionIndex:
+    """Where each marked injection sits in one page. Built with a single scan.
+
+    ``spans`` maps name -> (start, end) of the whole block, markers included.
+    Only the first complete block per name counts.
+    """
+
+    def __init__(self, html: str):
+        self.html = html or ""
+        self.spans = {}
+        opened = {}
+        for m in _MARK_RE.finditer(self.html):
+            name = m.group(2)
+            if m.group(1):
+                if name in opened and name not in self.spans:
+                    self.spans[name] = (opened.pop(name), m.end())
+            elif name not in opened:
+                opened[name] = m.start()
+
+    def __contains__(self, name) -> bool:
+        return name in self.spans
+
+    def markup(self, name: str):
+        """The snippet between the markers, or None when ``name`` is absent."""
+        if name not in self.spans:
+            return None
+        start, end = self.spans[name]
+        return self.html[start + len(open_marker(name)):end - len(close_marker(name))]
+
+
+def _insert(html: str, inj: Injection, block: str) -> str:
+    if inj.anchor == "head_end":
+        if "</head>" in html:
+            return html.replace("</head>", block + "</head>")
+        return block + html if inj.fallback else html
+    if inj.anchor == "body_start":
+        return html.replace("<body>", "<body>" + block)
+    if "</body>" in html:
+        return html.replace("</body>", block + "</body>")
+    return html + block if inj.fallback else html
+
+
+def inject(html: str, name: str, markup=None, index=None) -> str:
+    """Add injection ``name`` to ``html``, or replace it in place if already there.
+
+    ``markup`` overrides the registered snippet; pass an ``index`` built for
+    this exact ``html`` to skip the scan.
+    """
+    inj = REGISTRY[name]
+    block = marked(name, inj.markup if markup is None else markup)
+    index = index if index is not None else InjectionIndex(html)
+    if name in index:
+        start, end = index.spans[name]
+        if html[start:end] == block:
+            return html
+        return html[:start] + block + html[end:]
+    return _insert(html, inj, block)
+
+
+def remove(html: str, *names, index=None) -> str:
+    """Drop the named injections (markers included); absent names are ignored."""
+    index = index if index is not None else InjectionIndex(html)
+    cuts = sorted(index.spans[n] for n in names if n in index)
+    if not cuts:
+        return html
+    out, pos = [], 0
+    for start, end in cuts:
+        out.append(html[pos:start])
+        pos = end
+    out.append(html[pos:])
+    return "".join(out)
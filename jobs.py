@@ -0,0 +1,142 @@
+"""Background generation jobs.
+
+Generate and Regenerate used to call the model inside the script run, which
+froze the session until the answer was in. ``JobManager`` runs them on a
+process-wide worker pool instead; the session keeps the job id and polls:
+
+- ``job.partial`` is the latest preview snapshot and ``job.progress`` a short
+  status line, both written by the worker
+- ``job.queue`` is (position, eta seconds) while the job's model call waits
+  for a scheduler slot, else None
+- ``job.cancel()`` flags the job and the worker stops at its next
+  ``job.check()``: a call still queued in the scheduler leaves the queue,
+  a call waiting for its answer or for a retry gives up, and a streamed
+  call stops reading, which closes the stream and aborts the request in
+  flight
+
+Nothing here imports Streamlit. Job functions must not touch session state;
+the app applies ``job.result`` on its own script thread.
+"""
+
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from scheduler import scheduled
+
+FINISHED = ("done", "failed", "cancelled")
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, session: str, kind: str, meta=None):
+        self.id = uuid.uuid4().hex
+        self.session = session
+        self.kind = kind
+        self.meta = meta or {}  # whatever the app needs to deliver the result
+        self.state = "queued"  # queued -> running -> done | failed | cancelled
+        self.partial = ""
+        self.progress = ""
+        self.queue = None
+        self.result = None
+        self.error = None
+        self.created = time.monotonic()
+        self.finished = None
+        self._cancel = threading.Event()
+
+    @property
+    def done(self) -> bool:
+        return self.state in FINISHED
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def cancel(self) -> None:
+        self._cancel.set()
+
+    def wait(self, timeout: float) -> bool:
+        """Block up to ``timeout`` seconds; True once the job is cancelled."""
+        return self._cancel.wait(timeout)
+
+    def check(self) -> None:
+        """Raise JobCancelled once the job has been cancelled."""
+        if self._cancel.is_set():
+            raise JobCancelled(f"job {self.id} cancelled")
+
+    def on_wait(self, position: int, eta: float) -> None:
+        """Scheduler callback: remember the queue position, leave the queue on cancel."""
+        self.queue = (position, eta) if position else None
+        self.check()
+
+    def elapsed(self) -> float:
+        return (self.finished or time.monotonic()) - self.created
+
+
+class JobManager:
+    """Runs ``fn(job)`` for each submitted job on ``max_workers`` threads.
+
+    Model calls made by ``fn`` are queued in the scheduler under the job's
+    session and kind. Finished jobs are kept ``keep_seconds`` for the
+    session to pick up.
+    """
+
+    def __init__(self, max_workers: int = 8, keep_seconds: float = 900):
+        self.keep_seconds = keep_seconds
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, session: str, kind: str, fn, meta=None) -> Job:
+        job = Job(session, kind, meta)
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        self._pool.submit(self._run, job, fn)
+        return job
+
+    def get(self, job_id: str):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        job = self.get(job_id)
+        if job is None or job.done:
+            return False
+        job.cancel()
+        return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            out = dict.fromkeys(("queued", "running") + FINISHED, 0)
+            for job in self._jobs.values():
+                out[job.state] += 1
+        return out
+
+    def _run(self, job: Job, fn):
+        state = "failed"
+        try:
+            job.check()
+            job.state = "running"
+            with scheduled(job.session, job.kind, on_wait=job.on_wait, threadsafe=True, cancel=job):
+                job.result = fn(job)
+            state = "done"
+        except JobCancelled:
+            pass
+        except Exception as e:
+            job.error = e
+        finally:
+            if job.cancelled:
+                state = "cancelled"
+            job.queue = None
+            job.finished = time.monotonic()
+            job.state = state  # last: pollers read the other fields once this says finished
+
+    def _prune(self):
+        cutoff = time.monotonic() - self.keep_seconds
+        for job_id in [j.id for j in self._jobs.values() if j.done and j.finished < cutoff]:
+            del self._jobs[job_id]
@@ -0,0 +1,285 @@
+"""Per-request spans, token usage and a Prometheus-style export.
+
+A ``Trace`` wraps one Generate / Regenerate / batch job::
+
+    with Trace("generate") as trace:
+        with span("prompt_build"):
+            ...
+
+``span`` and ``record_usage`` find the active trace through a context
+variable, so library code (page_engine, backends) can be instrumented
+without passing the trace around. They are no-ops when no trace is active.
+Worker threads must run under ``propagate`` to see it. When a trace
+finishes it:
+
+- feeds histograms in ``REGISTRY`` (stage and request latency, prompt and
+  candidate tokens, response bytes);
+- logs one JSON line on the ``genwebly.metrics`` logger and, if
+  GENWEBLY_METRICS_LOG is set, appends it to that file;
+- rewrites the Prometheus text file named by GENWEBLY_PROM_FILE, if set.
+
+``serve_metrics(port)`` exposes the same text over HTTP for scraping.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+
+log = logging.getLogger("genwebly.metrics")
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000, 250000)
+BYTE_BUCKETS = (1e3, 5e3, 1e4, 5e4, 1e5, 2.5e5, 5e5, 1e6, 2.5e6, 5e6)
+
+_HELP = {
+    "genwebly_stage_seconds": ("Time spent per pipeline stage.", LATENCY_BUCKETS),
+    "genwebly_request_seconds": ("End-to-end time per request.", LATENCY_BUCKETS),
+    "genwebly_prompt_tokens": ("Prompt tokens per request (model-reported when available).", TOKEN_BUCKETS),
+    "genwebly_candidate_tokens": ("Response tokens per request (model-reported when available).", TOKEN_BUCKETS),
+    "genwebly_response_bytes": ("Size of the raw model response per request.", BYTE_BUCKETS),
+    "genwebly_queue_seconds": ("Time model calls waited for a scheduler slot.", LATENCY_BUCKETS),
+}
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.sum += value
+        self.count += 1
+        for i, b in enumerate(self.buckets):
+            if value <= b:
+                self.counts[i] += 1
+                break
+
+    def quantile(self, q: float):
+        """Upper bucket bound holding the q-quantile (None when empty or past the last bucket)."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for b, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= rank:
+                return b
+        return None
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._hists = {}  # (name, sorted label items) -> Histogram
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, labels: dict, value: float):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            h = self._hists.get(key)
+            if h is None:
+                h = self._hists[key] = Histogram(_HELP.get(name, ("", LATENCY_BUCKETS))[1])
+            h.observe(value)
+
+    def snapshot(self) -> dict:
+        """{(name, labels): (count, sum, p50, p95)} for quick display."""
+        with self._lock:
+            return {k: (h.count, h.sum, h.quantile(0.5), h.quantile(0.95)) for k, h in self._hists.items()}
+
+    def prometheus_text(self) -> str:
+        lines = []
+        with self._lock:
+            items = sorted(self._hists.items())
+            by_name = {}
+            for (name, labels), h in items:
+                by_name.setdefault(name, []).append((labels, h))
+            for name, series in by_name.items():
+                lines.append(f"# HELP {name} {_HELP.get(name, ('',))[0]}")
+                lines.append(f"# TYPE {name} histogram")
+                for labels, h in series:
+                    base = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+                    sep = "," if base else ""
+                    cumulative = 0
+                    for b, n in zip(h.buckets, h.counts):
+                        cumulative += n
+                        lines.append(f'{name}_bucket{{{base}{sep}le="{b:g}"}} {cumulative}')
+                    lines.append(f'{name}_bucket{{{base}{sep}le="+Inf"}} {h.count}')
+                    lines.append(f"{name}_sum{{{base}}} {h.sum:.6g}")
+                    lines.append(f"{name}_count{{{base}}} {h.count}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str):
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp, path)
+
+
+def _escape(v) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+REGISTRY = MetricsRegistry()
+_current = contextvars.ContextVar("genwebly_trace", default=None)
+
+
+class Trace:
+    def __init__(self, flow: str, registry: MetricsRegistry = REGISTRY, emit: bool = True, **attrs):
+        self.flow = flow
+        self.registry = registry
+        self.emit = emit
+        self.attrs = dict(attrs)
+        self.spans = []  # (stage, seconds)
+        self.usage = {"prompt_tokens": 0, "candidate_tokens": 0, "response_bytes": 0, "model_calls": 0}
+        self.status = "ok"
+        self._lock = threading.Lock()
+        self._t0 = None
+        self._token = None
+
+    def __enter__(self):
+        self._t0 = time.perf_counter()
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current.reset(self._token)
+        if exc_type is not None:
+            self.status = "error"
+            self.attrs.setdefault("error", f"{exc_type.__name__}: {exc}"[:300])
+        self.finish()
+        return False
+
+    @contextmanager
+    def span(self, stage: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.spans.append((stage, time.perf_counter() - t0))
+
+    def note(self, key: str, value):
+        with self._lock:
+            self.attrs[key] = value
+
+    def add_usage(self, prompt_tokens=0, candidate_tokens=0, response_bytes=0):
+        with self._lock:
+            self.usage["prompt_tokens"] += int(prompt_tokens or 0)
+            self.usage["candidate_tokens"] += int(candidate_tokens or 0)
+            self.usage["response_bytes"] += int(response_bytes or 0)
+            self.usage["model_calls"] += 1
+
+    def finish(self):
+        total = time.perf_counter() - self._t0
+        stages = {}
+        for stage, secs in self.spans:
+            stages[stage] = stages.get(stage, 0.0) + secs
+            self.registry.observe("genwebly_stage_seconds", {"flow": self.flow, "stage": stage}, secs)
+        self.registry.observe("genwebly_request_seconds", {"flow": self.flow, "status": self.status}, total)
+        if self.usage["model_calls"]:
+            labels = {"flow": self.flow}
+            self.registry.observe("genwebly_prompt_tokens", labels, self.usage["prompt_tokens"])
+            self.registry.observe("genwebly_candidate_tokens", labels, self.usage["candidate_tokens"])
+            self.registry.observe("genwebly_response_bytes", labels, self.usage["response_bytes"])
+        if not self.emit:
+            return
+        line = json.dumps(
+            {
+                "ts": round(time.time(), 3),
+                "flow": self.flow,
+                "status": self.status,
+                "seconds": round(total, 4),
+                "stages": {k: round(v, 4) for k, v in stages.items()},
+                **self.usage,
+                **self.attrs,
+            },
+            default=str,
+        )
+        log.info(line)
+        _append(os.getenv("GENWEBLY_METRICS_LOG", ""), line)
+        prom = os.getenv("GENWEBLY_PROM_FILE", "")
+        if prom:
+            try:
+                self.registry.write_prometheus(prom)
+            except OSError as e:
+                log.warning("could not write %s: %s", prom, e)
+
+
+def _append(path, line):
+    if not path:
+        return
+    try:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+    except OSError as e:
+        log.warning("could not write %s: %s", path, e)
+
+
+# ------------------ helpers for instrumented code ------------------
+def current_trace():
+    return _current.get()
+
+
+@contextmanager
+def span(stage: str):
+    """Time a stage of the active trace (no-op without one)."""
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    with trace.span(stage):
+        yield
+
+
+def record_usage(prompt_tokens=0, candidate_tokens=0, response_bytes=0):
+    trace = _current.get()
+    if trace is not None:
+        trace.add_usage(prompt_tokens, candidate_tokens, response_bytes)
+
+
+def note(key: str, value):
+    trace = _current.get()
+    if trace is not None:
+        trace.note(key, value)
+
+
+def propagate(fn):
+    """Bind ``fn`` to a copy of the caller's context so the active trace follows it
+    into a worker thread. Call once per submit: a context can't be entered twice at once."""
+    ctx = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        return ctx.run(fn, *args, **kwargs)
+
+    return run
+
+
+def serve_metrics(port: int, registry: MetricsRegistry = REGISTRY):
+    """Serve ``registry`` as Prometheus text on http://0.0.0.0:<port>/metrics (daemon thread)."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip("/") not in ("", "/metrics"):
+                self.send_error(404)
+                return
+            body = registry.prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
@@ -0,0 +1,459 @@
+"""Single-pass post-processing engine for generated pages.
+
+``render_page`` produces the same output as the chained
+``sanitize_html`` -> ``apply_explicit_image_patch`` -> ``postprocess_html``
+passes in app.py, but scans the document once. The scan cuts the page into
+tokens at the only places the rules care about (``href="..."`` attributes,
+``</head>``, ``<body>``, ``</body>`` and the hero/about/contact sections).
+Every transform then edits those tokens or attaches snippets to them, and
+the page is joined exactly once at the end.
+
+Snippets are added through the ``injections`` registry, wrapped in
+``<!--gw:name-->`` markers; the scan records the markers it meets, so a
+page that already carries an injection gets it replaced in place rather
+than a second copy.
+"""
+
+import re
+
+from injections import REGISTRY, marked, parse_marker, register
+from metrics import span
+from themes import sparkle_intent
+
+INTERCEPTOR_JS = """
+<script>
+document.addEventListener('click', function(e){
+  const a = e.target.closest('a'); if(!a) return;
+  const href = a.getAttribute('href') || '';
+  if (href.startsWith('#')) return;
+  if (/^https?:\\/\\//i.test(href) && a.target === '_blank') return;
+  e.preventDefault();
+  if (href === '#' || href === '') window.scrollTo({top: 0, behavior: 'smooth'});
+});
+document.querySelectorAll('a[href^="#"]').forEach(a=>{
+  a.addEventListener('click', function(ev){
+    const id = this.getAttribute('href').slice(1);
+    const el = document.getElementById(id);
+    if(el){ ev.preventDefault(); el.scrollIntoView({behavior:'smooth'}); }
+  });
+});
+</script>
+"""
+
+SPARKLES_SNIPPET = """
+        <style>
+        #sparkles{position:fixed;inset:0;pointer-events:none;z-index:1;}
+        .sparkle{position:absolute;border-radius:50%;
+        background:radial-gradient(circle, rgba(255,255,255,0.9), rgba(255,255,255,0));
+        opacity:.6;filter:blur(.5px);animation:float 6s linear infinite;}
+        @keyframes float{from{transform:translateY(0)}to{transform:translateY(-120vh)}}
+        </style>
+        <div id="sparkles"></div>
+        <script>(function(){const c=document.getElementById('sparkles');if(!c)return;
+        for(let i=0;i<28;i++){const s=document.createElement('div');s.className='sparkle';
+        const d=3+Math.random()*7;s.style.width=d+'px';s.style.height=d+'px';
+        s.style.left=Math.random()*100+'vw';s.style.top=(100+Math.random()*40)+'vh';
+        s.style.animationDelay=(Math.random()*6)+'s';
+        s.style.animationDuration=(5+Math.random()*6)+'s';c.appendChild(s);}})();</script>
+        """
+
+TARGET_BLANK = ' target="_blank" rel="noopener noreferrer"'
+
+register("interceptor", "body_end", INTERCEPTOR_JS)
+register("sparkles", "body_end", SPARKLES_SNIPPET)
+register("theme-css", "head_end")
+register("hero-bg", "head_end")
+register("theme-art", "body_start")
+register("image", "body_end")
+
+# ------------------ tokenizer ------------------
+# The leading lookahead lets the regex engine reject most positions on one
+# character test instead of trying every alternative.
+_SCAN_RE = re.compile(
+    r"(?=[h<#i])(?:"
+    r'(?P<href>href="[^"]*")'
+    r"|(?P<mark><!--/?gw:[\w-]+-->)"
+    r"|(?P<head_close></head>)"
+    r"|(?P<body_close></body>)"
+    r"|(?P<body_open><body>)"
+    r"""|(?P<section_open>(?i:<section[^>]*id=["'](?:hero|contact|about)["'][^>]*>))"""
+    r"|(?P<section_close>(?i:</section>))"
+    r'|(?P<flag>#story|id="sparkles"|id="theme-art"|(?i:<html))'
+    r")"
+)
+_SECTION_ID_RE = re.compile(r"""id=["'](hero|contact|about)["']""", re.I)
+_ABS_HREF_RE = re.compile(r'href="(https?://[^"]+)"(?![^>]*\btarget=)')
+_ROOT_HREF_RE = re.compile(r'href="/[^"]*"')
+_SPARKLE_BLOCK_RE = re.compile(
+    r"<!--gw:(?P<mark>[\w-]+)-->(?:(?!<!--gw:).)*?<!--/gw:(?P=mark)-->"
+    r"|<style\b[^>]*>(?:(?!</style>|<style\b).)*?#sparkles(?:(?!</style>|<style\b).)*</style>"
+    r"|<script\b[^>]*>(?:(?!</script>|<script\b).)*?sparkles(?:(?!</script>|<script\b).)*</script>"
+    r'|<div id="sparkles"></div>',
+    re.S,
+)
+_FLAGS = ("#story", 'id="sparkles"', 'id="theme-art"', "<html")
+
+
+class _Tok:
+    __slots__ = ("kind", "text", "before", "after", "dead", "section_id")
+
+    def __init__(self, kind, text, section_id=None):
+        self.kind = kind
+        self.text = text
+        self.before = None
+        self.after = None
+        self.dead = False
+        self.section_id = section_id
+
+    def insert_before(self, s):
+        if self.before is None:
+            self.before = []
+        self.before.append(s)
+
+    def insert_after(self, s):
+        if self.after is None:
+            self.after = []
+        self.after.append(s)
+
+
+def _has_flag(s: str, flag: str) -> bool:
+    return flag in (s.lower() if flag == "<html" else s)
+
+
+class PageDocument:
+    """Token view of one page. Built with a single regex scan."""
+
+    def __init__(self, text: str):
+        self.start = _Tok("start", "")
+        self.end = _Tok("end", "")
+        toks = [self.start]
+        # flag -> tokens whose text contains it (so deleted content stops counting)
+        self._flag_toks = {f: [] for f in _FLAGS}
+        # injection name -> tokens from its opening to its closing marker
+        self.marks = {}
+        opened = {}
+        pending = []  # flags seen in the plain text run that is still open
+        pos = 0
+        for m in _SCAN_RE.finditer(text):
+            kind = m.lastgroup
+            if kind == "flag":
+                flag = m.group()
+                pending.append("<html" if flag.lower() == "<html" else flag)
+                continue
+            if m.start() > pos:
+                toks.append(self._text_tok(text[pos:m.start()], pending))
+                pending = []
+            sid = None
+            if kind == "section_open":
+                sid = _SECTION_ID_RE.search(m.group()).group(1).lower()
+            tok = _Tok(kind, m.group(), sid)
+            if kind in ("href", "section_open"):
+                for f in _FLAGS:
+                    if _has_flag(tok.text, f):
+                        self._flag_toks[f].append(tok)
+            toks.append(tok)
+            pos = m.end()
+            if kind == "mark":
+                name, closing = parse_marker(tok.text)
+                if not closing:
+                    opened.setdefault(name, len(toks) - 1)
+                elif name in opened and name not in self.marks:
+                    self.marks[name] = toks[opened.pop(name):]
+        if pos < len(text):
+            toks.append(self._text_tok(text[pos:], pending))
+        toks.append(self.end)
+        self.toks = toks
+
+    def _text_tok(self, s, flags):
+        tok = _Tok("text", s)
+        for f in flags:
+            self._flag_toks[f].append(tok)
+        return tok
+
+    # ------------------ queries ------------------
+    def has(self, flag: str, extra=()) -> bool:
+        """True if ``flag`` occurs in a live token or in one of the ``extra`` snippets."""
+        if any(not t.dead for t in self._flag_toks[flag]):
+            return True
+        return any(_has_flag(s, flag) for s in extra if s)
+
+    def of_kind(self, kind):
+        return [t for t in self.toks if t.kind == kind and not t.dead]
+
+    def injected(self, name: str) -> bool:
+        """True if the page came with a complete, still live ``name`` injection."""
+        toks = self.marks.get(name)
+        return bool(toks) and not (toks[0].dead or toks[-1].dead)
+
+    def _rest_of_tag(self, i) -> str:
+        """Text after token ``i`` up to and including the next '>'."""
+        parts = []
+        toks = self.toks
+        for j in range(i + 1, len(toks)):
+            t = toks[j]
+            if t.dead:
+                continue
+            k = t.text.find(">")
+            parts.append(t.text if k < 0 else t.text[:k + 1])
+            if k >= 0:
+                break
+        return "".join(parts)
+
+    # ------------------ edits ------------------
+    def rewrite_links(self):
+        for i, t in enumerate(self.toks):
+            if t.dead:
+                continue
+            if t.kind == "href":
+                if t.text.startswith('href="/'):
+                    t.text = 'href="#"'
+                elif t.text.startswith('href="http') and _ABS_HREF_RE.match(t.text + self._rest_of_tag(i)):
+                    t.text += TARGET_BLANK
+            elif t.kind == "section_open":
+                t.text = _ROOT_HREF_RE.sub('href="#"', t.text)
+                t.text = _ABS_HREF_RE.sub(lambda m: f'href="{m.group(1)}"{TARGET_BLANK}', t.text)
+
+    def insert_before_each(self, kind, snippet, fallback="append"):
+        """Insert ``snippet`` before every ``kind`` token, else prepend/append it."""
+        hits = self.of_kind(kind)
+        for t in hits:
+            t.insert_before(snippet)
+        if not hits:
+            if fallback == "append":
+                self.end.insert_before(snippet)
+            elif fallback == "prepend":
+                self.start.insert_after(snippet)
+                self.start.after.insert(0, self.start.after.pop())
+        return bool(hits)
+
+    def insert_after_each(self, kind, snippet):
+        for t in self.of_kind(kind):
+            t.insert_after(snippet)
+
+    def inject(self, name: str, markup=None) -> str:
+        """Add registered injection ``name``; a marked copy already in the page is replaced in place.
+
+        Returns the marked block.
+        """
+        inj = REGISTRY[name]
+        block = marked(name, inj.markup if markup is None else markup)
+        if self.injected(name):
+            first, *rest = self.marks[name]
+            for t in rest:
+                t.dead = True
+            first.text = block
+            for f in _FLAGS:
+                if _has_flag(block, f):
+                    self._flag_toks[f].append(first)
+        elif inj.anchor == "head_end":
+            self.insert_before_each("head_close", block, fallback="prepend" if inj.fallback else None)
+        elif inj.anchor == "body_start":
+            self.insert_after_each("body_open", block)
+        else:
+            self.insert_before_each("body_close", block, fallback="append" if inj.fallback else None)
+        return block
+
+    def remove_injection(self, name: str):
+        if self.injected(name):
+            for t in self.marks[name]:
+                t.dead = True
+
+    def replace_section_bodies(self, section_id, replacement):
+        """Replace the content of every <section id=...> up to the next </section>."""
+        toks = self.toks
+        i, n = 0, len(toks)
+        while i < n:
+            t = toks[i]
+            if t.dead or t.kind != "section_open" or t.section_id != section_id:
+                i += 1
+                continue
+            j = i + 1
+            while j < n and (toks[j].dead or toks[j].kind != "section_close"):
+                j += 1
+            if j >= n:
+                return
+            # Snippets already attached in between go away with the content.
+            t.after = None
+            for k in range(i + 1, j):
+                toks[k].dead = True
+            toks[j].before = None
+            t.insert_after(replacement)
+            i = j + 1
+
+    def wrap_document(self):
+        inner = self.toks[1:-1]
+        # Snippets pinned to the document edges end up inside the new <body>.
+        if self.start.after:
+            inner.insert(0, _Tok("text", "".join(self.start.after)))
+            self.start.after = None
+        if self.end.before:
+            inner.append(_Tok("text", "".join(self.end.before)))
+            self.end.before = None
+        self.toks = (
+            [self.start, _Tok("text", "<html><head>"), _Tok("head_close", "</head>"), _Tok("body_open", "<body>")]
+            + inner
+            + [_Tok("body_close", "</body>"), _Tok("text", "</html>"), self.end]
+        )
+
+    def strip(self):
+        """Equivalent of str.strip() on the serialized document."""
+        live = [t for t in self.toks if not t.dead]
+        for t in live:
+            if self._strip_tok(t, left=True):
+                break
+        for t in reversed(live):
+            if self._strip_tok(t, left=False):
+                break
+
+    @staticmethod
+    def _strip_tok(t, left):
+        """Strip one side of a token and its snippets; True once non-space is reached."""
+        order = [("before", t.before), ("text", None), ("after", t.after)]
+        if not left:
+            order.reverse()
+        for name, lst in order:
+            if name == "text":
+                t.text = t.text.lstrip() if left else t.text.rstrip()
+                if t.text:
+                    return True
+                continue
+            if not lst:
+                continue
+            idxs = range(len(lst)) if left else range(len(lst) - 1, -1, -1)
+            for i in idxs:
+                lst[i] = lst[i].lstrip() if left else lst[i].rstrip()
+                if lst[i]:
+                    return True
+        return False
+
+    def serialize(self) -> str:
+        parts = []
+        for t in self.toks:
+            if t.dead:
+                continue
+            if t.before:
+                parts.extend(t.before)
+            parts.append(t.text)
+            if t.after:
+                parts.extend(t.after)
+        return "".join(parts)
+
+
+def remove_sparkle_blocks(html: str) -> str:
+    """Drop unmarked sparkle blocks: a ``<style>`` that styles ``#sparkles``,
+    the empty ``<div id="sparkles">`` and a ``<script>`` that mentions ``sparkles``.
+
+    Marked copies are removed through the injection index; this covers pages
+    made before the markers and ones where the model wrote the effect itself.
+    Each block is removed on its own and marked ``<!--gw:...-->`` spans are
+    kept whole, so nothing between blocks is touched. One regex pass: a block
+    match never scans past the next opener of its kind.
+    """
+    if "sparkles" not in html:
+        return html
+    return _SPARKLE_BLOCK_RE.sub(lambda m: m.group(0) if m.group("mark") else "", html)
+
+
+# ------------------ public entry point ------------------
+def build_image_tag(src: str, place_hint: str) -> str:
+    place_hint = (place_hint or "").lower()
+    base_styles = ["width:100%", "height:100%", "object-fit:contain", "display:block"]
+    if "small" in place_hint:
+        base_styles.append("max-width:90px")
+    elif "medium" in place_hint:
+        base_styles.append("max-width:180px")
+    elif "large" in place_hint:
+        base_styles.append("max-width:260px")
+    m = re.search(r"opacity\s*([0-9]*\.?[0-9]+)", place_hint)
+    if m:
+        try:
+            op = float(m.group(1))
+            if op > 1:
+                op = op / 100
+            base_styles.append(f"opacity:{op}")
+        except ValueError:
+            pass
+    style_attr = ' style="' + ";".join(base_styles) + ';"'
+    return f'<img src="{src}" loading="lazy"{style_attr} />'
+
+
+def _patch_image(doc: PageDocument, src: str, place_hint: str):
+    hint = (place_hint or "").lower()
+    img_tag = build_image_tag(src, hint)
+    for sid in ("contact", "about", "hero"):
+        if sid in hint:
+            doc.replace_section_bodies(sid, img_tag)
+            return img_tag
+    if "bottom left" in hint:
+        img_tag = "<div style='position:absolute;left:0;bottom:0;z-index:50;'>" + img_tag + "</div>"
+    elif "bottom right" in hint:
+        img_tag = "<div style='position:absolute;right:0;bottom:0;z-index:50;'>" + img_tag + "</div>"
+    return doc.inject("image", img_tag)
+
+
+def render_page(
+    raw: str,
+    prompt_text: str = "",
+    theme_css: str = "",
+    theme_svg: str = "",
+    image_src=None,
+    place_hint: str = "",
+    hero_image_url: str = "",
+    ensure_story_anchor: bool = True,
+) -> str:
+    """Sanitize, optionally place an image, and post-process a page in one pass.
+
+    ``image_src=None`` skips the image patch entirely (as when app.py does not
+    call apply_explicit_image_patch).
+    """
+    prompt_text = prompt_text or ""
+    with span("parse"):
+        text = (raw or "").replace("```html", "").replace("```", "").strip()
+        doc = PageDocument(text)
+    extras = []
+
+    # sanitize_html
+    with span("sanitize"):
+        if text:
+            doc.rewrite_links()
+            doc.inject("interceptor")
+
+    # apply_explicit_image_patch
+    if image_src is not None:
+        with span("image_patch"):
+            extras.append(_patch_image(doc, image_src, place_hint))
+
+    # postprocess_html
+    with span("postprocess"):
+        return _postprocess(doc, extras, prompt_text, theme_css, theme_svg, hero_image_url, ensure_story_anchor)
+
+
+def _postprocess(doc, extras, prompt_text, theme_css, theme_svg, hero_image_url, ensure_story_anchor):
+    doc.strip()
+    if not doc.has("<html", extras):
+        doc.wrap_document()
+
+    extras.append(doc.inject("theme-css", theme_css))
+
+    if ensure_story_anchor and doc.has("#story", extras):
+        for t in doc.toks:
+            if not t.dead and t.kind in ("href", "section_open") and 'href="#"' in t.text:
+                t.text = t.text.replace('href="#"', 'href="#story"')
+    doc.rewrite_links()
+
+    if hero_image_url and "hero background" in prompt_text.lower():
+        css = "<style>#hero{background:url('" + hero_image_url + "') center/cover no-repeat;}</style>"
+        extras.append(doc.inject("hero-bg", css))
+
+    hates, wants = sparkle_intent(prompt_text)
+    if hates:
+        doc.remove_injection("sparkles")
+        return remove_sparkle_blocks(doc.serialize())
+
+    if wants and not doc.has('id="sparkles"', extras):
+        extras.append(doc.inject("sparkles"))
+
+    if doc.injected("theme-art") or not doc.has('id="theme-art"', extras):
+        doc.inject("theme-art", theme_svg)
+
+    return doc.serialize()
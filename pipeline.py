@@ -0,0 +1,501 @@
+"""Streamlit-free core of GenWebly.
+
+Prompt building, the model call and HTML post-processing live here so they
+can be imported by app.py, the batch CLI (batch.py) and scripts alike.
+"""
+
+import io
+import re
+import json
+import hashlib
+import injections
+from page_engine import build_image_tag, remove_sparkle_blocks, render_page
+from themes import sparkle_intent, theme_assets
+from compaction import PLACEHOLDER_RULE, has_placeholders
+from metrics import note, span
+from streaming import strip_fences
+from webperf import image_dimensions, optimize_page
+
+
+
+# ------------------ 1) HTML safety + postprocess ------------------
+def _rewrite_links(html: str) -> str:
+    html = re.sub(r'href="/[^"]*"', 'href="#"', html)
+    html = html.replace('href="/"', 'href="#"')
+
+    def add_target_blank(m):
+        url = m.group(1)
+        return f'href="{url}" target="_blank" rel="noopener noreferrer"'
+
+    return re.sub(r'href="(https?://[^"]+)"(?![^>]*\btarget=)', add_target_blank, html)
+
+
+def sanitize_html(raw: str) -> str:
+    html = (raw or "").replace("```html", "").replace("```", "").strip()
+    if not html:
+        return ""
+    html = _rewrite_links(html)
+    return injections.inject(html, "interceptor")
+
+
+
+def postprocess_html(raw_html: str, hero_image_url: str = "", ensure_story_anchor: bool = True, prompt_text: str = "") -> str:
+    html = (raw_html or "").replace("```html", "").replace("```", "").strip()
+    if "<html" not in html.lower():
+        html = f"<html><head></head><body>{html}</body></html>"
+
+    theme_css, theme_svg = theme_assets(prompt_text)
+    html = injections.inject(html, "theme-css", theme_css)
+
+    html = re.sub(r'href="/[^"]*"', 'href="#"', html)
+    html = html.replace('href="/"', 'href="#"')
+    if ensure_story_anchor and "#story" in html:
+        html = html.replace('href="#"', 'href="#story"')
+
+    def _add_target_blank(m):
+        url = m.group(1)
+        return f'href="{url}" target="_blank" rel="noopener noreferrer"'
+
+    html = re.sub(r'href="(https?://[^"]+)"(?![^>]*\btarget=)', _add_target_blank, html)
+
+    if hero_image_url and "hero background" in prompt_text.lower():
+
+        css = "<style>#hero{background:url('" + hero_image_url + "') center/cover no-repeat;}</style>"
+        html = injections.inject(html, "hero-bg", css)
+
+        # --- CONDITIONAL SPARKLES ENGINE ---
+    user_hates_sparkles, user_wants_sparkles = sparkle_intent(prompt_text)
+
+    # Remove sparkles fully if user said no
+    if user_hates_sparkles:
+        return remove_sparkle_blocks(injections.remove(html, "sparkles"))
+
+    # Add sparkles only if requested
+    if user_wants_sparkles and 'id="sparkles"' not in html:
+        html = injections.inject(html, "sparkles")
+
+    index = injections.InjectionIndex(html)
+    if "theme-art" in index or 'id="theme-art"' not in html:
+        html = injections.inject(html, "theme-art", theme_svg, index=index)
+
+    return html
+
+
+def render_generated_page(raw: str, prompt_text: str, image_src=None, place_hint: str = "") -> str:
+    """Single-pass equivalent of sanitize_html -> apply_explicit_image_patch -> postprocess_html."""
+    theme_css, theme_svg = theme_assets(prompt_text)
+    return render_page(
+        raw,
+        prompt_text=prompt_text,
+        theme_css=theme_css,
+        theme_svg=theme_svg,
+        image_src=image_src,
+        place_hint=place_hint,
+    )
+
+
+# ------------------ 2) Stack helpers + prompt builders ------------------
+ALL_LANGS = ["HTML", "CSS", "JS", "Tailwind", "Bootstrap", "jQuery"]
+
+
+def check_stack_applicability(selected):
+    """Return (is_applicable: bool, message: str)."""
+    if not selected:
+        return True, "No stack chosen; model will pick a reasonable default (HTML + CSS)."
+    if "HTML" not in selected:
+        return False, "Stack not applicable: HTML is required since the output is always an HTML document. Add 'HTML'."
+    if "Tailwind" in selected and "Bootstrap" in selected:
+        return False, "Stack not applicable: Tailwind CSS and Bootstrap are full CSS frameworks that often conflict; pick one of them, not both."
+    return True, "Stack applicable."
+
+
+def build_stack_rules(selected_langs, js_mode: str, js_use: str) -> str:
+    if not selected_langs:
+        return ""
+
+    langs = set(selected_langs)
+    rules = []
+
+    # Base HTML/CSS rules
+    if "HTML" in langs and "CSS" not in langs and not (langs & {"Tailwind", "Bootstrap"}):
+        rules.append("Output a single self-contained HTML file. Use minimal inline CSS inside a <style> block.")
+    if "HTML" in langs and "CSS" in langs and not (langs & {"Tailwind", "Bootstrap", "jQuery"}):
+        rules.append("Use a single HTML file with a <style> block for CSS. Avoid external libraries.")
+
+    # Tailwind
+    if "Tailwind" in langs:
+        rules.append("Use Tailwind utility classes. Include CDN <script src='https://cdn.tailwindcss.com'></script> in <head>.")
+
+    # Bootstrap
+    if "Bootstrap" in langs:
+        rules.append("Use Bootstrap 5 via CDN (CSS and JS). Build layout with Bootstrap components.")
+
+    # jQuery
+    has_js_like = False
+    if "jQuery" in langs:
+        rules.append("Include jQuery via CDN and use it for small interactions.")
+        has_js_like = True
+
+    # Vanilla JS / Bootstrap behavior
+    if "JS" in langs or "Bootstrap" in langs:
+        has_js_like = True
+
+    if has_js_like:
+        rules.append("All code must live in a single HTML file with <style> and <script> blocks.")
+        if js_mode == "Dynamic":
+            rules.append(
+                "Use JavaScript to add interactivity (tabs, modals, form handling, smooth scrolling, localStorage, etc.). Avoid external API requests."
+            )
+        else:
+            rules.append("Keep JavaScript minimal, so the page mostly behaves like a static site (minor enhancements only).")
+        if js_use.strip():
+            rules.append(f"Specific JavaScript behavior requested by the user: {js_use.strip()}")
+
+    return "\n".join(rules)
+
+
+def build_prompt(u: str, img_mode=None, img_hint=None, stack_rules: str = "", temperature: float = 0.8) -> str:
+    base = (
+        "Return ONE complete HTML document (no markdown). "
+        "Prefer a single file with inline <style> and optional <script>. "
+        "Make it responsive and accessible with good contrast.\n"
+        "STRUCTURE: header/nav, hero, 3 feature cards/sections, footer.\n"
+        "NAV: in-page anchors only (e.g., href=\"#about\"). Smooth scrolling.\n"
+        "Buttons/links: External links target='_blank' rel='noopener noreferrer'.\n"
+        "Forms: no external navigation.\n"
+    )
+    if stack_rules:
+        base += f"\nStack rules:\n{stack_rules}\n"
+
+    if img_mode in ("data", "url"):
+        base += "Use the user's provided image as the main hero background. Do not include other images.\n"
+    elif img_mode == "svg" or (img_hint and img_hint.strip()):
+        base += "Generate visuals as inline SVG or CSS drawings that match the hint. No external URLs.\n" + f"Image Hint: {img_hint}\n"
+    else:
+        base += "Do NOT include external <img> unless asked. Use gradients/SVG if visuals are needed.\n"
+
+    return f"{base}\nUser request:\n{u}\n(temperature={temperature})"
+
+
+def build_revision_prompt(
+    current_html: str,
+    stack_rules: str,
+    change_list: str = "",
+    extra_image_src: str = "",
+    image_place_hint: str = "",
+    svg_hint: str = "",
+    logic_fixes: str = "",
+):
+    rules = [
+    "Revise the EXISTING HTML below. Do NOT recreate from scratch.",
+    "APPLY ONLY the requested changes. Do not remove sections or anchors.",
+    "Return ONE full HTML document (no markdown).",
+    "IMPORTANT: If a change mentions color, font, placement, or logic, edit the exact CSS/JS/HTML selectors.",
+    "Insert an HTML comment per applied change like <!--applied: change-key-->.",
+    "Keep responsiveness and accessibility intact.",
+    "YOU MUST make at least one visible modification to the HTML, even if the request is minor.",
+]
+
+
+    if stack_rules:
+        rules.append("Respect these stack rules:\n" + stack_rules)
+
+    # Make sure Gemini ALWAYS applies changes
+    if change_list.strip():
+        change_list += "\nALWAYS MODIFY AT LEAST ONE ELEMENT."
+
+    if change_list.strip():
+        rules.append("Apply these changes:\n" + change_list.strip())
+    else:
+        rules.append("User gave no changes → apply gentle improvements only.")
+
+    if logic_fixes.strip():
+        rules.append("Logic fixes:\n" + logic_fixes.strip())
+
+    if extra_image_src and image_place_hint:
+        rules.append(
+            f"PLACE THIS IMAGE EXACTLY at '{image_place_hint}'. USE THIS SRC ONLY: {extra_image_src}."
+        )
+
+    if svg_hint.strip():
+        rules.append("Add inline SVG art: " + svg_hint.strip())
+
+    if has_placeholders(current_html):
+        rules.append(PLACEHOLDER_RULE)
+
+    return (
+        "\n".join(rules)
+        + "\n\n--- CURRENT HTML (EDIT THIS, DO NOT REWRITE) ---\n"
+        + current_html
+    )
+
+
+
+# ------------------ 3) Helper utilities for regenerate verification/patch + splitting ------------------
+def _norm(s: str) -> str:
+    return re.sub(r"\s+", " ", (s or "")).strip()
+
+
+def _hash(s: str) -> str:
+    return hashlib.sha256((s or "").encode("utf-8")).hexdigest()
+
+
+_MIN_DATE_JS = """
+<script>
+(function(){
+  function todayStr(){
+    const t=new Date();
+    const m=String(t.getMonth()+1).padStart(2,'0');
+    const d=String(t.getDate()).padStart(2,'0');
+    return `${t.getFullYear()}-${m}-${d}`;
+  }
+  document.querySelectorAll('input[type="date"]').forEach(el=>{
+    const td=todayStr();
+    if(!el.min) el.min = td;
+    if(el.value && el.value < td) el.value = td;
+    el.addEventListener('change',()=>{ if(el.value < td) el.value = td; });
+  });
+})();
+</script>
+"""
+
+_CONTACT_TEXT_CSS = """
+<style id="contact-enforce-text">
+#contact, section#contact, .contact, .contact-section { color:#000 !important; }
+#contact p, .contact p, #contact li, .contact li { color:#000 !important; }
+</style>
+"""
+
+_EDIT_DELETE_ICONS = """
+<svg xmlns="http://www.w3.org/2000/svg" aria-hidden="true" style="position:absolute;width:0;height:0;overflow:hidden">
+<symbol id="gw-icon-edit" viewBox="0 0 24 24"><path d="M3 17.25V21h3.75L17.81 9.94l-3.75-3.75L3 17.25zm14.71-9.04a1 1 0 0 0 0-1.41l-2.51-2.51a1 1 0 0 0-1.41 0l-1.83 1.83 3.75 3.75 2-1.66z"/></symbol>
+<symbol id="gw-icon-delete" viewBox="0 0 24 24"><path d="M6 19a2 2 0 0 0 2 2h8a2 2 0 0 0 2-2V7H6v12zM19 4h-3.5l-1-1h-5l-1 1H5v2h14V4z"/></symbol>
+</svg>
+<script>
+(function(){
+  const icon = id => '<svg viewBox="0 0 24 24" width="18" height="18" fill="currentColor" aria-hidden="true"><use href="#' + id + '"/></svg>';
+  document.querySelectorAll('.icon-edit').forEach(el=>{ if(!el.innerHTML.trim()) el.innerHTML = icon('gw-icon-edit'); });
+  document.querySelectorAll('.icon-delete').forEach(el=>{ if(!el.innerHTML.trim()) el.innerHTML = icon('gw-icon-delete'); });
+})();
+</script>
+"""
+
+injections.register("min-date", "body_end", _MIN_DATE_JS)
+injections.register("contact-text", "head_end", _CONTACT_TEXT_CSS)
+injections.register("edit-delete-icons", "body_end", _EDIT_DELETE_ICONS)
+
+
+def ensure_min_date_js(html: str) -> str:
+    return injections.inject(html, "min-date")
+
+
+def force_contact_text_black(html: str) -> str:
+    return injections.inject(html, "contact-text")
+
+
+# --- IMAGE INJECTION ENGINE (FINAL PATCH) ---
+def apply_explicit_image_patch(html, src, place_hint, prompt):
+    place_hint = (place_hint or "").lower()
+    prompt = (prompt or "").lower()
+
+
+    img_tag = build_image_tag(src, place_hint)
+
+    # Placement logic
+    # 1) CONTACT SECTION
+    if "contact" in place_hint:
+        return re.sub(
+        r'(<section[^>]*id=["\']contact["\'][^>]*>)(.*?)(</section>)',
+        r'\1' + img_tag + r'\3',
+        html,
+        flags=re.I | re.S
+    )
+
+    # 2) ABOUT SECTION
+    if "about" in place_hint:
+        return re.sub(
+        r'(<section[^>]*id=["\']about["\'][^>]*>)(.*?)(</section>)',
+        r'\1' + img_tag + r'\3',
+        html,
+        flags=re.I | re.S
+    )
+
+
+    # 3) HERO IMAGE — REPLACE CONTENT
+    if "hero" in place_hint:
+        return re.sub(
+            r'(<section[^>]*id=["\']hero["\'][^>]*>)(.*?)(</section>)',
+            r'\1' + img_tag + r'\3',
+            html,
+            flags=re.I | re.S
+    )
+
+
+    # 4) BOTTOM LEFT
+    if "bottom left" in place_hint:
+        fixed = (
+            "<div style='position:absolute;left:0;bottom:0;z-index:50;'>"
+            + img_tag +
+            "</div>"
+        )
+        return injections.inject(html, "image", fixed)
+
+    # 5) BOTTOM RIGHT
+    if "bottom right" in place_hint:
+        fixed = (
+            "<div style='position:absolute;right:0;bottom:0;z-index:50;'>"
+            + img_tag +
+            "</div>"
+        )
+        return injections.inject(html, "image", fixed)
+
+    # 6) DEFAULT — append before </body>
+    return injections.inject(html, "image", img_tag)
+
+def inject_edit_delete_svgs_if_missing(html: str) -> str:
+    """Fill empty .icon-edit / .icon-delete elements with icons from one shared sprite."""
+    return injections.inject(html, "edit-delete-icons")
+
+
+_ASSET_BLOCK_RE = re.compile(r"<(style|script)\b([^>]*)>(.*?)</\1\s*>", re.S | re.I)
+_SRC_ATTR_RE = re.compile(r"\bsrc\s*=", re.I)
+_TYPE_ATTR_RE = re.compile(r"""\btype\s*=\s*["']?([^"'\s>]+)""", re.I)
+_CLASSIC_JS_TYPES = {"text/javascript", "application/javascript", "javascript"}
+
+
+def split_html_assets(raw_html: str):
+    """Split raw HTML into index.html, styles.css, script.js.
+
+    One scan over the document. External ``<script src>`` tags and non-classic
+    scripts (modules, JSON-LD, templates) stay where they are. styles.css is
+    linked where the first inline style was, and script.js where the last
+    inline script was, so the order against CDN tags is kept.
+    """
+    html = (raw_html or "").strip()
+    if not html:
+        return "", "", ""
+
+    css_parts, js_parts, out = [], [], []
+    link_at = script_at = None  # indexes into ``out`` for the injected tags
+    pos = 0
+    for m in _ASSET_BLOCK_RE.finditer(html):
+        tag, attrs, body = m.group(1).lower(), m.group(2), m.group(3)
+        if tag == "script":
+            t = _TYPE_ATTR_RE.search(attrs)
+            if _SRC_ATTR_RE.search(attrs) or (t and t.group(1).lower() not in _CLASSIC_JS_TYPES):
+                continue
+        out.append(html[pos:m.start()])
+        pos = m.end()
+        if tag == "style":
+            if body.strip():
+                css_parts.append(body.strip())
+            if link_at is None:
+                link_at = len(out)
+                out.append("")
+        else:
+            if body.strip():
+                js_parts.append(body.strip())
+            script_at = len(out)
+            out.append("")
+    out.append(html[pos:])
+
+    css = "\n\n".join(css_parts)
+    js = "\n\n".join(js_parts)
+    if css and link_at is not None:
+        out[link_at] = '<link rel="stylesheet" href="styles.css"/>'
+    if js and script_at is not None:
+        out[script_at] = '<script src="script.js"></script>'
+    return "".join(out).strip(), css, js
+
+
+def build_site_zip(html_main: str, css: str, js: str, files=None, precompress: bool = False) -> bytes:
+    """Zip of index.html / styles.css / script.js plus ``files`` ({path: bytes}).
+
+    With ``precompress`` the text files also get .gz siblings (and .br ones
+    when the optional ``brotli`` package is installed) for static hosts that
+    serve precompressed files.
+    """
+    # imported here: exports are rare and these modules add to every cold start
+    import gzip
+    import zipfile
+
+    try:
+        import brotli
+    except ImportError:  # optional; without it the zip export only adds .gz copies
+        brotli = None
+
+    entries = {"index.html": html_main.encode("utf-8")}
+    if css:
+        entries["styles.css"] = css.encode("utf-8")
+    if js:
+        entries["script.js"] = js.encode("utf-8")
+    if precompress:
+        for name in list(entries):
+            data = entries[name]
+            entries[name + ".gz"] = gzip.compress(data, compresslevel=9, mtime=0)
+            if brotli is not None:
+                entries[name + ".br"] = brotli.compress(data, quality=11)
+
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        for name, data in entries.items():
+            # already-compressed payloads are stored as-is
+            method = zipfile.ZIP_STORED if name.endswith((".gz", ".br")) else zipfile.ZIP_DEFLATED
+            zf.writestr(name, data, compress_type=method)
+        for path, data in (files or {}).items():
+            zf.writestr(path, data, compress_type=zipfile.ZIP_STORED)
+    return buf.getvalue()
+
+
+def optimize_site(html_main: str, css: str = "", files=None):
+    """Load-performance pass over an exported index.html; returns (html, PerfReport).
+
+    ``css`` is the styles.css that goes next to it (its critical rules are
+    inlined) and ``files`` the bundled images, used to fill in width/height.
+    """
+    files = files or {}
+    return optimize_page(
+        html_main,
+        css_files={"styles.css": css} if css else None,
+        size_of=lambda src: image_dimensions(files[src]) if src in files else None,
+    )
+
+
+# ------------------ 4) Model call ------------------
+def generation_cache_key(model_name: str, generation_config: dict, req: str) -> str:
+    cfg = json.dumps(generation_config or {}, sort_keys=True)
+    return _hash(f"{model_name}\n{cfg}\n{req}")
+
+
+def call_model(req: str, generation_config: dict, backend) -> str:
+    """One model call; the answer with its Markdown fences removed."""
+    with span("model_call"):
+        return strip_fences(backend.generate(req, generation_config))
+
+
+def cache_lookup(cache, key: str, bypass_cache: bool = False):
+    """Cached text for ``key``, or None; notes the hit, miss or bypass on the trace."""
+    if bypass_cache:
+        cache.note_bypass()
+        note("cache", "bypass")
+        return None
+    cached = cache.get(key)
+    note("cache", "miss" if cached is None else "hit")
+    return cached
+
+
+def generate_html(req: str, generation_config: dict, backend, cache=None, bypass_cache: bool = False) -> str:
+    """Run one model call on ``backend``, served from ``cache`` (a GenerationCache) when possible.
+
+    The app's non-streamed calls and batch both go through here, so a cache
+    entry holds the same text whichever of them filled it.
+    """
+    if cache is None:
+        return call_model(req, generation_config, backend)
+    key = generation_cache_key(backend.model_name, generation_config, req)
+    cached = cache_lookup(cache, key, bypass_cache)
+    if cached is not None:
+        return cached
+    html = call_model(req, generation_config, backend)
+    cache.put(key, html)
+    return html
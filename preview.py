@@ -0,0 +1,52 @@
+"""Hash-keyed live preview.
+
+The page is shown in an isolated ``srcdoc`` iframe inside a small custom
+component (preview_frame/index.html). The document itself is sent to the
+browser only when its content hash changes. On other reruns (device radio,
+height slider, unrelated widgets) the component just receives the hash and
+the frame size. If the browser lost the document (the component was
+remounted), it asks for it once and the next rerun resends it.
+"""
+
+import os
+import hashlib
+from functools import lru_cache
+
+import streamlit as st
+
+DEVICE_WIDTHS = {"Mobile": 375, "Tablet": 768, "Laptop": 1280, "Desktop": 1440}
+
+
+@lru_cache(maxsize=1)
+def _component():
+    """Declared on first render: registering the component costs ~25 ms at import time."""
+    import streamlit.components.v1 as components
+
+    return components.declare_component(
+        "preview_frame", path=os.path.join(os.path.dirname(os.path.abspath(__file__)), "preview_frame")
+    )
+
+
+def doc_hash(html: str) -> str:
+    return hashlib.sha256((html or "").encode("utf-8")).hexdigest()[:16]
+
+
+def preview_frame(html: str, width: int, height: int, asset_urls=None, key: str = "preview_frame"):
+    """Render ``html`` at ``width`` x ``height``; ``asset_urls`` maps asset ids to static URLs."""
+    h = doc_hash(html)
+    sync = st.session_state.setdefault(f"_{key}_sync", {"sent": None, "served": None})
+    reply = st.session_state.get(key) or {}
+    resend = reply.get("need") == h and reply.get("nonce") != sync["served"]
+    send_doc = sync["sent"] != h or resend
+    if resend:
+        sync["served"] = reply.get("nonce")
+    sync["sent"] = h
+    _component()(
+        hash=h,
+        doc=html if send_doc else None,
+        assets=(asset_urls or {}) if send_doc else {},
+        width=int(width),
+        height=int(height),
+        key=key,
+        default=None,
+    )
@@ -0,0 +1,256 @@
+"""Near-duplicate lookup for prompts.
+
+The generation cache is keyed by the exact request, so "coffee shop landing
+page" and "landing page for a coffee shop, warm colors" never share an
+entry. ``PromptIndex`` remembers which cache key each prompt produced and
+finds earlier prompts that say nearly the same thing:
+
+- prompts are normalized (``_norm``, lowercase, punctuation and filler words
+  dropped) and cut into word shingles (single words and adjacent pairs)
+- each shingle set gets a 64-value MinHash signature (per shingle, one
+  SHAKE-128 digest read as 64 independent 32-bit hashes; the signature is
+  their element-wise minimum); LSH splits it into 16 bands of 4, and
+  prompts sharing any band land in the same bucket
+- a lookup only scores the prompts in its buckets, by exact Jaccard
+  similarity of the shingle sets
+
+The stack rules, image mode and a separately given SVG hint are part of
+the bucket key: a page built for Bootstrap is never offered for a Tailwind
+request. Lookups compare against a handful of candidates, so they stay
+well under a millisecond however many prompts are indexed (see
+``python -m benchmarks.prompt_index``).
+"""
+
+import os
+import re
+import sys
+import json
+import struct
+import hashlib
+import threading
+from functools import lru_cache
+from collections import OrderedDict, namedtuple
+
+from pipeline import _norm
+
+Match = namedtuple("Match", "key prompt score")
+
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+_MAX_BUCKET = 64  # newest entries kept per bucket; stops one popular prompt from flooding lookups
+_UNPACK = struct.Struct(f"<{NUM_PERM}I").unpack
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_FILLER = frozenset(
+    "a an the and or for with of to in on at by my our your me us i we it this that some please "
+    "make create build design generate want need give show".split()
+)
+
+
+def prompt_tokens(prompt: str) -> list:
+    return [w for w in _WORD_RE.findall(_norm(prompt).lower()) if w not in _FILLER]
+
+
+def shingles(tokens) -> frozenset:
+    """Single words plus adjacent word pairs."""
+    return frozenset(tokens) | frozenset(f"{a} {b}" for a, b in zip(tokens, tokens[1:]))
+
+
+def _base_hash(s: str) -> int:
+    return int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+@lru_cache(maxsize=1 << 16)
+def _hash_row(shingle: str) -> tuple:
+    """NUM_PERM independent 32-bit hashes of one shingle."""
+    return _UNPACK(hashlib.shake_128(shingle.encode("utf-8")).digest(4 * NUM_PERM))
+
+
+def signature(shingle_set) -> tuple:
+    return tuple(map(min, zip(*map(_hash_row, shingle_set))))
+
+
+def jaccard(a: frozenset, b: frozenset) -> float:
+    if not a or not b:
+        return 0.0
+    inter = len(a & b)
+    return inter / (len(a) + len(b) - inter)
+
+
+def prompt_context(stack_rules: str = "", img_mode=None, img_hint: str = "") -> str:
+    """What besides the wording has to match for a cached page to fit."""
+    return f"{img_mode or ''}\n{_norm(img_hint).lower()}\n{_norm(stack_rules)}"
+
+
+class _Entry:
+    __slots__ = ("key", "prompt", "context", "shingles")
+
+    def __init__(self, key, prompt, context, shingle_set):
+        self.key = key
+        self.prompt = prompt
+        self.context = context
+        self.shingles = shingle_set
+
+
+class PromptIndex:
+    """In-memory MinHash/LSH index of prompt -> generation cache key.
+
+    With ``path`` every addition is appended to a JSON-lines log that is
+    replayed on start, so the index survives restarts together with the
+    on-disk generation cache. ``max_items`` evicts the oldest prompts.
+    """
+
+    def __init__(self, path: str = "", max_items: int = 100_000):
+        self.path = path
+        self.max_items = max_items
+        self._entries = OrderedDict()  # key -> _Entry, oldest first
+        # band hash -> key, or a list of keys once several prompts share the band
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.counters = {"lookups": 0, "matches": 0, "served": 0}
+        if path:
+            self._load()
+
+    def __len__(self):
+        return len(self._entries)
+
+    # ------------------ lookups ------------------
+    def lookup(self, prompt: str, context: str = "", min_score: float = 0.0, exclude_key: str = ""):
+        """Best earlier prompt with similarity >= ``min_score`` in the same context, or None."""
+        shs = shingles(prompt_tokens(prompt))
+        if not shs:
+            return None
+        bands = self._band_keys(context, signature(shs))
+        best, best_score = None, 0.0
+        with self._lock:
+            self.counters["lookups"] += 1
+            seen = set()
+            for band in bands:
+                bucket = self._buckets.get(band, ())
+                for key in (bucket,) if isinstance(bucket, str) else bucket:
+                    if key in seen or key == exclude_key:
+                        continue
+                    seen.add(key)
+                    score = jaccard(shs, self._entries[key].shingles)
+                    if score > best_score:
+                        best, best_score = self._entries[key], score
+            if best is None or best_score < min_score:
+                return None
+            self.counters["matches"] += 1
+            return Match(best.key, best.prompt, best_score)
+
+    def note_served(self) -> None:
+        """Count a match whose page was used instead of a model call."""
+        with self._lock:
+            self.counters["served"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            out = dict(self.counters)
+            out["prompts"] = len(self._entries)
+        return out
+
+    # ------------------ updates ------------------
+    def add(self, prompt: str, context: str, key: str) -> bool:
+        """Index ``prompt`` as producing cache entry ``key``; False if it has no usable words."""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return True
+        if not self._insert(prompt, context, key):
+            return False
+        if self.path:
+            self._append({"key": key, "ctx": context, "prompt": prompt})
+        return True
+
+    def discard(self, key: str) -> None:
+        """Forget ``key`` (e.g. after its page left the generation cache)."""
+        with self._lock:
+            self._drop(key)
+        if self.path:
+            self._append({"key": key, "drop": True})
+
+    def _insert(self, prompt, context, key) -> bool:
+        shs = shingles(prompt_tokens(prompt))
+        if not shs:
+            return False
+        # interned: most shingles and contexts repeat across prompts
+        shs = frozenset(map(sys.intern, shs))
+        context = sys.intern(context)
+        bands = self._band_keys(context, signature(shs))
+        buckets = self._buckets
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = _Entry(key, prompt, context, shs)
+            for band in bands:
+                bucket = buckets.get(band)
+                if bucket is None:
+                    buckets[band] = key
+                elif isinstance(bucket, str):
+                    buckets[band] = [bucket, key]
+                else:
+                    bucket.append(key)
+                    if len(bucket) > _MAX_BUCKET:
+                        del bucket[0]
+            while len(self._entries) > self.max_items:
+                self._drop(next(iter(self._entries)))
+        return True
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for band in self._band_keys(entry.context, signature(entry.shingles)):
+            bucket = self._buckets.get(band)
+            if bucket == key:
+                del self._buckets[band]
+            elif isinstance(bucket, list) and key in bucket:
+                bucket.remove(key)
+                if len(bucket) == 1:
+                    self._buckets[band] = bucket[0]
+
+    @staticmethod
+    def _band_keys(context, sig):
+        ctx = _base_hash(context)
+        return tuple(hash((ctx, b) + sig[b * ROWS:(b + 1) * ROWS]) for b in range(BANDS))
+
+    # ------------------ log ------------------
+    def _append(self, record):
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+        except OSError:
+            pass  # the index still works in memory
+
+    def _load(self):
+        latest = OrderedDict()
+        lines = 0
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    lines += 1
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        continue
+                    latest.pop(rec.get("key"), None)
+                    if not rec.get("drop"):
+                        latest[rec.get("key")] = rec
+        except OSError:
+            return
+        for rec in list(latest.values())[-self.max_items:]:
+            self._insert(rec.get("prompt", ""), rec.get("ctx", ""), rec.get("key", ""))
+        if lines > 2 * len(self._entries) + 100:
+            self._rewrite_log()
+
+    def _rewrite_log(self):
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                for e in self._entries.values():
+                    f.write(json.dumps({"key": e.key, "ctx": e.context, "prompt": e.prompt}) + "\n")
+            os.replace(tmp, self.path)
+        except OSError:
+            pass
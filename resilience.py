@@ -0,0 +1,382 @@
+"""Deadlines, retries and hedged requests around a model backend.
+
+``ResilientBackend`` wraps any ``ModelBackend``:
+
+- each attempt gets a deadline; a call that misses it counts as a timeout
+  and is retried (the abandoned call finishes in the background);
+- retryable errors (rate limits, 5xx, timeouts, connection resets) are
+  retried with full-jitter exponential backoff; other errors raise at once;
+- with hedging on, a duplicate request is fired once the primary has run
+  longer than the observed p95 latency, and the first answer wins. A hedge
+  budget caps hedges to a fraction of primary calls.
+
+Streamed calls get the same treatment up to their first chunk: the deadline
+bounds the wait for it, and the first stream to answer wins while the others
+are closed. Once chunks flow, errors propagate.
+
+Inside a ``scheduled(..., cancel=job)`` block, waiting for an answer and
+backing off between attempts end as soon as the job is cancelled.
+
+Every attempt is recorded (kind, outcome, seconds) so the thresholds can be
+tuned from ``stats()`` or from the optional JSONL log.
+"""
+
+import json
+import time
+import queue
+import random
+import threading
+from collections import deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from backends import ModelBackend
+from metrics import propagate
+from scheduler import current_cancel
+
+Attempt = namedtuple("Attempt", "at kind attempt outcome seconds error")
+
+_CANCEL_POLL = 0.2  # seconds between cancellation checks while waiting for an answer
+
+_RETRYABLE_MARKERS = (
+    "ResourceExhausted", "429", "quota", "rate limit",
+    "ServiceUnavailable", "503", "InternalServerError", "500", "502", "504",
+    "DeadlineExceeded", "Timeout", "timed out", "Connection", "reset by peer",
+)
+
+
+class ModelTimeout(Exception):
+    pass
+
+
+class ModelCallError(Exception):
+    """Raised when every attempt failed; ``attempts`` holds what was tried."""
+
+    def __init__(self, message, attempts=()):
+        super().__init__(message)
+        self.attempts = list(attempts)
+
+
+def is_retryable(e: Exception) -> bool:
+    if isinstance(e, (ModelTimeout, TimeoutError, ConnectionError)):
+        return True
+    text = f"{type(e).__name__} {e}".lower()
+    return any(m.lower() in text for m in _RETRYABLE_MARKERS)
+
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 30.0, rng=random) -> float:
+    """Full-jitter exponential backoff: uniform(0, min(cap, base * 2**attempt))."""
+    return rng.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def _wait_slice(seconds: float, cancel) -> float:
+    """How long to block before looking at ``cancel`` again."""
+    return seconds if cancel is None else min(seconds, _CANCEL_POLL)
+
+
+def _pause(seconds: float) -> None:
+    """Backoff sleep that ends early, raising, when the caller is cancelled."""
+    cancel = current_cancel()
+    if cancel is None:
+        time.sleep(seconds)
+        return
+    cancel.wait(seconds)
+    cancel.check()
+
+
+class ResilientBackend(ModelBackend):
+    def __init__(
+        self,
+        inner: ModelBackend,
+        timeout: float = 120.0,
+        max_retries: int = 3,
+        backoff_base: float = 1.0,
+        backoff_cap: float = 30.0,
+        hedge: bool = False,
+        hedge_after: float = 20.0,
+        hedge_budget: float = 0.1,
+        min_samples: int = 20,
+        log_path: str = "",
+        max_workers: int = 16,
+    ):
+        self.inner = inner
+        self.name = inner.name
+        self.model_name = inner.model_name
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.hedge = hedge
+        self.hedge_after = hedge_after
+        self.hedge_budget = hedge_budget
+        self.min_samples = min_samples
+        self.log_path = log_path
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="model-call")
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=200)  # successful attempt latencies
+        self._attempts = deque(maxlen=500)
+        self._primaries = 0
+        self._hedges = 0
+        self._hedge_wins = 0
+
+    @property
+    def available(self) -> bool:
+        return self.inner.available
+
+    def count_tokens(self, req):
+        return self.inner.count_tokens(req)
+
+    # ------------------ bookkeeping ------------------
+    def _record(self, kind, attempt, outcome, seconds, error=None):
+        rec = Attempt(time.time(), kind, attempt, outcome, round(seconds, 3), str(error)[:200] if error else None)
+        with self._lock:
+            self._attempts.append(rec)
+            if outcome == "ok":
+                self._latencies.append(seconds)
+        if self.log_path:
+            try:
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(rec._asdict()) + "\n")
+            except OSError:
+                pass
+
+    def _percentile(self, q):
+        with self._lock:
+            lat = sorted(self._latencies)
+        if not lat:
+            return None
+        return lat[min(len(lat) - 1, int(q * len(lat)))]
+
+    def hedge_delay(self) -> float:
+        """Seconds to wait before hedging: observed p95 once there are enough samples."""
+        with self._lock:
+            enough = len(self._latencies) >= self.min_samples
+        return self._percentile(0.95) if enough else self.hedge_after
+
+    def _may_hedge(self) -> bool:
+        with self._lock:
+            # one free hedge, then at most hedge_budget per primary call
+            if self._hedges < 1 + self.hedge_budget * self._primaries:
+                self._hedges += 1
+                return True
+        return False
+
+    def stats(self) -> dict:
+        with self._lock:
+            attempts = list(self._attempts)
+            primaries, hedges, wins = self._primaries, self._hedges, self._hedge_wins
+        outcomes = {}
+        for a in attempts:
+            outcomes[f"{a.kind}:{a.outcome}"] = outcomes.get(f"{a.kind}:{a.outcome}", 0) + 1
+        return {
+            "calls": primaries,
+            "hedges": hedges,
+            "hedge_wins": wins,
+            "p50_s": self._percentile(0.5),
+            "p95_s": self._percentile(0.95),
+            "hedge_delay_s": self.hedge_delay() if self.hedge else None,
+            "outcomes": outcomes,
+        }
+
+    # ------------------ calls ------------------
+    def _timed(self, kind, attempt, req, generation_config):
+        def run():
+            t0 = time.perf_counter()
+            try:
+                text = self.inner.generate(req, generation_config)
+            except Exception as e:
+                self._record(kind, attempt, "error", time.perf_counter() - t0, e)
+                raise
+            self._record(kind, attempt, "ok", time.perf_counter() - t0)
+            return text
+
+        return self._pool.submit(propagate(run))
+
+    def _attempt(self, attempt, req, generation_config):
+        """One attempt (maybe hedged) bounded by ``timeout``; returns text or raises."""
+        cancel = current_cancel()
+        t0 = time.perf_counter()
+        deadline = t0 + self.timeout
+        first = self._timed("primary" if attempt == 0 else "retry", attempt, req, generation_config)
+        futures = [first]
+        hedged = False
+        last_error = None
+        while futures:
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            wait_for = deadline - now
+            if self.hedge and not hedged:
+                wait_for = min(wait_for, max(0.0, t0 + self.hedge_delay() - now))
+            done, _ = wait(futures, timeout=_wait_slice(wait_for, cancel), return_when=FIRST_COMPLETED)
+            if cancel is not None and not done:
+                cancel.check()  # the abandoned call finishes in the background
+            for fut in done:
+                futures.remove(fut)
+                try:
+                    text = fut.result()
+                except Exception as e:
+                    last_error = e
+                    continue
+                if hedged and fut is not first:
+                    with self._lock:
+                        self._hedge_wins += 1
+                return text
+            now = time.perf_counter()
+            if not done and self.hedge and not hedged and futures and t0 + self.hedge_delay() <= now < deadline:
+                hedged = True
+                if self._may_hedge():
+                    futures.append(self._timed("hedge", attempt, req, generation_config))
+        if last_error is not None and not futures:
+            raise last_error
+        self._record("deadline", attempt, "timeout", time.perf_counter() - t0)
+        raise ModelTimeout(f"no answer within {self.timeout:g}s")
+
+    def generate(self, req, generation_config):
+        with self._lock:
+            self._primaries += 1
+        cancel = current_cancel()
+        errors = []
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self._attempt(attempt, req, generation_config)
+            except Exception as e:
+                if cancel is not None:
+                    cancel.check()
+                errors.append(e)
+                if not is_retryable(e) or attempt == self.max_retries:
+                    break
+                _pause(backoff_delay(attempt, self.backoff_base, self.backoff_cap))
+        raise ModelCallError(
+            f"model call failed after {len(errors)} attempt(s): {type(errors[-1]).__name__}: {errors[-1]}",
+            errors,
+        )
+
+    def _open_stream(self, kind, attempt, req, generation_config, chunks):
+        """Start one streamed attempt on the pool; it puts ``(stop, what, value)`` on ``chunks``.
+
+        ``what`` is "chunk", "end" or "error". Setting the returned ``stop``
+        event makes the attempt close its stream at the next chunk.
+        """
+        stop = threading.Event()
+
+        def run():
+            t0 = time.perf_counter()
+            it = None
+            try:
+                it = iter(self.inner.stream(req, generation_config))
+                for text in it:
+                    if stop.is_set():
+                        self._record(kind, attempt, "cancelled", time.perf_counter() - t0)
+                        return
+                    chunks.put((stop, "chunk", text))
+            except Exception as e:
+                self._record(kind, attempt, "error", time.perf_counter() - t0, e)
+                chunks.put((stop, "error", e))
+                return
+            finally:
+                if hasattr(it, "close"):
+                    it.close()
+            self._record(kind, attempt, "ok", time.perf_counter() - t0)
+            chunks.put((stop, "end", None))
+
+        self._pool.submit(propagate(run))
+        return stop
+
+    def _first_chunk(self, attempt, req, generation_config):
+        """One streamed attempt (maybe hedged) bounded by ``timeout`` until its first chunk.
+
+        Returns ``(chunks, winner, what, value)`` for the first stream to
+        answer; the others are stopped.
+        """
+        cancel = current_cancel()
+        t0 = time.perf_counter()
+        deadline = t0 + self.timeout
+        chunks = queue.Queue()
+        first = self._open_stream("primary" if attempt == 0 else "retry", attempt, req, generation_config, chunks)
+        racing = [first]
+        hedged = False
+        last_error = None
+        while racing:
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            wait_for = deadline - now
+            if self.hedge and not hedged:
+                wait_for = min(wait_for, max(0.0, t0 + self.hedge_delay() - now))
+            try:
+                stop, what, value = chunks.get(timeout=_wait_slice(wait_for, cancel))
+            except queue.Empty:
+                if cancel is not None and cancel.wait(0):
+                    for stop in racing:
+                        stop.set()
+                    cancel.check()
+                now = time.perf_counter()
+                if self.hedge and not hedged and t0 + self.hedge_delay() <= now < deadline:
+                    hedged = True
+                    if self._may_hedge():
+                        racing.append(self._open_stream("hedge", attempt, req, generation_config, chunks))
+                continue
+            if stop not in racing:
+                continue
+            if what == "error":
+                racing.remove(stop)
+                last_error = value
+                continue
+            for other in racing:
+                if other is not stop:
+                    other.set()
+            if hedged and stop is not first:
+                with self._lock:
+                    self._hedge_wins += 1
+            return chunks, stop, what, value
+        for stop in racing:
+            stop.set()
+        if last_error is not None and not racing:
+            raise last_error
+        self._record("deadline", attempt, "timeout", time.perf_counter() - t0)
+        raise ModelTimeout(f"no first chunk within {self.timeout:g}s")
+
+    def stream(self, req, generation_config):
+        """Like ``generate`` until the first chunk arrives: ``timeout`` bounds the
+        wait for it, and retries and hedges happen before it. After that errors
+        propagate, and ``timeout`` bounds each gap between chunks: a stream
+        that goes quiet for longer is stopped with ModelTimeout.
+        """
+        with self._lock:
+            self._primaries += 1
+        cancel = current_cancel()
+        errors = []
+        for attempt in range(self.max_retries + 1):
+            try:
+                chunks, winner, what, value = self._first_chunk(attempt, req, generation_config)
+            except Exception as e:
+                if cancel is not None:
+                    cancel.check()
+                errors.append(e)
+                if not is_retryable(e) or attempt == self.max_retries:
+                    raise ModelCallError(
+                        f"streamed model call failed after {len(errors)} attempt(s): {type(e).__name__}: {e}",
+                        errors,
+                    ) from e
+                _pause(backoff_delay(attempt, self.backoff_base, self.backoff_cap))
+                continue
+            try:
+                while what == "chunk":
+                    yield value
+                    idle_until = time.perf_counter() + self.timeout
+                    stop = None
+                    while stop is not winner:
+                        left = idle_until - time.perf_counter()
+                        if left <= 0:
+                            self._record("idle", attempt, "timeout", self.timeout)
+                            raise ModelTimeout(f"stream stalled: no chunk for {self.timeout:g}s")
+                        try:
+                            stop, what, value = chunks.get(timeout=_wait_slice(left, cancel))
+                        except queue.Empty:
+                            if cancel is not None:
+                                cancel.check()
+                if what == "error":
+                    raise ModelCallError(f"streamed model call failed: {type(value).__name__}: {value}", [value]) from value
+                return
+            finally:
+                winner.set()
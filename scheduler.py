@@ -0,0 +1,465 @@
+"""Process-wide scheduling of model calls.
+
+All Streamlit sessions share one backend. Left alone, a burst of sessions
+trips the per-minute quotas and one user hammering Regenerate pushes
+everyone else back. ``FairScheduler`` sits in front of every call:
+
+- quotas: token buckets for requests and tokens per minute. A call
+  reserves one request and its estimated tokens before it starts; the
+  token charge is corrected once the answer is in
+- priority: Generate calls go before Regenerate calls, which go before
+  batch jobs
+- fairness: within a priority, sessions take turns by deficit round-robin
+  weighted by estimated tokens, so ten queued calls from one session do
+  not delay another session's single call by ten calls
+- concurrency: at most ``max_concurrent`` calls in flight
+
+``ScheduledBackend`` puts a backend behind a scheduler. Callers say who
+they are with ``scheduled(session, kind, on_wait)``. While a call waits,
+``on_wait(position, eta_seconds)`` is called about twice a second (from
+the thread that entered the block, unless it is marked thread-safe), and
+once more with position 0 when the call starts; raising from it leaves
+the queue.
+
+Retries and hedges inside a ResilientBackend run under the admission of
+their call; they are not queued again.
+"""
+
+import time
+import threading
+import contextvars
+from collections import deque, namedtuple
+from contextlib import contextmanager
+
+from backends import ModelBackend
+from metrics import REGISTRY, span
+
+PRIORITY = ("generate", "regenerate", "batch")
+_BURST_FRACTION = 1 / 6  # share of a minute's quota that may go out at once
+
+
+class TokenBucket:
+    """Thread-safe token bucket: ``rate`` tokens per second, bursts up to ``capacity``."""
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def acquire(self, n: float = 1.0) -> float:
+        """Block until ``n`` tokens are available; return the time spent waiting."""
+        if self.rate <= 0:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= n:
+                    self._tokens -= n
+                    return waited
+                delay = (n - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def reserve(self, n: float = 1.0) -> float:
+        """Take ``n`` tokens now, going into debt if needed; return the seconds until
+        the debt is paid off. A negative ``n`` gives tokens back."""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.capacity, self._tokens - n)
+            return max(0.0, -self._tokens / self.rate)
+
+    def wait_for(self, n: float) -> float:
+        """Seconds until ``n`` tokens would be available, without taking any."""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            self._refill()
+            return max(0.0, (n - self._tokens) / self.rate)
+
+
+def quota_bucket(per_minute: float) -> TokenBucket:
+    """Bucket that lets at most ``per_minute`` through in any 60-second window
+    (burst plus refill), with bursts of up to a sixth of it; 0 means no limit."""
+    if per_minute <= 0:
+        return TokenBucket(0)
+    burst = per_minute * _BURST_FRACTION
+    return TokenBucket(max(per_minute - burst, per_minute / 2) / 60.0, burst)
+
+
+class Ticket:
+    """One queued model call. ``actual`` may be set to the real token count before release."""
+
+    __slots__ = ("session", "kind", "cost", "actual", "state", "event", "queued_at", "started_at")
+
+    def __init__(self, session, kind, cost):
+        self.session = session
+        self.kind = kind
+        self.cost = cost
+        self.actual = None
+        self.state = "queued"  # queued -> next (picked, waiting for quota) -> running -> done | cancelled
+        self.event = threading.Event()
+        self.queued_at = time.monotonic()
+        self.started_at = None
+
+
+class _DrrQueues:
+    """Queued tickets: strict priority between kinds, deficit round-robin between sessions."""
+
+    def __init__(self, quantum: float):
+        self.quantum = quantum
+        self.queues = {}  # (kind, session) -> deque of tickets
+        self.rings = {k: deque() for k in PRIORITY}  # sessions with queued tickets, in turn order
+        self.deficit = {}  # (kind, session) -> token credit
+        self.turn = dict.fromkeys(PRIORITY, False)  # front session already got this round's quantum
+
+    def __len__(self):
+        return sum(len(q) for q in self.queues.values())
+
+    def push(self, t: Ticket):
+        key = (t.kind, t.session)
+        q = self.queues.get(key)
+        if q is None:
+            q = self.queues[key] = deque()
+            self.rings[t.kind].append(t.session)
+        q.append(t)
+
+    def remove(self, t: Ticket):
+        q = self.queues.get((t.kind, t.session))
+        if q and t in q:
+            q.remove(t)
+
+    def pop(self):
+        for kind in PRIORITY:
+            ring = self.rings[kind]
+            while ring:
+                key = (kind, ring[0])
+                q = self.queues.get(key)
+                if not q:
+                    self._end_turn(kind, key, drop=True)
+                    continue
+                if not self.turn[kind]:
+                    self.deficit[key] = self.deficit.get(key, 0.0) + self.quantum
+                    self.turn[kind] = True
+                if self.deficit[key] >= q[0].cost:
+                    t = q.popleft()
+                    self.deficit[key] -= t.cost
+                    if not q:
+                        self._end_turn(kind, key, drop=True)
+                    return t
+                self._end_turn(kind, key)
+        return None
+
+    def _end_turn(self, kind, key, drop=False):
+        self.turn[kind] = False
+        if drop:
+            self.rings[kind].popleft()
+            self.queues.pop(key, None)
+            self.deficit.pop(key, None)
+        else:
+            self.rings[kind].rotate(-1)
+
+    def order(self) -> list:
+        """Queued tickets in the order they would be dispatched."""
+        sim = _DrrQueues(self.quantum)
+        sim.queues = {k: deque(q) for k, q in self.queues.items()}
+        sim.rings = {k: deque(r) for k, r in self.rings.items()}
+        sim.deficit = dict(self.deficit)
+        sim.turn = dict(self.turn)
+        out = []
+        t = sim.pop()
+        while t is not None:
+            out.append(t)
+            t = sim.pop()
+        return out
+
+
+class FairScheduler:
+    """Admits model calls under RPM/TPM quotas, by priority and fairly across sessions.
+
+    ``rpm`` / ``tpm`` of 0 mean no limit. ``quantum`` is the token credit a
+    session gets per round-robin turn; about one typical call.
+    """
+
+    def __init__(self, rpm: float = 0, tpm: float = 0, max_concurrent: int = 8, quantum: float = 8000):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_concurrent = max(1, max_concurrent)
+        self._requests = quota_bucket(rpm)
+        self._tokens = quota_bucket(tpm)
+        self._queue = _DrrQueues(quantum)
+        self._cond = threading.Condition()
+        self._next = None  # picked ticket waiting for quota
+        self._running = 0
+        self._service_s = None  # moving average of call duration
+        self._thread = None
+        self.counters = {"admitted": 0, "cancelled": 0}
+
+    # ------------------ callers ------------------
+    def submit(self, session: str, kind: str, cost: float) -> Ticket:
+        if kind not in PRIORITY:
+            raise ValueError(f"unknown call kind {kind!r}; expected one of {', '.join(PRIORITY)}")
+        t = Ticket(session, kind, max(1.0, float(cost)))
+        with self._cond:
+            self._queue.push(t)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._dispatch, name="model-scheduler", daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+        return t
+
+    def wait(self, t: Ticket, on_wait=None, poll: float = 0.5) -> None:
+        """Block until ``t`` may start, reporting (position, eta) to ``on_wait`` meanwhile."""
+        waited = False
+        while not t.event.wait(poll if on_wait else None):
+            on_wait(*self.position(t))
+            waited = True
+        if waited:
+            on_wait(0, 0.0)
+
+    def acquire(self, session: str, kind: str, cost: float, on_wait=None) -> Ticket:
+        t = self.submit(session, kind, cost)
+        try:
+            self.wait(t, on_wait)
+        except BaseException:
+            self.cancel(t)
+            raise
+        REGISTRY.observe("genwebly_queue_seconds", {"kind": kind}, t.started_at - t.queued_at)
+        return t
+
+    def release(self, t: Ticket) -> None:
+        with self._cond:
+            if t.state != "running":
+                return
+            t.state = "done"
+            self._running -= 1
+            secs = time.monotonic() - t.started_at
+            self._service_s = secs if self._service_s is None else 0.8 * self._service_s + 0.2 * secs
+            self._cond.notify_all()
+        if t.actual is not None:
+            self._tokens.reserve(t.actual - t.cost)
+
+    def cancel(self, t: Ticket) -> None:
+        with self._cond:
+            if t.state == "running":
+                pass
+            elif t.state in ("queued", "next"):
+                self._queue.remove(t)
+                t.state = "cancelled"
+                self.counters["cancelled"] += 1
+                return
+            else:
+                return
+        self.release(t)
+
+    @contextmanager
+    def slot(self, session: str, kind: str, cost: float, on_wait=None):
+        """``with scheduler.slot(...) as ticket:`` runs the body once admitted."""
+        t = self.acquire(session, kind, cost, on_wait)
+        try:
+            yield t
+        finally:
+            self.release(t)
+
+    # ------------------ introspection ------------------
+    def position(self, t: Ticket):
+        """(1-based queue position, estimated seconds until ``t`` starts); (0, 0.0) once running."""
+        with self._cond:
+            if t.state not in ("queued", "next"):
+                return 0, 0.0
+            # the ticket picked next has already taken its quota from the buckets
+            picked = self._next is not None
+            ahead = [] if t is self._next else self._queue.order()
+            if t in ahead:
+                ahead = ahead[:ahead.index(t)]
+            free = self.max_concurrent - self._running
+            service = self._service_s if self._service_s is not None else 10.0
+        own = 0 if t is self._next else 1
+        n = len(ahead) + (1 if picked and own else 0)
+        eta = max(
+            self._requests.wait_for(len(ahead) + own),
+            self._tokens.wait_for(sum(x.cost for x in ahead) + own * t.cost),
+            service * max(0, n + 1 - free) / self.max_concurrent,
+        )
+        return n + 1, eta
+
+    def stats(self) -> dict:
+        with self._cond:
+            queued = {k: 0 for k in PRIORITY}
+            for (kind, _session), q in self._queue.queues.items():
+                queued[kind] += len(q)
+            out = dict(self.counters)
+            out.update(queued=queued, running=self._running, service_s=self._service_s)
+        return out
+
+    # ------------------ dispatcher ------------------
+    def _dispatch(self):
+        while True:
+            with self._cond:
+                while not len(self._queue) or self._running >= self.max_concurrent:
+                    self._cond.wait()
+                t = self._queue.pop()
+                if t is None:
+                    continue
+                t.state = "next"
+                self._next = t
+            delay = max(self._requests.reserve(1), self._tokens.reserve(t.cost))
+            if delay:
+                time.sleep(delay)
+            with self._cond:
+                self._next = None
+                if t.state == "next":
+                    t.state = "running"
+                    t.started_at = time.monotonic()
+                    self._running += 1
+                    self.counters["admitted"] += 1
+                    t.event.set()
+                else:  # cancelled while waiting for quota: hand the reservation back
+                    self._requests.reserve(-1)
+                    self._tokens.reserve(-t.cost)
+
+
+# ------------------ backend wrapper ------------------
+Caller = namedtuple("Caller", "session kind on_wait thread cancel")
+_caller = contextvars.ContextVar("genwebly_caller", default=Caller("", "generate", None, None, None))
+
+
+@contextmanager
+def scheduled(session: str, kind: str = "generate", on_wait=None, threadsafe: bool = False, cancel=None):
+    """Model calls made inside this block are queued as ``kind`` for ``session``.
+
+    ``on_wait`` only runs for calls made on this thread unless ``threadsafe``.
+    ``cancel`` (a Job, or anything with ``wait(timeout)`` and ``check()``)
+    lets backends stop waiting for an answer or a retry once it is set.
+    """
+    token = _caller.set(Caller(session, kind, on_wait, None if threadsafe else threading.get_ident(), cancel))
+    try:
+        yield
+    finally:
+        _caller.reset(token)
+
+
+def current_cancel():
+    """The ``cancel`` of the enclosing ``scheduled`` block, or None."""
+    return _caller.get().cancel
+
+
+@contextmanager
+def cancelled_by(cancel):
+    """Calls made inside this block keep the enclosing ``scheduled`` caller but use ``cancel``."""
+    token = _caller.set(_caller.get()._replace(cancel=cancel))
+    try:
+        yield
+    finally:
+        _caller.reset(token)
+
+
+class CallStopped(Exception):
+    pass
+
+
+class StopSignal:
+    """A ``cancel`` for a group of calls: set by ``stop()``, or by ``parent`` (an outer cancel)."""
+
+    def __init__(self, parent=None, poll: float = 0.2):
+        self.parent = parent
+        self.poll = poll
+        self._event = threading.Event()
+
+    def stop(self) -> None:
+        self._event.set()
+
+    def wait(self, timeout: float) -> bool:
+        if self.parent is None:
+            return self._event.wait(timeout)
+        deadline = time.monotonic() + timeout
+        while True:
+            if self._event.wait(max(0.0, min(self.poll, deadline - time.monotonic()))) or self.parent.wait(0):
+                return True
+            if time.monotonic() >= deadline:
+                return False
+
+    def check(self) -> None:
+        if self.parent is not None:
+            self.parent.check()
+        if self._event.is_set():
+            raise CallStopped("call stopped")
+
+
+def _checking(cancel, on_wait):
+    """``on_wait`` that leaves the queue once ``cancel`` is set."""
+
+    def waiting(position, eta):
+        cancel.check()
+        if on_wait is not None:
+            on_wait(position, eta)
+
+    return waiting
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text or "") // 4)
+
+
+class ScheduledBackend(ModelBackend):
+    """Backend whose calls wait for a ``FairScheduler`` slot first.
+
+    ``expected_output_tokens`` is charged up front for the answer and
+    corrected when the call finishes.
+    """
+
+    def __init__(self, inner: ModelBackend, scheduler: FairScheduler, expected_output_tokens: int = 4000):
+        self.inner = inner
+        self.scheduler = scheduler
+        self.expected_output_tokens = expected_output_tokens
+        self.name = inner.name
+        self.model_name = inner.model_name
+
+    @property
+    def available(self) -> bool:
+        return self.inner.available
+
+    def count_tokens(self, req):
+        return self.inner.count_tokens(req)
+
+    def stats(self) -> dict:
+        out = dict(self.inner.stats()) if hasattr(self.inner, "stats") else {}
+        out["scheduler"] = self.scheduler.stats()
+        return out
+
+    @contextmanager
+    def _admitted(self, req):
+        c = _caller.get()
+        # UI callbacks only run on the thread that registered them
+        on_wait = c.on_wait if c.thread in (None, threading.get_ident()) else None
+        if c.cancel is not None:
+            on_wait = _checking(c.cancel, on_wait)
+        with span("queue_wait"):
+            t = self.scheduler.acquire(c.session, c.kind, estimate_tokens(req) + self.expected_output_tokens, on_wait)
+        try:
+            yield t
+        finally:
+            self.scheduler.release(t)
+
+    def generate(self, req, generation_config):
+        with self._admitted(req) as t:
+            text = self.inner.generate(req, generation_config)
+            t.actual = estimate_tokens(req) + estimate_tokens(text)
+            return text
+
+    def stream(self, req, generation_config):
+        with self._admitted(req) as t:
+            size = 0
+            for text in self.inner.stream(req, generation_config):
+                size += len(text)
+                yield text
+            t.actual = estimate_tokens(req) + max(1, size // 4)
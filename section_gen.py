@@ -0,0 +1,287 @@
+"""Section-parallel page generation.
+
+``build_prompt`` asks for one long completion (header/nav, hero, three
+features, footer). The model writes it token by token, so the wait grows
+with the size of the whole page. Here the page is built in two steps:
+
+1. a short spec call settles what the sections must share: site name,
+   fonts and the anchor ids of the feature sections. The palette comes
+   from ``theme_palette`` and the class names and base CSS are fixed
+   locally, so this answer is a few lines of JSON
+2. header, hero, each feature and the footer are generated concurrently
+   against the spec
+
+``stitch`` joins the fragments into one document. Each section's
+``<style>`` is merged into a single block with duplicate rules dropped,
+``<link>`` tags go to the head and scripts to the end of the body. The
+stitched page then takes the usual sanitize/post-processing path.
+Wall time is about the spec call plus the slowest section (see
+``python -m benchmarks.section_gen``).
+"""
+
+import re
+import json
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from metrics import propagate, span
+from scheduler import StopSignal, cancelled_by, current_cancel
+from themes import theme_palette
+
+Part = namedtuple("Part", "key element brief")
+
+CLASSES = {"container": "container", "button": "btn", "card": "card"}
+SPEC_MARKER = "--- DESIGN SPEC ---"
+SECTION_MARKER = "--- SECTION TO WRITE ---"
+
+_DEFAULT_FONTS = ("system-ui, sans-serif", "system-ui, sans-serif")
+_SAFE_FONT_RE = re.compile(r"^[\w\s,'\"-]{1,80}$")
+_ID_CHARS_RE = re.compile(r"[^a-z0-9-]+")
+_FENCE_RE = re.compile(r"```(?:html|json|css)?", re.I)
+_STYLE_RE = re.compile(r"<style\b[^>]*>(.*?)</style\s*>", re.I | re.S)
+_SCRIPT_RE = re.compile(r"<script\b([^>]*)>(.*?)</script\s*>", re.I | re.S)
+_SRC_RE = re.compile(r"""\bsrc\s*=\s*["']([^"']+)["']""", re.I)
+_LINK_RE = re.compile(r"<link\b[^>]*>", re.I)
+_BODY_RE = re.compile(r"<body\b[^>]*>(.*?)(?:</body\s*>|$)", re.I | re.S)
+_SHELL_RE = re.compile(r"<!doctype[^>]*>|</?html\b[^>]*>|<head\b[^>]*>.*?</head\s*>|</?body\b[^>]*>", re.I | re.S)
+_CSS_COMMENT_RE = re.compile(r"/\*.*?\*/", re.S)
+_CSS_SPACE_RE = re.compile(r"\s*([{};,])\s*")
+
+
+# ------------------ spec ------------------
+def _image_rule(img_mode, img_hint) -> str:
+    if img_mode in ("data", "url"):
+        return "The user's image is the hero background; it is added afterwards. Do not include other images."
+    if img_mode == "svg" or (img_hint and img_hint.strip()):
+        return f"Visuals as inline SVG or CSS drawings that match the hint; no external URLs. Image Hint: {img_hint}"
+    return "Do NOT include external <img>. Use gradients/SVG if visuals are needed."
+
+
+def build_spec_prompt(user_prompt: str, temperature: float = 0.8) -> str:
+    return (
+        "Plan a landing page: header/nav, hero, 3 feature sections, footer. "
+        "Other writers build each section in parallel from your plan.\n"
+        "Return ONLY a JSON object (no markdown) with keys:\n"
+        '  "site_name": short brand name,\n'
+        '  "tagline": one sentence,\n'
+        '  "heading_font" and "body_font": CSS font-family stacks (web-safe or system fonts),\n'
+        '  "tone": a few words on the visual style,\n'
+        '  "features": exactly 3 objects {"id": lowercase-anchor-id, "title": nav label}.\n'
+        f"{SPEC_MARKER}\nUser request:\n{user_prompt}\n(temperature={temperature})"
+    )
+
+
+def _slug(s: str) -> str:
+    return _ID_CHARS_RE.sub("-", (s or "").lower()).strip("-")[:32]
+
+
+def parse_spec(answer: str, user_prompt: str) -> dict:
+    """Spec dict from the model's JSON; anything missing or unusable gets a default."""
+    try:
+        text = _FENCE_RE.sub("", answer or "")
+        raw = json.loads(text[text.index("{"):text.rindex("}") + 1])
+    except ValueError:
+        raw = {}
+    if not isinstance(raw, dict):
+        raw = {}
+
+    fonts = [raw.get("heading_font"), raw.get("body_font")]
+    fonts = [f if isinstance(f, str) and _SAFE_FONT_RE.match(f) else d for f, d in zip(fonts, _DEFAULT_FONTS)]
+    features, used = [], {"hero", "contact"}
+    listed = raw.get("features") if isinstance(raw.get("features"), list) else []
+    for i in range(3):
+        item = listed[i] if i < len(listed) and isinstance(listed[i], dict) else {}
+        anchor = _slug(item.get("id") or item.get("title") or "")
+        if not anchor or anchor in used or not anchor[0].isalpha():
+            anchor = f"feature-{i + 1}"
+        used.add(anchor)
+        features.append({"id": anchor, "title": _clean(item.get("title"), anchor.replace("-", " ").title(), 40)})
+    return {
+        "site_name": _clean(raw.get("site_name"), (user_prompt or "Landing page").strip().split("\n")[0][:40].title(), 40),
+        "tagline": _clean(raw.get("tagline"), "", 160),
+        "tone": _clean(raw.get("tone"), "", 80),
+        "heading_font": fonts[0],
+        "body_font": fonts[1],
+        "features": features,
+        "palette": theme_palette(user_prompt),
+        "classes": dict(CLASSES),
+    }
+
+
+def _clean(value, default: str, limit: int) -> str:
+    return " ".join(str(value).split())[:limit] if value else default
+
+
+def base_css(spec: dict) -> str:
+    """Shared rules every section relies on: palette variables, fonts, shared classes."""
+    p, c = spec["palette"], spec["classes"]
+    return (
+        ":root{" + "".join(f"--{k}:{v};" for k, v in p.items()) + "}\n"
+        "html{scroll-behavior:smooth}\n"
+        f"body{{margin:0;font-family:{spec['body_font']};background:var(--bg);color:var(--text);line-height:1.6}}\n"
+        f"h1,h2,h3{{font-family:{spec['heading_font']};line-height:1.2}}\n"
+        f".{c['container']}{{width:min(1100px,92%);margin:0 auto}}\n"
+        f".{c['button']}{{display:inline-block;padding:.75rem 1.4rem;border-radius:999px;"
+        "background:var(--primary);color:var(--bg);text-decoration:none;font-weight:600}\n"
+        f".{c['card']}{{background:var(--bg2);border:1px solid var(--border);border-radius:16px;padding:1.5rem}}\n"
+        "section{padding:4rem 0}"
+    )
+
+
+def plan_parts(spec: dict) -> list:
+    """The sections to generate, in page order."""
+    anchors = [("hero", "Home")] + [(f["id"], f["title"]) for f in spec["features"]] + [("contact", "Contact")]
+    nav = ", ".join(f'#{a} "{t}"' for a, t in anchors)
+    parts = [
+        Part("header", '<header class="site-header">', f"site header with the site name and a <nav> linking to {nav}"),
+        Part("hero", '<section id="hero">', "hero: headline, the tagline and a .btn call to action to the first feature"),
+    ]
+    for i, f in enumerate(spec["features"]):
+        element = f'<section id="{f["id"]}" class="feature">'
+        parts.append(Part(f["id"], element, f'feature {i + 1} of 3: "{f["title"]}", content in a .card'))
+    parts.append(Part("footer", '<footer id="contact">', "footer: contact details (forms must not navigate away), copyright"))
+    return parts
+
+
+def build_part_prompt(spec: dict, part: Part, user_prompt: str, img_mode=None, img_hint=None,
+                      stack_rules: str = "", temperature: float = 0.8) -> str:
+    shared = {k: spec[k] for k in ("site_name", "tagline", "tone", "heading_font", "body_font", "features")}
+    rules = [
+        "Write ONE section of a landing page. Other sections are written in parallel from the same design spec.",
+        "Return ONLY: at most one <style> block with rules scoped to this section, then the section element, "
+        "then optionally one <script>. No <html>, <head> or <body>, no markdown.",
+        f"Start the element with exactly: {part.element}",
+        "Already defined for the whole page (do not redefine): CSS variables "
+        + ", ".join(f"var(--{k})" for k in spec["palette"])
+        + "; classes " + ", ".join("." + c for c in spec["classes"].values())
+        + "; body and heading fonts. Use the variables instead of raw colors.",
+        "Links: in-page anchors only; external links target='_blank' rel='noopener noreferrer'.",
+        _image_rule(img_mode, img_hint) if part.key == "hero" else "No images; use CSS or small inline SVG if needed.",
+    ]
+    if stack_rules:
+        rules.append("Stack rules:\n" + stack_rules)
+    return (
+        "\n".join(rules)
+        + f"\n{SECTION_MARKER}\n{part.key}: {part.brief}\n"
+        + f"Design spec: {json.dumps(shared)}\n"
+        + f"User request:\n{user_prompt}\n(temperature={temperature})"
+    )
+
+
+# ------------------ stitching ------------------
+def split_fragment(text: str):
+    """(css list, head tags, markup, scripts) of one section answer."""
+    text = _FENCE_RE.sub("", text or "").strip()
+    css = [m.group(1) for m in _STYLE_RE.finditer(text)]
+    links = _LINK_RE.findall(text)
+    scripts = [m.group(0) for m in _SCRIPT_RE.finditer(text)]
+    rest = _LINK_RE.sub("", _SCRIPT_RE.sub("", _STYLE_RE.sub("", text)))
+    m = _BODY_RE.search(rest)
+    markup = m.group(1) if m else rest
+    return css, links, _SHELL_RE.sub("", markup).strip(), scripts
+
+
+def css_rules(css: str) -> list:
+    """Top-level rules of a stylesheet (at-rule blocks stay whole)."""
+    css = _CSS_COMMENT_RE.sub("", css)
+    rules, depth, start = [], 0, 0
+    for i, ch in enumerate(css):
+        if ch == "{":
+            depth += 1
+        elif ch == "}" and depth:
+            depth -= 1
+            if not depth:
+                rules.append(css[start:i + 1].strip())
+                start = i + 1
+        elif ch == ";" and not depth:  # @import / @charset
+            rules.append(css[start:i + 1].strip())
+            start = i + 1
+    return [r for r in rules if r]
+
+
+def merge_css(sheets) -> str:
+    """One stylesheet from several, dropping repeated rules (first one wins); @import/@charset first."""
+    seen, head, body = set(), [], []
+    for sheet in sheets:
+        for rule in css_rules(sheet):
+            key = _CSS_SPACE_RE.sub(r"\1", " ".join(rule.split())).replace(";}", "}")
+            if key in seen:
+                continue
+            seen.add(key)
+            (head if rule.startswith(("@import", "@charset")) else body).append(rule)
+    return "\n".join(head + body)
+
+
+def stitch(spec: dict, parts, fragments: dict) -> str:
+    """One document from the section answers in ``fragments`` (part key -> text); missing parts are skipped."""
+    sheets, links, body, scripts = [base_css(spec)], [], [], []
+    for part in parts:
+        if part.key not in fragments:
+            continue
+        css, head_tags, markup, part_scripts = split_fragment(fragments[part.key])
+        sheets.extend(css)
+        links.extend(head_tags)
+        scripts.extend(part_scripts)
+        body.append(markup)
+    seen_src, unique_scripts = set(), []
+    for tag in scripts:
+        m = _SRC_RE.search(tag)
+        key = m.group(1) if m else " ".join(tag.split())
+        if key not in seen_src:
+            seen_src.add(key)
+            unique_scripts.append(tag)
+    head = "\n".join(dict.fromkeys(links))
+    return (
+        '<!DOCTYPE html>\n<html lang="en">\n<head>\n<meta charset="utf-8">\n'
+        '<meta name="viewport" content="width=device-width, initial-scale=1">\n'
+        f"<title>{_escape(spec['site_name'])}</title>\n"
+        + (head + "\n" if head else "")
+        + f"<style>\n{merge_css(sheets)}\n</style>\n</head>\n<body>\n"
+        + "\n".join(body)
+        + ("\n" + "\n".join(unique_scripts) if unique_scripts else "")
+        + "\n</body>\n</html>"
+    )
+
+
+def _escape(s: str) -> str:
+    return s.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+# ------------------ driver ------------------
+def generate_sectioned(generate, user_prompt: str, img_mode=None, img_hint=None, stack_rules: str = "",
+                       temperature: float = 0.8, max_workers: int = 6, on_progress=None) -> str:
+    """Spec call, then every section concurrently; returns the stitched raw page.
+
+    ``generate(req, generation_config) -> str`` must be thread-safe. The
+    first failing section fails the page and stops the sections still
+    waiting for an answer (through the scheduler's cancel, see
+    ``scheduler.cancelled_by``). ``on_progress(done, total, doc)`` gets the
+    page stitched from the sections finished so far.
+    """
+    with span("section_spec"):
+        spec = parse_spec(generate(build_spec_prompt(user_prompt, temperature), {"temperature": 0.4}), user_prompt)
+    parts = plan_parts(spec)
+    fragments = {}
+    stop = StopSignal(current_cancel())
+    workers = max(1, min(max_workers, len(parts)))
+    with cancelled_by(stop), ThreadPoolExecutor(max_workers=workers, thread_name_prefix="section") as pool:
+        futures = {
+            pool.submit(
+                propagate(generate),
+                build_part_prompt(spec, part, user_prompt, img_mode, img_hint, stack_rules, temperature),
+                {"temperature": temperature},
+            ): part.key
+            for part in parts
+        }
+        try:
+            for fut in as_completed(futures):
+                fragments[futures[fut]] = fut.result()
+                if on_progress is not None and len(fragments) < len(parts):
+                    on_progress(len(fragments), len(parts), stitch(spec, parts, fragments))
+        except BaseException:
+            stop.stop()
+            for fut in futures:
+                fut.cancel()
+            raise
+    with span("stitch"):
+        return stitch(spec, parts, fragments)
@@ -0,0 +1,197 @@
+"""Section-scoped revisions.
+
+``index_sections`` cuts a page into addressable top-level blocks: elements
+with an ``id``, landmark elements (header/nav/main/footer/aside), and the
+inline ``<style>``/``<script>`` blocks. ``select_sections`` decides which of
+those a change note touches. Only those blocks go to the model, plus a
+compact outline of the rest, and ``splice_sections`` puts the returned
+fragments back in place.
+"""
+
+import re
+from collections import namedtuple
+
+from compaction import PLACEHOLDER_RULE, has_placeholders
+
+Section = namedtuple("Section", "key tag start end attrs")
+
+LANDMARKS = ("header", "nav", "main", "footer", "aside")
+_RAW_TEXT = ("style", "script")
+_VOID = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+
+_TAG_RE = re.compile(r"<(/?)([a-zA-Z][\w-]*)([^>]*)>|<!--.*?-->", re.S)
+_ID_RE = re.compile(r"""\bid\s*=\s*["']([^"']+)["']""", re.I)
+_CLASS_RE = re.compile(r"""\bclass\s*=\s*["']([^"']+)["']""", re.I)
+_FRAGMENT_RE = re.compile(r"<!--section:([^>]+?)-->(.*?)<!--/section:\1-->", re.S)
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+# Change-note vocabulary that points at CSS or JS rather than at one block.
+# Words for things that live in the markup ("form", "date") stay out of
+# SCRIPT_WORDS: "add a contact form" must reach the block that gets the form.
+STYLE_WORDS = {
+    "color", "colour", "colors", "font", "fonts", "gold", "background", "theme", "dark", "light",
+    "spacing", "padding", "margin", "border", "rounded", "shadow", "gradient", "bigger", "smaller",
+    "size", "bold", "style", "css", "buttons", "button", "links", "hover", "palette", "contrast",
+}
+SCRIPT_WORDS = {
+    "click", "js", "javascript", "script", "modal", "localstorage", "validation", "validate",
+    "toggle", "tabs", "animation", "interactive", "scroll",
+}
+# Loose aliases from everyday words to landmark / common section ids.
+ALIASES = {
+    "menu": "nav", "navbar": "nav", "navigation": "nav", "top": "header", "banner": "hero",
+    "headline": "hero", "title": "hero", "bottom": "footer", "copyright": "footer",
+    "contacts": "contact", "email": "contact", "story": "about",
+}
+
+
+def index_sections(html: str):
+    """Top-level addressable blocks of ``html`` in document order."""
+    sections = []
+    stack = []  # (tag, start, attrs, indexed)
+    counts = {}
+    indexed_depth = 0
+    pos = 0
+    while True:
+        m = _TAG_RE.search(html, pos)
+        if not m:
+            break
+        pos = m.end()
+        if m.group(2) is None:  # comment
+            continue
+        closing, tag, attrs = m.group(1), m.group(2).lower(), m.group(3)
+
+        if not closing and tag in _RAW_TEXT:
+            end_m = re.compile(rf"</{tag}\s*>", re.I).search(html, m.end())
+            end = end_m.end() if end_m else len(html)
+            pos = end
+            if indexed_depth == 0 and not re.search(r"\bsrc\s*=", attrs, re.I):
+                sections.append(_make(tag, m.start(), end, attrs, counts))
+            continue
+
+        if closing:
+            # pop to the matching open tag (tolerates unclosed children)
+            for i in range(len(stack) - 1, -1, -1):
+                if stack[i][0] == tag:
+                    t, start, a, indexed = stack[i]
+                    if indexed:
+                        sections.append(_make(t, start, m.end(), a, counts))
+                    if any(e[3] for e in stack[i:]):
+                        indexed_depth = 0  # at most one indexed element is open at a time
+                    del stack[i:]
+                    break
+            continue
+
+        if tag in _VOID or attrs.rstrip().endswith("/"):
+            continue
+        qualifies = indexed_depth == 0 and (tag in LANDMARKS or (_ID_RE.search(attrs) and tag not in ("html", "body")))
+        stack.append((tag, m.start(), attrs, qualifies))
+        if qualifies:
+            indexed_depth += 1
+
+    sections.sort(key=lambda s: s.start)
+    return sections
+
+
+def _make(tag, start, end, attrs, counts):
+    m = _ID_RE.search(attrs)
+    if m and tag not in _RAW_TEXT:
+        key = "#" + m.group(1)
+    else:
+        n = counts.get(tag, 0)
+        counts[tag] = n + 1
+        key = tag if (n == 0 and tag in LANDMARKS) else f"{tag}[{n}]"
+    return Section(key, tag, start, end, attrs)
+
+
+def _section_words(html: str, s: Section) -> set:
+    words = set(_WORD_RE.findall(s.key.lower()))
+    words.add(s.tag)
+    c = _CLASS_RE.search(s.attrs)
+    if c:
+        words.update(_WORD_RE.findall(c.group(1).lower()))
+    # first heading gives a human name ("About us", "Pricing")
+    h = re.search(r"<h[1-3][^>]*>(.*?)</h[1-3]>", html[s.start:s.end], re.S | re.I)
+    if h:
+        words.update(_WORD_RE.findall(re.sub(r"<[^>]+>", " ", h.group(1)).lower()))
+    return words
+
+
+def select_sections(html: str, sections, change_note: str, max_share: float = 0.6):
+    """Sections the change note touches, or None if a full-page revision is the better call."""
+    note_words = set(_WORD_RE.findall((change_note or "").lower()))
+    if not sections or not note_words:
+        return None
+    note_words |= {ALIASES[w] for w in note_words if w in ALIASES}
+
+    picked = []
+    for s in sections:
+        if s.tag == "style":
+            hit = bool(note_words & STYLE_WORDS)
+        elif s.tag == "script":
+            hit = bool(note_words & SCRIPT_WORDS)
+        else:
+            hit = bool(note_words & (_section_words(html, s) - {"section", "div"}))
+        if hit:
+            picked.append(s)
+
+    if not picked:
+        return None
+    if sum(s.end - s.start for s in picked) > max_share * max(len(html), 1):
+        return None
+    return picked
+
+
+def outline(html: str, sections, selected) -> str:
+    """One line per block so the model knows what surrounds the fragments it edits."""
+    chosen = {s.key for s in selected}
+    lines = []
+    for s in sections:
+        mark = "EDIT" if s.key in chosen else "keep"
+        text = re.sub(r"<[^>]+>", " ", html[s.start:s.end]) if s.tag not in _RAW_TEXT else ""
+        text = re.sub(r"\s+", " ", text).strip()[:60]
+        lines.append(f"- [{mark}] {s.key} <{s.tag}{s.attrs[:60]}> {text}".rstrip())
+    return "\n".join(lines)
+
+
+def build_section_revision_prompt(html: str, sections, selected, change_list: str, stack_rules: str = "") -> str:
+    rules = [
+        "Revise ONLY the HTML fragments below; they are parts of a larger page.",
+        "APPLY ONLY the requested changes. Keep ids, classes and anchors the other parts rely on.",
+        "Return EVERY fragment you were given, each wrapped exactly as received: <!--section:KEY--> ... <!--/section:KEY-->.",
+        "Return nothing else (no markdown, no full document).",
+        "Insert an HTML comment per applied change like <!--applied: change-key--> inside the fragment you changed.",
+        "YOU MUST make at least one visible modification.",
+    ]
+    if stack_rules:
+        rules.append("Respect these stack rules:\n" + stack_rules)
+    if has_placeholders(html):
+        rules.append(PLACEHOLDER_RULE)
+    rules.append("Apply these changes:\n" + (change_list.strip() or "gentle improvements only"))
+    frags = "\n\n".join(
+        f"<!--section:{s.key}-->\n{html[s.start:s.end]}\n<!--/section:{s.key}-->" for s in selected
+    )
+    return (
+        "\n".join(rules)
+        + "\n\n--- PAGE OUTLINE (for context, do not return) ---\n"
+        + outline(html, sections, selected)
+        + "\n\n--- FRAGMENTS TO EDIT ---\n"
+        + frags
+    )
+
+
+def splice_sections(html: str, selected, response: str):
+    """Put returned fragments back into ``html``; None if the response had none of them."""
+    text = (response or "").replace("```html", "").replace("```", "")
+    returned = {m.group(1).strip(): m.group(2).strip("\n") for m in _FRAGMENT_RE.finditer(text)}
+    hits = [s for s in selected if s.key in returned]
+    if not hits:
+        return None
+    out = []
+    pos = 0
+    for s in sorted(hits, key=lambda s: s.start):
+        out.append(html[pos:s.start])
+        out.append(returned[s.key])
+        pos = s.end
+    out.append(html[pos:])
+    return "".join(out)
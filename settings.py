@@ -0,0 +1,176 @@
+"""Process-wide configuration and session defaults.
+
+Streamlit re-executes app.py on every interaction, so anything that only
+has to happen once lives here: ``load_settings`` reads .env and the
+GENWEBLY_* variables a single time (app.py caches the result with
+``st.cache_resource``), and the ``make_*`` factories build the backend,
+caches and stores from it. Nothing here imports Streamlit or a model SDK.
+"""
+
+import os
+import uuid
+from collections import namedtuple
+
+Settings = namedtuple(
+    "Settings",
+    "api_key backend timeout_s retries hedge hedge_budget call_log "
+    "cache_dir cache_items cache_mb cache_ttl_hours asset_dir asset_max_dim asset_mb "
+    "history_mb history_versions stream_repaint_ms variant_workers metrics_port "
+    "similar_show similar_serve rpm tpm max_concurrent job_workers job_poll_ms "
+    "fake_latency fake_jitter fake_responses fake_error_rate fake_tail_rate "
+    "fake_rpm fake_tpm fake_char_latency",
+)
+
+SESSION_DEFAULTS = {
+    "html": "",
+    "raw_html": "",
+    "regen_notes": "",
+    "img_value": None,
+    "last_img_mode": None,
+    "last_img_value": "",
+    "last_prompt": "",
+    "stack_langs": [],
+    "show_learn": False,
+    "stack_js_mode": "Static",
+    "stack_js_use": "",
+    "stack_choice": "— choose —",
+    "stack_prev_choice": "— choose —",
+    "render_tick": 0,
+    "variants": [],
+}
+
+
+def load_settings(env=None, dotenv: bool = True) -> Settings:
+    """Read configuration from ``env`` (default: os.environ, after loading .env)."""
+    if env is None:
+        if dotenv:
+            from dotenv import load_dotenv
+
+            load_dotenv()
+        env = os.environ
+    get = env.get
+    return Settings(
+        api_key=get("GEMINI_API_KEY", ""),
+        backend=get("GENWEBLY_BACKEND", "gemini"),
+        timeout_s=float(get("GENWEBLY_TIMEOUT_S", "120")),
+        retries=int(get("GENWEBLY_RETRIES", "3")),
+        hedge=get("GENWEBLY_HEDGE", "0") == "1",
+        hedge_budget=float(get("GENWEBLY_HEDGE_BUDGET", "0.1")),
+        call_log=get("GENWEBLY_CALL_LOG", ""),
+        cache_dir=get("GENWEBLY_CACHE_DIR", ".genwebly_cache"),
+        cache_items=int(get("GENWEBLY_CACHE_ITEMS", "64")),
+        cache_mb=int(get("GENWEBLY_CACHE_MB", "200")),
+        cache_ttl_hours=float(get("GENWEBLY_CACHE_TTL_HOURS", "168")),
+        asset_dir=get("GENWEBLY_ASSET_DIR", "static/assets"),
+        asset_max_dim=int(get("GENWEBLY_ASSET_MAX_DIM", "1600")),
+        asset_mb=int(get("GENWEBLY_ASSET_MB", "500")),
+        history_mb=int(get("GENWEBLY_HISTORY_MB", "8")),
+        history_versions=int(get("GENWEBLY_HISTORY_VERSIONS", "50")),
+        stream_repaint_ms=int(get("GENWEBLY_STREAM_REPAINT_MS", "400")),
+        variant_workers=int(get("GENWEBLY_VARIANT_WORKERS", "4")),
+        metrics_port=int(get("GENWEBLY_METRICS_PORT", "0")),
+        similar_show=float(get("GENWEBLY_SIMILAR_SHOW", "0.5")),
+        similar_serve=float(get("GENWEBLY_SIMILAR_SERVE", "0.9")),
+        rpm=float(get("GENWEBLY_RPM", "0")),
+        tpm=float(get("GENWEBLY_TPM", "0")),
+        max_concurrent=int(get("GENWEBLY_MAX_CONCURRENT", "8")),
+        job_workers=int(get("GENWEBLY_JOB_WORKERS", "8")),
+        job_poll_ms=int(get("GENWEBLY_JOB_POLL_MS", "500")),
+        fake_latency=float(get("GENWEBLY_FAKE_LATENCY", "0.5")),
+        fake_jitter=float(get("GENWEBLY_FAKE_JITTER", "0")),
+        fake_responses=get("GENWEBLY_FAKE_RESPONSES", ""),
+        fake_error_rate=float(get("GENWEBLY_FAKE_ERROR_RATE", "0")),
+        fake_tail_rate=float(get("GENWEBLY_FAKE_TAIL_RATE", "0")),
+        fake_rpm=int(get("GENWEBLY_FAKE_RPM", "0")),
+        fake_tpm=int(get("GENWEBLY_FAKE_TPM", "0")),
+        fake_char_latency=float(get("GENWEBLY_FAKE_CHAR_LATENCY", "0")),
+    )
+
+
+def init_session(state) -> bool:
+    """Fill missing session keys once per session; returns True on the first call."""
+    if state.get("_session_ready"):
+        return False
+    for k, v in SESSION_DEFAULTS.items():
+        if k not in state:
+            state[k] = list(v) if isinstance(v, list) else v
+    if "session_id" not in state:
+        state["session_id"] = uuid.uuid4().hex  # the scheduler's fairness key
+    state["_session_ready"] = True
+    return True
+
+
+# ------------------ resources (built once per process by the caller) ------------------
+def make_model_backend(s: Settings):
+    """The bare model backend (no retries or scheduling) named by ``s.backend``."""
+    from backends import create_backend
+
+    return create_backend(
+        s.backend,
+        api_key=s.api_key,
+        request_timeout=s.timeout_s,
+        fake_options=dict(
+            latency=s.fake_latency,
+            jitter=s.fake_jitter,
+            responses_dir=s.fake_responses,
+            error_rate=s.fake_error_rate,
+            tail_rate=s.fake_tail_rate,
+            rpm_limit=s.fake_rpm,
+            tpm_limit=s.fake_tpm,
+            char_latency=s.fake_char_latency,
+        ),
+    )
+
+
+def make_backend(s: Settings):
+    from resilience import ResilientBackend
+    from scheduler import FairScheduler, ScheduledBackend
+
+    # The scheduler sits outside the resilience layer: queueing does not eat
+    # into call timeouts, and retries reuse their call's admission.
+    return ScheduledBackend(
+        ResilientBackend(
+            make_model_backend(s),
+            timeout=s.timeout_s,
+            max_retries=s.retries,
+            hedge=s.hedge,
+            hedge_budget=s.hedge_budget,
+            log_path=s.call_log,
+        ),
+        FairScheduler(rpm=s.rpm, tpm=s.tpm, max_concurrent=s.max_concurrent),
+    )
+
+
+def make_generation_cache(s: Settings):
+    from gen_cache import GenerationCache
+
+    return GenerationCache(
+        cache_dir=s.cache_dir,
+        max_items=s.cache_items,
+        max_disk_bytes=s.cache_mb * 1024 * 1024,
+        ttl_seconds=s.cache_ttl_hours * 3600,
+    )
+
+
+def make_prompt_index(s: Settings):
+    from prompt_index import PromptIndex
+
+    return PromptIndex(path=os.path.join(s.cache_dir, "prompts.jsonl") if s.cache_dir else "")
+
+
+def make_job_manager(s: Settings):
+    from jobs import JobManager
+
+    return JobManager(max_workers=s.job_workers)
+
+
+def make_asset_store(s: Settings):
+    from asset_store import AssetStore
+
+    return AssetStore(root=s.asset_dir, max_dim=s.asset_max_dim, max_bytes=s.asset_mb * 1024 * 1024)
+
+
+def make_history(s: Settings):
+    from history import VersionHistory
+
+    return VersionHistory(max_bytes=s.history_mb * 1024 * 1024, max_versions=s.history_versions)
@@ -0,0 +1,109 @@
+"""Incremental handling of streamed model output for progressive previews.
+
+The model streams the page in arbitrary chunks. ``IncrementalHtmlSanitizer``
+keeps the raw text, advances a "safe" cut point whenever a landmark block
+(section/header/nav/main/footer/...) closes, sanitizes only the newly
+completed span and can hand back a renderable, well-closed prefix at any time.
+"""
+
+import re
+import time
+
+# Closing tags that end a visually complete block of the page.
+_BLOCK_CLOSE_RE = re.compile(
+    r"</(?:section|header|nav|main|footer|article|aside|style|head)\s*>", re.I
+)
+_FENCE_OPEN_RE = re.compile(r"^\s*```(?:html)?\s*", re.I)
+
+
+def strip_fences(text: str) -> str:
+    """Model answer with its Markdown code fences removed."""
+    return text.replace("```html", "").replace("```", "").strip()
+
+
+class IncrementalHtmlSanitizer:
+    def __init__(self, fragment_filter=None, repaint_ms: int = 400):
+        """``fragment_filter`` is applied once to each completed span (e.g. link rewriting).
+
+        ``repaint_ms`` is the minimum time between repaints; a repaint is
+        only asked for when another block has completed since the last one.
+        """
+        self.fragment_filter = fragment_filter or (lambda s: s)
+        self.repaint_ms = repaint_ms
+        self._raw = []
+        self._pending = []  # chunks after the safe cut point (fence removed)
+        self._pending_len = 0
+        self._tail = ""  # last few characters, so a closing tag split across chunks is still seen
+        self._head = ""  # start of the text until the opening fence has been checked
+        self._safe_end = 0  # offset into the text up to which output is complete
+        self._painted_end = 0
+        self._sanitized = []
+        self._last_paint = 0.0
+        self._fence_checked = False
+        self.first_chunk_at = None
+        self.first_paint_at = None
+
+    @property
+    def text(self) -> str:
+        """Everything received so far, fence markers included."""
+        return "".join(self._raw)
+
+    def feed(self, chunk: str) -> bool:
+        """Add a chunk; return True when the caller should repaint now."""
+        if not chunk:
+            return False
+        if self.first_chunk_at is None:
+            self.first_chunk_at = time.perf_counter()
+        self._raw.append(chunk)
+
+        if not self._fence_checked:
+            self._head += chunk
+            if len(self._head) < 8:
+                return False
+            m = _FENCE_OPEN_RE.match(self._head)
+            chunk = self._head[m.end():] if m else self._head
+            self._head = ""
+            self._fence_checked = True
+
+        # Only scan the new chunk, plus a tag-length overlap with the previous text.
+        scan = self._tail + chunk
+        offset = len(self._tail)
+        last_end = None
+        for m in _BLOCK_CLOSE_RE.finditer(scan):
+            last_end = m.end() - offset
+        self._tail = scan[-16:]
+        self._pending.append(chunk)
+        self._pending_len += len(chunk)
+
+        if last_end is not None:
+            # last_end is relative to the start of this chunk; the pending text ends with it
+            cut = self._pending_len - len(chunk) + last_end
+            if cut > 0:
+                pending = "".join(self._pending)
+                self._sanitized.append(self.fragment_filter(pending[:cut]))
+                self._safe_end += cut
+                rest = pending[cut:]
+                self._pending = [rest] if rest else []
+                self._pending_len = len(rest)
+
+        if self._safe_end == self._painted_end:
+            return False
+        return (time.perf_counter() - self._last_paint) * 1000 >= self.repaint_ms
+
+    def snapshot(self) -> str:
+        """Sanitized prefix ending on a closed block, wrapped into a complete document."""
+        self._painted_end = self._safe_end
+        self._last_paint = time.perf_counter()
+        if self.first_paint_at is None:
+            self.first_paint_at = self._last_paint
+        body = "".join(self._sanitized)
+        lower = body.lower()
+        if "<html" not in lower:
+            body = f"<html><head></head><body>{body}"
+        elif "<body" not in lower:
+            body += "<body>"
+        return body + "</body></html>"
+
+    def finish(self) -> str:
+        """Full raw text with fences removed, ready for the normal pipeline."""
+        return strip_fences(self.text)
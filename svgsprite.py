@@ -0,0 +1,139 @@
+"""Shared-sprite deduplication for inline SVG.
+
+Generated pages often repeat the same inline ``<svg>`` (edit/delete buttons
+on every list row, star ratings, social icons). ``dedupe_svgs`` fingerprints
+each inline SVG by its viewBox and normalized children, moves every
+repeated one into a single hidden sprite of ``<symbol>`` elements at the
+top of ``<body>``, and replaces each copy with a short
+``<svg ...><use href="#id"/></svg>``. The outer ``<svg>`` keeps its own
+attributes (class, size, fill, aria), so sizing and inherited colors are
+unchanged.
+
+Path data is rounded to ``precision`` decimals on the way (``d`` and
+``points``; paths with arc commands are left alone because their packed
+flags are easy to corrupt).
+
+Content under a ``<use>`` lives in a shadow tree that page CSS and scripts
+cannot select into, so the pass backs off when the page styles or queries
+SVG children (``svg path { ... }``, ``querySelector('... circle')``).
+"""
+
+import re
+import hashlib
+from collections import namedtuple
+
+SpriteStats = namedtuple("SpriteStats", "symbols replaced bytes_before bytes_after skipped")
+
+_SVG_RE = re.compile(r"<svg\b([^>]*)>(.*?)</svg\s*>", re.S | re.I)
+_SKIP_RE = re.compile(r"<(script|style|template|textarea|noscript)\b.*?</\1\s*>|<!--.*?-->", re.S | re.I)
+_BODY_OPEN_RE = re.compile(r"<body\b[^>]*>", re.I)
+_ATTR_RE = re.compile(r"""\s*([^\s=/>"']+)(?:\s*=\s*("[^"]*"|'[^']*'|[^\s>]+))?""")
+_NUM_ATTR_RE = re.compile(r"""(\s(?:d|points)\s*=\s*)(["'])(.*?)\2""", re.S | re.I)
+_NUMBER_RE = re.compile(r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+_SVG_CHILD_TAGS = r"(?:path|circle|rect|ellipse|line|polyline|polygon|g|use|stop|symbol)"
+_STYLE_REACH_RE = re.compile(rf"(?:^|[\s>,}}])(?:svg\s*>?\s*)?{_SVG_CHILD_TAGS}\s*[{{,:.\[]", re.I)
+_QUERY_REACH_RE = re.compile(
+    rf"""(?:querySelector(?:All)?|getElementsByTagName|closest|matches)\(\s*['"][^'"\n]*\b{_SVG_CHILD_TAGS}\b""", re.I
+)
+_SPRITE_STYLE = "position:absolute;width:0;height:0;overflow:hidden"
+
+
+def round_numbers(data: str, precision: int = 2) -> str:
+    """Round every decimal in path/points data to ``precision`` places."""
+
+    def repl(m):
+        s = m.group(0)
+        if "." not in s or "e" in s.lower() or len(s.split(".", 1)[1]) <= precision:
+            return s
+        out = f"{round(float(s), precision):.{precision}f}".rstrip("0").rstrip(".")
+        if out.startswith("0.") or out.startswith("-0."):
+            out = out.replace("0.", ".", 1)
+        if "." not in out and data[m.end():m.end() + 1] == ".":
+            out += " "  # "1.999.5" -> "2 .5", not "2.5"
+        return out
+
+    return _NUMBER_RE.sub(repl, data)
+
+
+def _round_attrs(markup: str, precision: int) -> str:
+    def repl(m):
+        value = m.group(3)
+        if re.search(r"[aA]", value) and m.group(1).strip().lower().startswith("d"):
+            return m.group(0)
+        return f"{m.group(1)}{m.group(2)}{round_numbers(value, precision)}{m.group(2)}"
+
+    return _NUM_ATTR_RE.sub(repl, markup)
+
+
+def _view_box(attrs: str):
+    keep = []
+    for m in _ATTR_RE.finditer(attrs):
+        if m.group(1).lower() in ("viewbox", "preserveaspectratio") and m.group(2):
+            keep.append(f"{m.group(1)}={m.group(2)}")
+    return " ".join(keep)
+
+
+def _styles_reach_inside(html: str, extra_css=()) -> bool:
+    """True if the page's inline styles/scripts, or any stylesheet in ``extra_css``, select SVG children."""
+    for css in extra_css:
+        if _STYLE_REACH_RE.search(re.sub(r"/\*.*?\*/", "", css or "", flags=re.S)):
+            return True
+    for m in re.finditer(r"<(style|script)\b[^>]*>(.*?)</\1\s*>", html, re.S | re.I):
+        text = re.sub(r"/\*.*?\*/", "", m.group(2), flags=re.S)
+        if m.group(1).lower() == "style" and _STYLE_REACH_RE.search(text):
+            return True
+        if m.group(1).lower() == "script" and _QUERY_REACH_RE.search(text):
+            return True
+    return False
+
+
+def dedupe_svgs(
+    html: str, min_count: int = 2, min_chars: int = 80, precision: int = 2, prefix: str = "gw-s-", extra_css=()
+):
+    """Return (html, SpriteStats); repeated inline SVGs become ``<use>`` references to one sprite.
+
+    ``extra_css`` holds the texts of external stylesheets the page loads; like
+    inline ``<style>``, a rule in them that reaches inside an SVG skips the pass.
+    """
+    html = html or ""
+    before = len(html.encode("utf-8"))
+    if "<svg" not in html.lower():
+        return html, SpriteStats(0, 0, before, before, "")
+    if _styles_reach_inside(html, extra_css):
+        return html, SpriteStats(0, 0, before, before, "page CSS or scripts select SVG children")
+
+    skipped = [m.span() for m in _SKIP_RE.finditer(html)]
+    found = []  # (start, end, attrs, key)
+    groups = {}
+    for m in _SVG_RE.finditer(html):
+        inner = m.group(2)
+        if any(a <= m.start() < b for a, b in skipped) or "<svg" in inner.lower() or "<use" in inner.lower():
+            continue
+        inner = _round_attrs(re.sub(r">\s+<", "><", inner.strip()), precision)
+        key = (_view_box(m.group(1)), inner)
+        found.append((m.start(), m.end(), m.group(1), key))
+        groups[key] = groups.get(key, 0) + 1
+
+    repeated = {k for k, n in groups.items() if n >= min_count and len(k[1]) >= min_chars}
+    ids, symbols, out, pos, replaced = {}, [], [], 0, 0
+    for start, end, attrs, key in found:
+        out.append(html[pos:start])
+        pos = end
+        if key in repeated:
+            if key not in ids:
+                ids[key] = prefix + hashlib.sha1(repr(key).encode("utf-8")).hexdigest()[:8]
+                view_box = f" {key[0]}" if key[0] else ""
+                symbols.append(f'<symbol id="{ids[key]}"{view_box}>{key[1]}</symbol>')
+            out.append(f'<svg{attrs}><use href="#{ids[key]}"/></svg>')
+            replaced += 1
+        else:
+            out.append(_round_attrs(html[start:end], precision))
+    out.append(html[pos:])
+    result = "".join(out)
+
+    if symbols:
+        sprite = f'<svg xmlns="http://www.w3.org/2000/svg" aria-hidden="true" style="{_SPRITE_STYLE}">{"".join(symbols)}</svg>'
+        body = _BODY_OPEN_RE.search(result)
+        at = body.end() if body else 0
+        result = result[:at] + sprite + result[at:]
+    return result, SpriteStats(len(symbols), replaced, before, len(result.encode("utf-8")), "")
@@ -0,0 +1,188 @@
+"""Data-driven theme registry and one-pass prompt classifier.
+
+Themes, palettes, SVG motifs and trigger keywords live in themes.json. They
+are loaded once and compiled into a single word-boundary-aware regex, so a
+prompt is classified in one scan. Keywords ending in ``*`` match as word
+prefixes ("tech*" matches "technology"), all others match whole words only
+("ai" no longer matches "maintain"). Theme CSS and SVG strings are built once
+per theme.
+"""
+
+import os
+import re
+import json
+from functools import lru_cache
+from collections import namedtuple
+
+REGISTRY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "themes.json")
+
+Theme = namedtuple("Theme", "name palette svg keywords negative")
+PromptMatch = namedtuple("PromptMatch", "theme visual wants_sparkles hates_sparkles")
+
+
+class ThemeRegistry:
+    def __init__(self, data: dict):
+        self.themes = [
+            Theme(t["name"], t["palette"], t["svg"], t.get("keywords", []), t.get("negative", []))
+            for t in data["themes"]
+        ]
+        d = data["default"]
+        self.default = Theme(d["name"], d["palette"], d["svg"], [], [])
+        self.by_name = {t.name: t for t in self.themes}
+        self.by_name[self.default.name] = self.default
+        self._rank = {t.name: i for i, t in enumerate(self.themes)}
+
+        # keyword -> list of (kind, owner); one keyword may serve several owners
+        owners = {}
+        for t in self.themes:
+            for kw in t.keywords:
+                owners.setdefault(kw.lower(), []).append(("theme", t.name))
+            for kw in t.negative:
+                owners.setdefault(kw.lower(), []).append(("negative", t.name))
+        for intent, kws in data.get("intents", {}).items():
+            for kw in kws:
+                owners.setdefault(kw.lower(), []).append(("intent", intent))
+
+        # Longest keywords first so phrases win over their own words.
+        keywords = sorted(owners, key=len, reverse=True)
+        self._owners = [owners[k] for k in keywords]
+        alts = [f"(?P<k{i}>{_keyword_pattern(k)})" for i, k in enumerate(keywords)]
+        self._matcher = re.compile(r"(?<!\w)(?:" + "|".join(alts) + ")", re.I)
+
+    def classify(self, text: str) -> PromptMatch:
+        hits_theme, hits_negative, intents = set(), set(), set()
+        for m in self._matcher.finditer(text or ""):
+            for kind, owner in self._owners[int(m.lastgroup[1:])]:
+                if kind == "theme":
+                    hits_theme.add(owner)
+                elif kind == "negative":
+                    hits_negative.add(owner)
+                else:
+                    intents.add(owner)
+        candidates = sorted(hits_theme - hits_negative, key=self._rank.__getitem__)
+        theme = self.by_name[candidates[0]] if candidates else self.default
+        return PromptMatch(
+            theme,
+            "visual" in intents,
+            "sparkles_on" in intents,
+            "sparkles_off" in intents,
+        )
+
+
+def _keyword_pattern(kw: str) -> str:
+    prefix = kw.endswith("*")
+    words = kw.rstrip("*").split()
+    body = r"\s+".join(re.escape(w) for w in words)
+    return body + (r"\w*" if prefix else r"(?!\w)")
+
+
+@lru_cache(maxsize=None)
+def load_registry(path: str = REGISTRY_PATH) -> ThemeRegistry:
+    with open(path, "r", encoding="utf-8") as f:
+        return ThemeRegistry(json.load(f))
+
+
+@lru_cache(maxsize=512)
+def classify_prompt(prompt_text: str) -> PromptMatch:
+    return load_registry().classify(prompt_text or "")
+
+
+# ------------------ public helpers (used by app.py / page_engine.py) ------------------
+def theme_palette(prompt_text: str) -> dict:
+    return dict(classify_prompt(prompt_text).theme.palette)
+
+
+def detect_visual_intent(text: str) -> bool:
+    if not text:
+        return False
+    return classify_prompt(text).visual
+
+
+def sparkle_intent(prompt_text: str):
+    """Return (user_hates_sparkles, user_wants_sparkles) for a prompt."""
+    m = classify_prompt(prompt_text)
+    return m.hates_sparkles, m.wants_sparkles
+
+
+def build_theme_css(p: dict) -> str:
+    return f"""
+<style>
+:root {{
+  --bg: {p['bg']};
+  --bg2: {p['bg2']};
+  --text: {p['text']};
+  --muted: {p['muted']};
+  --primary: {p['primary']};
+  --accent: {p['accent']};
+  --border: {p['border']};
+}}
+html, body {{
+  background: radial-gradient(1200px 700px at 20% 0%, var(--bg2), var(--bg));
+  color: var(--text);
+}}
+section, .card, .panel, .feature {{
+  background: rgba(255,255,255,0.6);
+  backdrop-filter: blur(6px);
+  border: 1px solid var(--border);
+  border-radius: 14px;
+  padding: 1.25rem; margin: .75rem 0;
+}}
+#hero {{
+  min-height: 70vh; display: flex; align-items: center; justify-content: center;
+  position: relative; overflow: hidden;
+}}
+h1, h2, h3 {{ color: var(--text); letter-spacing: .3px; text-shadow: 0 1px 0 rgba(255,255,255,.25); }}
+a, .link {{ color: var(--primary); text-decoration: none; }}
+a:hover {{ opacity: .9; }}
+button, .btn, .cta, input[type="submit"] {{
+  display: inline-block; padding: .75rem 1.1rem; border-radius: 12px;
+  border: 1px solid var(--border);
+  background: linear-gradient(180deg, var(--primary), var(--accent));
+  color: #0d0f12; font-weight: 600; cursor: pointer;
+  transition: transform .08s ease, box-shadow .18s ease;
+  box-shadow: 0 6px 20px rgba(0,0,0,.12);
+}}
+button:hover, .btn:hover, .cta:hover, input[type="submit"]:hover {{ transform: translateY(-2px); }}
+nav a {{ padding: .35rem .6rem; border-radius: 8px; }}
+hr {{ border: 0; height: 1px; background: linear-gradient(90deg, transparent, var(--border), transparent); }}
+</style>
+"""
+
+
+def build_theme_svg(svg: dict) -> str:
+    color1, color2, shape = svg["color1"], svg["color2"], svg["motif"]
+    return f"""
+<svg id="theme-art" viewBox="0 0 220 220" width="240" height="240"
+     style="position:absolute;top:-10px;left:-10px;opacity:.15;z-index:0;pointer-events:none;">
+  <defs>
+    <linearGradient id="grad1" x1="0" y1="0" x2="1" y2="1">
+      <stop offset="0" stop-color="{color1}"/><stop offset="1" stop-color="{color2}"/>
+    </linearGradient>
+  </defs>
+  <g fill="url(#grad1)" stroke="{color2}" stroke-width="0.6">
+    <path d="M40,110 C60,80 90,70 120,70 C145,70 170,80 185,95
+             C130,125 90,150 55,170 C35,150 25,130 40,110 Z"/>
+    <text x="12" y="205" font-size="10" fill="{color2}" opacity=".6">{shape}</text>
+  </g>
+</svg>
+"""
+
+
+@lru_cache(maxsize=None)
+def theme_css_for(name: str) -> str:
+    return build_theme_css(load_registry().by_name[name].palette)
+
+
+@lru_cache(maxsize=None)
+def theme_svg_for(name: str) -> str:
+    return build_theme_svg(load_registry().by_name[name].svg)
+
+
+def theme_aware_svg(prompt_text: str) -> str:
+    return theme_svg_for(classify_prompt(prompt_text).theme.name)
+
+
+def theme_assets(prompt_text: str):
+    """(css, svg) for the prompt's theme; both are memoized per theme."""
+    name = classify_prompt(prompt_text).theme.name
+    return theme_css_for(name), theme_svg_for(name)
@@ -0,0 +1,63 @@
+"""Concurrent multi-variant generation.
+
+``iter_variants`` sends N model calls through a bounded thread pool. Each
+call uses a slightly different temperature/top_p. Each result is
+post-processed in its worker and yielded as soon as it is ready, so the
+caller can fill a gallery while slower calls are still running.
+"""
+
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from metrics import propagate
+
+Variant = namedtuple("Variant", "index config raw html error seconds")
+
+
+def variant_configs(n: int, base_temperature: float = 0.8, spread: float = 0.3) -> list:
+    """N generation configs spread evenly around ``base_temperature``."""
+    if n <= 1:
+        return [{"temperature": base_temperature}]
+    configs = []
+    for i in range(n):
+        offset = -spread / 2 + spread * i / (n - 1)
+        temp = round(min(2.0, max(0.0, base_temperature + offset)), 2)
+        top_p = 0.95 if i % 2 else 0.9
+        configs.append({"temperature": temp, "top_p": top_p})
+    return configs
+
+
+def iter_variants(generate, req: str, configs, postprocess=None, max_workers: int = 4):
+    """Yield ``Variant`` tuples in completion order.
+
+    ``generate(req, config) -> str`` must be thread-safe; ``postprocess(raw) -> str``
+    runs inside the worker so results arrive ready to display.
+    """
+
+    def one(i, cfg):
+        t0 = time.perf_counter()
+        try:
+            raw = generate(req, cfg)
+            html = postprocess(raw) if postprocess else raw
+            return Variant(i, cfg, raw, html, None, time.perf_counter() - t0)
+        except Exception as e:
+            return Variant(i, cfg, "", "", str(e), time.perf_counter() - t0)
+
+    workers = max(1, min(max_workers, len(configs)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="variant") as pool:
+        futures = [pool.submit(propagate(one), i, cfg) for i, cfg in enumerate(configs)]
+        for fut in as_completed(futures):
+            yield fut.result()
+
+
+def thumbnail_html(page_html: str, scale: float = 0.3, page_width: int = 1280, height: int = 260) -> str:
+    """Wrap a page in a scaled-down frame for gallery thumbnails."""
+    return f"""
+<div style="width:{int(page_width * scale)}px;height:{height}px;overflow:hidden;border-radius:10px;
+            border:1px solid rgba(120,130,150,.35);background:#fff;">
+  <div style="width:{page_width}px;transform:scale({scale});transform-origin:0 0;pointer-events:none;">
+    {page_html}
+  </div>
+</div>
+"""
@@ -0,0 +1,502 @@
+"""Load-performance pass for generated pages (opt-in).
+
+``optimize_page`` runs after post-processing and rewrites a page so it
+renders sooner:
+
+- external classic scripts get ``defer`` when nothing later on the page runs
+  synchronously against them (known libraries are matched by their globals;
+  anything else only when no later inline code exists at all);
+- non-critical stylesheets (web fonts, icon sets) load without blocking;
+  a local stylesheet passed in ``css_files`` is split into critical rules,
+  inlined, and the full file is loaded after first paint;
+- images get ``loading="lazy"`` / ``decoding="async"`` below the fold,
+  ``width``/``height`` when the size can be read from the data, and the first
+  above-the-fold image (or the hero background) is preloaded;
+- repeated inline SVGs are moved into one ``<symbol>`` sprite (svgsprite.py);
+- inline CSS, JS and the HTML itself are minified conservatively.
+
+Every change is listed in the returned ``PerfReport`` next to a before/after
+audit (bytes, gzip bytes, render-blocking resources).
+"""
+
+import re
+import base64
+import struct
+from collections import namedtuple
+
+from page_engine import INTERCEPTOR_JS, SPARKLES_SNIPPET
+from svgsprite import dedupe_svgs
+
+PageAudit = namedtuple("PageAudit", "bytes gzip_bytes blocking images unsized_images")
+PerfReport = namedtuple("PerfReport", "before after changes")
+
+_SCRIPT_RE = re.compile(r"<script\b([^>]*)>(.*?)</script\s*>", re.S | re.I)
+_LINK_RE = re.compile(r"<link\b([^>]*?)/?>", re.I)
+_IMG_RE = re.compile(r"<img\b([^>]*?)(/?)>", re.I)
+_ATTR_RE = re.compile(r"""([^\s=/>"']+)(?:\s*=\s*("[^"]*"|'[^']*'|[^\s>]+))?""")
+_HEAD_END_RE = re.compile(r"</head\s*>|<body\b", re.I)
+_HERO_OPEN_RE = re.compile(r"""<(\w+)[^>]*\bid=["']hero["'][^>]*>""", re.I)
+_HERO_BG_RE = re.compile(r"""#hero\s*\{[^}]*?url\(\s*['"]?([^'")]+)['"]?\s*\)""", re.I)
+_FOLD_FALLBACK_RE = re.compile(r"</(?:section|header)\s*>", re.I)
+_NOSCRIPT_RE = re.compile(r"<noscript\b.*?</noscript\s*>", re.S | re.I)
+_PROTECTED_RE = re.compile(
+    r"<(script|style|pre|textarea)\b([^>]*)>(.*?)</\1\s*>|<!--(.*?)-->", re.S | re.I
+)
+
+_JS_TYPES = ("", "text/javascript", "application/javascript")
+# globals a later inline script would use if it depends on the library
+_LIBRARY_GLOBALS = {
+    "jquery": ("jQuery", "$(", "$."),
+    "bootstrap": ("bootstrap.", "jQuery", "$("),
+    "gsap": ("gsap", "ScrollTrigger"),
+    "alpine": ("Alpine",),
+    "chart": ("Chart",),
+}
+# scripts that must stay blocking: the Tailwind Play CDN styles the page at runtime
+_KEEP_BLOCKING = ("cdn.tailwindcss.com",)
+_ASYNC_STYLE_HINTS = ("fonts.googleapis.com", "font-awesome", "fontawesome", "icons", "animate")
+_KEEP_COMMENTS = ("[if", "keep:", "section:", "/section", "applied:", "gw:", "/gw:")
+
+
+# ------------------ small helpers ------------------
+def _attrs(text: str) -> dict:
+    out = {}
+    for m in _ATTR_RE.finditer(text or ""):
+        v = m.group(2)
+        if v is not None and v[:1] in "\"'":
+            v = v[1:-1]
+        out.setdefault(m.group(1).lower(), v)  # like browsers, the first duplicate wins
+    return out
+
+
+def _head_end(html: str) -> int:
+    m = _HEAD_END_RE.search(html)
+    return m.start() if m else 0
+
+
+def _insert_in_head(html: str, snippet: str) -> str:
+    m = re.search(r"</head\s*>", html, re.I)
+    if m:
+        return html[:m.start()] + snippet + html[m.start():]
+    m = re.search(r"<body\b", html, re.I)
+    at = m.start() if m else 0
+    return html[:at] + snippet + html[at:]
+
+
+def _is_injected(code: str) -> bool:
+    code = code.strip()
+    return bool(code) and (code in INTERCEPTOR_JS or code in SPARKLES_SNIPPET)
+
+
+def _fold_end(html: str) -> int:
+    """End of the first screen: the hero element, else the first section/header."""
+    m = _HERO_OPEN_RE.search(html)
+    if m:
+        close = re.search(rf"</{m.group(1)}\s*>", html[m.end():], re.I)
+        return m.end() + close.end() if close else len(html)
+    body = re.search(r"<body\b", html, re.I)
+    m = _FOLD_FALLBACK_RE.search(html, body.end() if body else 0)
+    return m.end() if m else len(html)
+
+
+# ------------------ image sizes ------------------
+def image_dimensions(data: bytes):
+    """(width, height) from a PNG/GIF/JPEG/WebP header, or None."""
+    if not data or len(data) < 24:
+        return None
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return struct.unpack(">II", data[16:24])
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return struct.unpack("<HH", data[6:10])
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP" and len(data) >= 30:
+        chunk = data[12:16]
+        if chunk == b"VP8 ":
+            w, h = struct.unpack("<HH", data[26:30])
+            return w & 0x3FFF, h & 0x3FFF
+        if chunk == b"VP8L":
+            bits = int.from_bytes(data[21:25], "little")
+            return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+        if chunk == b"VP8X":
+            return int.from_bytes(data[24:27], "little") + 1, int.from_bytes(data[27:30], "little") + 1
+        return None
+    if data[:2] == b"\xff\xd8":
+        i = 2
+        while i + 9 < len(data):
+            if data[i] != 0xFF:
+                i += 1
+                continue
+            marker = data[i + 1]
+            if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+                i += 2
+                continue
+            (length,) = struct.unpack(">H", data[i + 2:i + 4])
+            if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                h, w = struct.unpack(">HH", data[i + 5:i + 9])
+                return w, h
+            i += 2 + length
+    return None
+
+
+def _data_url_dimensions(src: str):
+    if not src.startswith("data:image/") or ";base64," not in src[:64]:
+        return None
+    payload = src.split(",", 1)[1][:88000]  # JPEG size markers sit near the start
+    payload = payload[: len(payload) // 4 * 4]
+    try:
+        return image_dimensions(base64.b64decode(payload))
+    except ValueError:
+        return None
+
+
+# ------------------ audit ------------------
+def render_blocking(html: str) -> list:
+    """URLs of stylesheets and head scripts that hold up first paint."""
+    html = html or ""
+    found = []
+    head_end = _head_end(html)
+    for m in _SCRIPT_RE.finditer(html, 0, head_end):
+        a = _attrs(m.group(1))
+        if a.get("src") and (a.get("type") or "").lower() in _JS_TYPES and not (
+            "async" in a or "defer" in a
+        ):
+            found.append(a["src"])
+    for m in _LINK_RE.finditer(_NOSCRIPT_RE.sub("", html)):
+        a = _attrs(m.group(1))
+        rel = (a.get("rel") or "").lower().split()
+        media = (a.get("media") or "all").lower()
+        if "stylesheet" in rel and a.get("href") and media in ("all", "screen") and "disabled" not in a:
+            found.append(a["href"])
+    return found
+
+
+def audit(html: str) -> PageAudit:
+    import gzip
+
+    html = html or ""
+    raw = html.encode("utf-8")
+    images = unsized = 0
+    for m in _IMG_RE.finditer(html):
+        images += 1
+        a = _attrs(m.group(1))
+        if not (a.get("width") and a.get("height")):
+            unsized += 1
+    return PageAudit(len(raw), len(gzip.compress(raw, 6, mtime=0)), tuple(render_blocking(html)), images, unsized)
+
+
+# ------------------ passes ------------------
+def _defer_scripts(html: str, changes: list) -> str:
+    scripts = list(_SCRIPT_RE.finditer(html))
+    later_sync = []  # synchronous scripts after the current one: ("inline", code) / ("external", src)
+    edits = {}
+    for m in reversed(scripts):
+        a = _attrs(m.group(1))
+        if (a.get("type") or "").lower() not in _JS_TYPES:
+            continue  # modules are deferred already; JSON and templates never run
+        src = a.get("src")
+        if not src:
+            if not _is_injected(m.group(2)):
+                later_sync.append(("inline", m.group(2)))
+            continue
+        if "async" in a or "defer" in a:
+            continue
+        lowered = src.lower()
+        if any(k in lowered for k in _KEEP_BLOCKING):
+            continue  # stays blocking, but depends on nothing earlier
+        globals_ = next((g for lib, g in _LIBRARY_GLOBALS.items() if lib in lowered), None)
+        depends = False
+        for kind, code in later_sync:
+            if kind == "external" or globals_ is None or any(g in code for g in globals_):
+                depends = True
+                break
+        if depends:
+            later_sync.append(("external", src))
+            continue
+        edits[m.start()] = m.group(0).replace("<script", "<script defer", 1)
+        changes.append(f"deferred script {src}")
+    if not edits:
+        return html
+    out, pos = [], 0
+    for m in scripts:
+        if m.start() in edits:
+            out.append(html[pos:m.start()])
+            out.append(edits[m.start()])
+            pos = m.end()
+    out.append(html[pos:])
+    return "".join(out)
+
+
+def _load_styles(html: str, css_files: dict, changes: list) -> str:
+    fold_html = html[: _fold_end(html)]
+    fallbacks = [m.span() for m in _NOSCRIPT_RE.finditer(html)]
+
+    def repl(m):
+        if any(a <= m.start() < b for a, b in fallbacks):
+            return m.group(0)
+        a = _attrs(m.group(1))
+        rel = (a.get("rel") or "").lower().split()
+        href = a.get("href") or ""
+        if "stylesheet" not in rel or not href or (a.get("media") or "all").lower() not in ("all", "screen"):
+            return m.group(0)
+        if href in css_files:
+            critical = critical_css(css_files[href], fold_html)
+            changes.append(f"inlined {len(critical):,} B of critical CSS, deferred {href}")
+            return (
+                (f"<style>{critical}</style>" if critical else "")
+                + f'<link rel="preload" href="{href}" as="style" onload="this.onload=null;this.rel=\'stylesheet\'">'
+                + f'<noscript><link rel="stylesheet" href="{href}"></noscript>'
+            )
+        if any(h in href.lower() for h in _ASYNC_STYLE_HINTS):
+            changes.append(f"non-blocking stylesheet {href}")
+            tag = m.group(0)
+            return (
+                tag.replace("<link", "<link media=\"print\" onload=\"this.media='all'\"", 1)
+                + f"<noscript>{tag}</noscript>"
+            )
+        return m.group(0)
+
+    return _LINK_RE.sub(repl, html)
+
+
+def _preconnect(html: str, changes: list) -> str:
+    origins = []
+    for url in render_blocking(html) + [_attrs(m.group(1)).get("src") or "" for m in _SCRIPT_RE.finditer(html)]:
+        m = re.match(r"(?:https?:)?//[^/\"']+", url)
+        if m and m.group(0) not in origins:
+            origins.append(m.group(0))
+    origins = [o for o in origins[:3] if f'rel="preconnect" href="{o}"' not in html]
+    if not origins:
+        return html
+    hints = "".join(f'<link rel="preconnect" href="{o}" crossorigin>' for o in origins)
+    changes.append(f"preconnect to {', '.join(origins)}")
+    head = re.search(r"<head\b[^>]*>", html, re.I)
+    if head:
+        return html[:head.end()] + hints + html[head.end():]
+    return _insert_in_head(html, hints)
+
+
+def _tune_images(html: str, size_of, changes: list) -> str:
+    fold = _fold_end(html)
+    body = re.search(r"<body\b", html, re.I)
+    body_start = body.end() if body else 0
+    hero = {"src": None}
+    counts = {"lazy": 0, "sized": 0}
+
+    def repl(m):
+        a = _attrs(m.group(1))
+        src = a.get("src") or ""
+        tag = m.group(0)
+        add = []
+        if not (a.get("width") or a.get("height")):
+            dims = _data_url_dimensions(src) or (size_of(src) if size_of and src else None)
+            if dims:
+                add.append(f'width="{dims[0]}" height="{dims[1]}"')
+                counts["sized"] += 1
+        if body_start <= m.start() < fold and hero["src"] is None:
+            hero["src"] = src
+            tag = re.sub(r"""\s+loading=["']?lazy["']?""", "", tag, flags=re.I)
+            if "fetchpriority" not in a:
+                add.append('fetchpriority="high"')
+        elif m.start() >= fold:
+            if "loading" not in a:
+                add.append('loading="lazy"')
+                counts["lazy"] += 1
+            if "decoding" not in a:
+                add.append('decoding="async"')
+        if not add:
+            return tag
+        return tag.replace("<img", "<img " + " ".join(add), 1)
+
+    out = _IMG_RE.sub(repl, html)
+    if counts["lazy"]:
+        changes.append(f"lazy-loaded {counts['lazy']} below-the-fold image(s)")
+    if counts["sized"]:
+        changes.append(f"added width/height to {counts['sized']} image(s)")
+
+    target = hero["src"]
+    if not target:
+        m = _HERO_BG_RE.search(out)
+        target = m.group(1) if m else None
+    if target and not target.startswith(("data:", "asset://")) and f'rel="preload" as="image" href="{target}"' not in out:
+        out = _insert_in_head(out, f'<link rel="preload" as="image" href="{target}" fetchpriority="high">')
+        changes.append(f"preloaded hero image {target[:80]}")
+    return out
+
+
+# ------------------ critical CSS ------------------
+def _prelude(text: str) -> str:
+    return re.sub(r"/\*.*?\*/", "", text, flags=re.S).strip()
+
+
+def _css_blocks(css: str):
+    """Top-level (prelude, body) pairs; body is None for statements like @import."""
+    i, n, start = 0, len(css), 0
+    while i < n:
+        c = css[i]
+        if c in "\"'":
+            j = css.find(c, i + 1)
+            i = n if j < 0 else j + 1
+            continue
+        if css.startswith("/*", i):
+            j = css.find("*/", i + 2)
+            i = n if j < 0 else j + 2
+            continue
+        if c == ";":
+            yield _prelude(css[start:i]), None
+            start = i = i + 1
+            continue
+        if c == "{":
+            depth, j = 1, i + 1
+            while j < n and depth:
+                if css[j] in "\"'":
+                    k = css.find(css[j], j + 1)
+                    j = n if k < 0 else k + 1
+                    continue
+                depth += {"{": 1, "}": -1}.get(css[j], 0)
+                j += 1
+            yield _prelude(css[start:i]), css[i + 1:j - 1]
+            start = i = j
+            continue
+        i += 1
+
+
+_SIMPLE_RE = re.compile(r"([#.]?)(-?[_a-zA-Z][\w-]*)")
+
+
+def _selector_matches(selector: str, tags, ids, classes) -> bool:
+    subject = re.split(r"[\s>+~]+", re.sub(r"\([^)]*\)|\[[^\]]*\]|::?[\w-]+", "", selector).strip())[-1]
+    if not subject or subject in ("*", "html", "body", ":root"):
+        return True
+    for kind, name in _SIMPLE_RE.findall(subject):
+        pool = ids if kind == "#" else classes if kind == "." else tags
+        if name.lower() not in pool:
+            return False
+    return True
+
+
+def critical_css(css: str, fold_html: str) -> str:
+    """Rules of ``css`` that can apply to elements in ``fold_html`` (plus @font-face / @import)."""
+    tags = {t.lower() for t in re.findall(r"<([a-zA-Z][\w-]*)", fold_html)} | {"html", "body"}
+    ids = {v.lower() for v in re.findall(r"""\bid=["']([^"']+)["']""", fold_html)}
+    classes = {c.lower() for v in re.findall(r"""\bclass=["']([^"']+)["']""", fold_html) for c in v.split()}
+
+    def pick(text):
+        out = []
+        for prelude, body in _css_blocks(text):
+            lower = prelude.lower()
+            if body is None:
+                if lower.startswith(("@import", "@charset")):
+                    out.append(prelude + ";")
+            elif lower.startswith(("@media", "@supports", "@layer")):
+                inner = pick(body)
+                if inner:
+                    out.append(f"{prelude}{{{inner}}}")
+            elif lower.startswith(("@font-face", "@property")) or lower == ":root":
+                out.append(f"{prelude}{{{body}}}")
+            elif not lower.startswith("@") and any(
+                _selector_matches(s, tags, ids, classes) for s in prelude.split(",")
+            ):
+                out.append(f"{prelude}{{{body}}}")
+        return "".join(out)
+
+    return minify_css(pick(css or ""))
+
+
+# ------------------ minification ------------------
+_CSS_TOKEN_RE = re.compile(r"""("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')|/\*.*?\*/|\s*([{};,>])\s*|(:)\s+|(\s+)""", re.S)
+
+
+def minify_css(css: str) -> str:
+    def repl(m):
+        if m.group(1):
+            return m.group(1)
+        if m.group(2):
+            return m.group(2)
+        if m.group(3):
+            return ":"
+        if m.group(4):
+            return " "
+        return ""  # comment
+
+    return _CSS_TOKEN_RE.sub(repl, css or "").replace(";}", "}").strip()
+
+
+def minify_js(js: str) -> str:
+    """Drop indentation, blank lines and whole-line // comments; lines are never joined."""
+    if "`" in js or re.search(r"\\\s*$", js, re.M):
+        return js.strip()  # template literals / continued strings: whitespace may be content
+    lines = []
+    for line in js.splitlines():
+        line = line.strip()
+        if line and not line.startswith("//"):
+            lines.append(line)
+    return "\n".join(lines)
+
+
+def minify_html(html: str) -> str:
+    """Collapse whitespace between tags, drop comments, minify inline CSS/JS."""
+    out, pos = [], 0
+
+    def text(s):
+        s = re.sub(r"[ \t]*\n\s*", "\n", s)
+        return re.sub(r"[ \t]{2,}", " ", s)
+
+    for m in _PROTECTED_RE.finditer(html):
+        out.append(text(html[pos:m.start()]))
+        pos = m.end()
+        if m.group(4) is not None:
+            if m.group(4).lstrip().startswith(_KEEP_COMMENTS):
+                out.append(m.group(0))
+            continue
+        tag, attrs, inner = m.group(1).lower(), m.group(2), m.group(3)
+        if tag == "style":
+            inner = minify_css(inner)
+        elif tag == "script" and (_attrs(attrs).get("type") or "").lower() in _JS_TYPES + ("module",):
+            inner = minify_js(inner)
+        else:
+            out.append(m.group(0))
+            continue
+        out.append(f"<{m.group(1)}{attrs}>{inner}</{m.group(1)}>")
+    out.append(text(html[pos:]))
+    return "".join(out).strip()
+
+
+# ------------------ entry point ------------------
+def optimize_page(html: str, css_files=None, size_of=None, minify: bool = True, sprite: bool = True):
+    """Return (optimized html, PerfReport).
+
+    ``css_files`` maps stylesheet hrefs on the page to their text (e.g. the
+    exported styles.css) so their critical rules can be inlined; ``size_of``
+    may return (width, height) for image sources that are not data URLs.
+    """
+    html = html or ""
+    before = audit(html)
+    changes = []
+    out = _defer_scripts(html, changes)
+    out = _load_styles(out, css_files or {}, changes)
+    out = _tune_images(out, size_of, changes)
+    out = _preconnect(out, changes)
+    if sprite:
+        out, stats = dedupe_svgs(out, extra_css=list((css_files or {}).values()))
+        if stats.replaced:
+            changes.append(
+                f"moved {stats.replaced} repeated SVG(s) into {stats.symbols} sprite symbol(s) "
+                f"({stats.bytes_before - stats.bytes_after:+,} B)"
+            )
+        elif stats.skipped:
+            changes.append(f"SVG sprite skipped: {stats.skipped}")
+    if minify:
+        out = minify_html(out)
+        changes.append("minified HTML and inline CSS/JS")
+    return out, PerfReport(before, audit(out), changes)
+
+
+def format_report(report: PerfReport) -> str:
+    b, a = report.before, report.after
+    lines = [
+        f"Size: {b.bytes:,} → {a.bytes:,} B ({a.bytes - b.bytes:+,}); gzip {b.gzip_bytes:,} → {a.gzip_bytes:,} B",
+        f"Render-blocking resources: {len(b.blocking)} → {len(a.blocking)}",
+        f"Images without width/height: {b.unsized_images} → {a.unsized_images} of {a.images}",
+    ]
+    lines += [f"  still blocking: {url}" for url in a.blocking]
+    lines += [f"- {c}" for c in report.changes]
+    return "\n".join(lines)